@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks the index generators against a generated L{fake_redmine} instance.
+
+Each scenario runs in its own process and reports wall time, the number of
+HTTP requests seen by the server, the bytes it sent and the peak resident
+memory of the generator process.
+
+Example::
+
+    python benchmark.py --projects 10000 --pages 200000 --latency 0.01 --workers 1 8 32
+"""
+
+#---
+#--- Python
+import sys
+import time
+import json
+import urllib2
+import argparse
+import resource
+import multiprocessing
+
+#---
+#--- 3rd party
+from redmine import Redmine
+
+#---
+#--- Local
+import fake_redmine
+from wiki_crawl import BACKENDS, createBackend
+
+#---
+def runGlobal(redmineHandle, args, workers) :
+    from overall_index import iterGlobaleIndexLines
+    lineCount = 0
+    backend = createBackend(args.backend, redmineHandle, workers)
+    for line in iterGlobaleIndexLines(redmineHandle, workers = workers, backend = backend) :
+        lineCount += 1
+    return lineCount
+
+def runTopic(redmineHandle, args, workers) :
+    from topic_index import iterTopicEntries
+    entryCount = 0
+    backend = createBackend(args.backend, redmineHandle, workers)
+    for entry in iterTopicEntries(redmineHandle, args.topic, workers = workers, noAuthor = args.noauthor,
+                                  backend = backend) :
+        entryCount += 1
+    return entryCount
+
+SCENARIOS = {'global' : runGlobal,
+             'topic' : runTopic}
+
+#---
+def _serverRequest(url, path, data = None) :
+    return json.loads(urllib2.urlopen(url + path, data).read())
+
+def _runScenario(url, args, scenario, workers, resultQueue) :
+    redmineHandle = Redmine(url, key = 'benchmark')
+    _serverRequest(url, '/_reset', '')
+    startTime = time.time()
+    outputCount = SCENARIOS[scenario](redmineHandle, args, workers)
+    wallTime = time.time() - startTime
+    stats = _serverRequest(url, '/_stats.json')
+    peakMemory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0 # kB on Linux
+    resultQueue.put({'scenario' : scenario,
+                     'workers' : workers,
+                     'output' : outputCount,
+                     'wallTime' : wallTime,
+                     'requests' : stats['requests'],
+                     'endpoints' : stats['endpoints'],
+                     'bytes' : stats['bytes'],
+                     'peakMemoryMB' : peakMemory})
+
+def runBenchmark(url, args) :
+    """
+    @return: [result, ...] one dict per scenario and worker count
+    """
+    results = []
+    for scenario in args.scenarios :
+        for workers in args.workers :
+            resultQueue = multiprocessing.Queue()
+            process = multiprocessing.Process(target = _runScenario,
+                                              args = (url, args, scenario, workers, resultQueue))
+            process.start()
+            result = resultQueue.get()
+            process.join()
+            results.append(result)
+            print "%(scenario)-8s workers=%(workers)-3i %(wallTime)8.2fs %(requests)8i requests " \
+                  "%(bytes)12i bytes %(peakMemoryMB)8.1f MB peak  (%(output)i lines/entries)" % result
+            sys.stdout.flush()
+    return results
+
+def _serve(args, readyQueue) :
+    server = fake_redmine.FakeRedmineServer(('127.0.0.1', 0), fake_redmine.createInstance(args), args.latency,
+                                            args.maxinflight)
+    readyQueue.put(server.getURL())
+    server.serve_forever()
+
+#---
+def main() :
+    parser = argparse.ArgumentParser()
+    fake_redmine.addInstanceArguments(parser)
+    parser.add_argument("--url", help = "Use an already running fake_redmine.py instead of starting one")
+    parser.add_argument("--scenarios", nargs = "+", choices = sorted(SCENARIOS), default = sorted(SCENARIOS))
+    parser.add_argument("--workers", nargs = "+", type = int, default = [1, 8])
+    parser.add_argument("--no-author", dest = "noauthor", action = "store_true",
+                        help = "Run the topic scenario without page details")
+    parser.add_argument("--backend", choices = BACKENDS, default = "redmine", help = "Crawl backend to measure")
+    parser.add_argument("--json", help = "Write the results to this file")
+    args = parser.parse_args()
+
+    serverProcess = None
+    url = args.url
+    if url is None :
+        readyQueue = multiprocessing.Queue()
+        serverProcess = multiprocessing.Process(target = _serve, args = (args, readyQueue))
+        serverProcess.daemon = True
+        serverProcess.start()
+        url = readyQueue.get()
+
+    print "%i projects, ~%i pages, %.3fs latency at %s" % (args.projects, args.pages, args.latency, url)
+    try :
+        results = runBenchmark(url, args)
+    finally :
+        if serverProcess is not None :
+            serverProcess.terminate()
+
+    if args.json :
+        with open(args.json, 'w') as f :
+            json.dump({'instance' : {'projects' : args.projects, 'pages' : args.pages,
+                                     'depth' : args.depth, 'latency' : args.latency},
+                       'backend' : args.backend,
+                       'results' : results}, f, indent = 2)
+
+if __name__ == '__main__' :
+    try :
+        main()
+    except KeyboardInterrupt :
+        sys.exit(0)
@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Generates the global index and any number of topic indexes from a single
+crawl of all projects and wiki pages.
+
+With C{--watch} the script keeps running and regenerates the documents
+whenever the wiki changed.
+"""
+
+#---
+#--- Python
+import sys
+import time
+import hashlib
+import argparse
+import logging
+
+#---
+#--- 3rd party
+from redmine import Redmine
+
+#---
+#--- Local
+from wiki_crawl import getProjectList, iterProjectPages, fillPageAuthors, addCrawlArguments, getBackend, \
+    createBackend, getDefaultCachePath
+from crawl_cache import CrawlCache
+from negative_cache import NegativeCache, getNegativeCachePath
+from crawl_checkpoint import CrawlCheckpoint, TimeBudgetExceeded, getCheckpointPath, getDeadline, \
+    addCheckpointArguments
+from wiki_tree import ProjectTree
+from wiki_upload import updateWikiPage
+from render_cache import RenderCache, getRenderCachePath
+from instrumentation import Profiler, NULL_PROFILER
+from overall_index import iterGlobaleIndexLinesFromPages
+from topic_index import iterTopicEntriesFromPages, iterTopicIndexLines, selectTopicPages
+from recent_pages import addRecentArguments
+
+# To disable all urllib3 warnings
+import urllib3
+urllib3.disable_warnings()
+
+# To capture warnings to your own log with the logging module
+logging.captureWarnings(True)
+
+#---
+def crawl(redmineHandle, **keywords) :
+    """
+    Fetches all projects and their wiki pages once.
+
+    @keyword workers: Number of projects whose wiki pages are fetched concurrently
+    @type    workers: int
+    @keyword cache: Page metadata of earlier runs
+    @type    cache: None or L{CrawlCache}
+    @keyword withAuthor: Fetch page details to learn the author names
+    @type    withAuthor: bool
+    @keyword detailFilter: function(allPages) returning the pages whose authors are needed
+    @keyword negativeCache: Projects without accessible wiki pages of earlier runs
+    @type    negativeCache: None or L{NegativeCache}
+    @keyword profiler: Records requests and the time spent per phase
+    @type    profiler: L{Profiler}
+    @keyword backend: Backend used for the crawl, default: the Redmine client
+    @type    backend: L{RedmineBackend} or L{RestBackend}
+    @keyword projects: Project list fetched earlier in this run, default: fetch it
+    @type    projects: None or [ProjectRecord, ...]
+    @keyword checkpoint: Projects finished by an interrupted run; updated during the crawl
+    @type    checkpoint: None or L{CrawlCheckpoint}
+    @keyword deadline: time.time() value at which the crawl stops with L{TimeBudgetExceeded}
+    @type    deadline: None or float
+    @return: (projectTree, [(project, allPages), ...])
+    """
+    r = redmineHandle
+    profiler = keywords.get('profiler', NULL_PROFILER)
+    backend = getBackend(r, **keywords)
+    allProjects = getProjectList(backend, keywords.get('projects', None), profiler)
+    with profiler.phase('project tree') :
+        projectTree = ProjectTree(allProjects)
+
+    workers = keywords.get('workers', 1)
+    cache = keywords.get('cache', None)
+    withAuthor = keywords.get('withAuthor', True)
+    detailFilter = keywords.get('detailFilter', None)
+    projectPages = list(iterProjectPages(backend, projectTree.iter_dfs(), workers = workers, cache = cache,
+                                         withAuthor = withAuthor, profiler = profiler, detailFilter = detailFilter,
+                                         negativeCache = keywords.get('negativeCache', None),
+                                         checkpoint = keywords.get('checkpoint', None),
+                                         deadline = keywords.get('deadline', None)))
+    return (projectTree, projectPages)
+
+def selectAllTopicPages(allPages, topicParentPages) :
+    """
+    @return: [page, ...] below any of the topic pages
+    """
+    selectedPages = []
+    for topicParentPage in topicParentPages :
+        selectedPages.extend(selectTopicPages(allPages, topicParentPage))
+    return selectedPages
+
+def iterOutputs(baseURL, projectTree, projectPages, globalTargetPage, topicParentPages, **keywords) :
+    """
+    Iterates over the generated documents.
+
+    @param globalTargetPage: Target page of the global index, empty to skip it
+    @param topicParentPages: Parent pages whose child pages should be collected
+    @keyword profiler: Records the time spent per phase
+    @type    profiler: L{Profiler}
+    @keyword renderCache: Sections of the global index rendered earlier
+    @type    renderCache: None or L{RenderCache}
+    @keyword recent: Number of the most recently changed pages listed at the end of each document
+    @type    recent: int
+    @keyword backend: Fetches missing authors of the recently changed pages
+    @type    backend: None or L{RedmineBackend} or L{RestBackend}
+    @return: iterator over (targetPage, title, lines)
+    """
+    if globalTargetPage :
+        lines = iterGlobaleIndexLinesFromPages(baseURL, projectTree, projectPages, **keywords)
+        yield (globalTargetPage, 'Global index', lines)
+
+    for topicParentPage in topicParentPages :
+        entries = iterTopicEntriesFromPages(projectTree, projectPages, topicParentPage, **keywords)
+        lines = iterTopicIndexLines(topicParentPage, entries, keywords.get('recent', 0))
+        yield (topicParentPage.replace(' ', '_'), topicParentPage, lines)
+
+def publishOutputs(redmineHandle, projectId, outputs, profiler = NULL_PROFILER, publishedDigests = None,
+                   renderCache = None) :
+    """
+    Prints the documents or writes them to the wiki of C{projectId}.
+
+    @param outputs: (targetPage, title, lines) as yielded by L{iterOutputs}
+    @param projectId: Target project, empty to print the documents to stdout
+    @param publishedDigests: If given, {targetPage -> digest} of the documents
+                             published earlier; unchanged documents are skipped
+                             and the dict is updated.
+    @param renderCache: Digests of the texts uploaded earlier, see L{updateWikiPage}
+    """
+    for (targetPage, title, lines) in outputs :
+        if not projectId and publishedDigests is None :
+            for line in lines :
+                print line
+            continue
+
+        newText = "\n".join(lines)
+        digest = hashlib.sha1(newText).hexdigest()
+        if publishedDigests is not None and publishedDigests.get(targetPage) == digest :
+            continue
+        if not projectId :
+            print newText
+        else :
+            print projectId, targetPage
+            with profiler.phase('wiki page update') :
+                updateWikiPage(redmineHandle, projectId, targetPage, newText, title, renderCache)
+        if publishedDigests is not None :
+            publishedDigests[targetPage] = digest
+
+def getCrawlFingerprint(projectPages) :
+    """
+    @param projectPages: (project, allPages) pairs as returned by L{crawl}
+    @return: Digest of all projects and the version of every wiki page
+    """
+    digest = hashlib.sha1()
+    for (project, allPages) in projectPages :
+        digest.update(repr((project.id, project.parent_id, project.name, project.identifier)))
+        for page in allPages :
+            digest.update(repr((page.title, page.parent_title, page.version, page.updated_on)))
+    return digest.hexdigest()
+
+def watch(redmineHandle, projectId, globalTargetPage, topicParentPages, interval, debounce, maxWait = None,
+          **keywords) :
+    """
+    Regenerates the documents whenever the wiki changed, until interrupted.
+
+    Every C{interval} seconds the project list and the wiki indexes are
+    polled, which costs one request per project and listing page; page
+    details are not requested by a poll. A change is published once the
+    wiki stayed unchanged for C{debounce} seconds, so a burst of edits
+    causes a single rebuild, or at the latest C{maxWait} seconds after the
+    first change of the burst, so constant editing cannot delay it forever.
+    Only the rebuild fetches the authors of new or changed pages, and only
+    documents whose text changed are written.
+
+    @param interval: Seconds between two polls
+    @param debounce: Seconds without further changes before a rebuild
+    @param maxWait: Seconds after the first unpublished change at which a rebuild
+                    happens anyway, None to wait for the debounce only
+    @keyword profiler: Records requests and the time spent per phase
+    @keyword profilePath: Report written after every rebuild, if given
+    @keyword renderCache: Sections and upload digests, saved after every rebuild
+    @keyword recent: Number of the most recently changed pages listed at the end of each document
+    """
+    profiler = keywords.get('profiler', NULL_PROFILER)
+    profilePath = keywords.get('profilePath', None)
+    renderCache = keywords.get('renderCache', None)
+    withAuthor = keywords.get('withAuthor', True)
+    backend = getBackend(redmineHandle, **keywords)
+    # polls only read the wiki indexes; unchanged pages keep their authors through the cache
+    pollKeywords = dict(keywords, withAuthor = False)
+    lastFingerprint = None
+    (firstChangeAt, changedAt) = (None, None)
+    isPending = False
+    publishedDigests = {}
+    while True :
+        try :
+            (projectTree, projectPages) = crawl(redmineHandle, **pollKeywords)
+            if lastFingerprint is None and len(projectTree) == 0 :
+                print "You must provide a VALID Redmine API-Key!"
+                return
+            now = time.time()
+            fingerprint = getCrawlFingerprint(projectPages)
+            if fingerprint != lastFingerprint :
+                # the first poll is published at once
+                changedAt = now if lastFingerprint is not None else now - debounce
+                if not isPending :
+                    firstChangeAt = changedAt
+                lastFingerprint = fingerprint
+                isPending = True
+            isOverdue = isPending and maxWait is not None and now - firstChangeAt >= maxWait
+            if isPending and (now - changedAt >= debounce or isOverdue) :
+                if withAuthor :
+                    fillPageAuthors(backend, projectPages, keywords.get('cache', None), keywords.get('workers', 1),
+                                    profiler, keywords.get('detailFilter', None))
+                outputs = iterOutputs(redmineHandle.url, projectTree, projectPages,
+                                      globalTargetPage, topicParentPages, profiler = profiler,
+                                      renderCache = renderCache, recent = keywords.get('recent', 0),
+                                      backend = backend)
+                publishOutputs(redmineHandle, projectId, outputs, profiler, publishedDigests, renderCache)
+                if renderCache is not None :
+                    renderCache.save()
+                isPending = False
+                if profilePath :
+                    profiler.writeReport(profilePath)
+        except Exception as error :
+            # keep watching; the next poll retries
+            sys.stderr.write("Poll failed: %r\n" % (error,))
+        sys.stdout.flush()
+        time.sleep(interval)
+
+#---
+class CLI(object) :
+    """
+    Encapsulates the Command Line Interface.
+    """
+    def __init__(self) :
+        self._parser = parser = self._createParser()
+        self._args = args = parser.parse_args()
+        if args.apikey is None :
+            print "You must provide a Redmine API-Key as first argument."
+            sys.exit(1)
+            return
+
+    def _createParser(self) :
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--apikey", help = "Valid API-key to use the Python REST-API")
+        parser.add_argument("-t", "--targetpage",
+                            help = "Fully qualified Name of the Wiki page the global index should be stored on",
+                            default = "Global_index")
+        parser.add_argument("--no-global", dest = "noglobal", action = "store_true",
+                            help = "Do not generate the global index")
+        parser.add_argument("-p", "--projectid",
+                            help = "Id of the project the target wiki pages belong to. "
+                                   "Without it all documents are printed to stdout.",
+                            default = "")
+        parser.add_argument("--topicparentpage", action = "append",
+                            help = "Name of a parent page whose child pages should be collected "
+                                   "on a page of the same name. May be given several times.",
+                            default = [])
+        parser.add_argument("--no-author", dest = "noauthor", action = "store_true",
+                            help = "Do not fetch page details; topic indexes show no author names")
+        parser.add_argument("--watch", action = "store_true",
+                            help = "Keep running and regenerate the documents whenever the wiki changed")
+        parser.add_argument("--interval", type = float,
+                            help = "Seconds between two polls in watch mode",
+                            default = 300.0)
+        parser.add_argument("--debounce", type = float,
+                            help = "Seconds the wiki must stay unchanged before a rebuild in watch mode",
+                            default = 60.0)
+        parser.add_argument("--max-wait", dest = "maxwait", type = float,
+                            help = "Seconds after the first change at which watch mode rebuilds even "
+                                   "if the wiki keeps changing, 0 to wait for the debounce only",
+                            default = 900.0)
+        addCrawlArguments(parser)
+        addCheckpointArguments(parser)
+        addRecentArguments(parser)
+
+        return parser
+
+    def getBaseURL(self) :
+        """
+        Base URL of the Redmine instance.
+        """
+        baseURL = 'https://redmine.itz.uni-halle.de'
+        return baseURL
+
+    def getApiKey(self) :
+        """
+        Valid API-key to use the REST-API of Redmine.
+        """
+        return self._args.apikey
+
+    def getGlobalTargetPage(self) :
+        """
+        @return: Target page of the global index, empty if it should not be generated
+        """
+        if self._args.noglobal :
+            return ""
+        return self._args.targetpage
+
+    def getProjectId(self) :
+        """Target Project ID"""
+        return self._args.projectid
+
+    def getTopicParentPages(self) :
+        """Pages whose child pages will be listet on a target page each."""
+        return [topic.replace('_', ' ') for topic in self._args.topicparentpage]
+
+    def getWorkers(self) :
+        """Number of concurrent wiki page requests."""
+        return max(self._args.workers, 1)
+
+    def isAuthorOmitted(self) :
+        """True if no page details should be fetched."""
+        return self._args.noauthor
+
+    def getCachePath(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.cache
+
+    def getProfilePath(self) :
+        """
+        @return: None, '-' for a summary on stderr or the path of a JSON report
+        """
+        return self._args.profile
+
+    def getBackend(self) :
+        """Name of the crawl backend."""
+        return self._args.backend
+
+    def getPageSize(self) :
+        """Number of projects per listing request."""
+        return max(self._args.pagesize, 1)
+
+    def getRetries(self) :
+        """Retries of requests failing with a transient error."""
+        return max(self._args.retries, 0)
+
+    def getNegativeTTL(self) :
+        """Seconds projects without accessible wiki pages are skipped."""
+        return self._args.negativettl * 3600
+
+    def isRefreshForced(self) :
+        """True if projects skipped in earlier runs should be checked again."""
+        return self._args.refresh
+
+    def getRecentCount(self) :
+        """Number of recently changed pages listed at the end, 0 for none."""
+        return max(self._args.recent, 0)
+
+    def isResuming(self) :
+        """True if the crawl should continue from the checkpoint of an interrupted run."""
+        return self._args.resume
+
+    def getTimeBudget(self) :
+        """
+        @return: Seconds the crawl may take or None
+        """
+        return self._args.timebudget * 60 if self._args.timebudget is not None else None
+
+    def isWatching(self) :
+        """True if the script should keep running."""
+        return self._args.watch
+
+    def getInterval(self) :
+        """Seconds between two polls."""
+        return max(self._args.interval, 1.0)
+
+    def getDebounce(self) :
+        """Seconds without changes before a rebuild."""
+        return max(self._args.debounce, 0.0)
+
+    def getMaxWait(self) :
+        """
+        @return: Seconds after the first change at which a rebuild is forced or None
+        """
+        return self._args.maxwait if self._args.maxwait > 0 else None
+
+#---
+def main() :
+    cli = CLI()
+    baseURL = cli.getBaseURL()
+    apiKey = cli.getApiKey()
+
+    redmineHandle = Redmine(baseURL, key = apiKey, requests={'verify': False})
+    profilePath = cli.getProfilePath()
+    profiler = Profiler() if profilePath else NULL_PROFILER
+    if profilePath :
+        profiler.attach(redmineHandle)
+
+    workers = cli.getWorkers()
+    backend = createBackend(cli.getBackend(), redmineHandle, workers, verify = False, pageSize = cli.getPageSize(),
+                            retries = cli.getRetries(), profiler = profiler)
+    if profilePath and backend.session is not None :
+        profiler.attach(backend.session)
+    cachePath = cli.getCachePath()
+    cache = CrawlCache(cachePath, baseURL) if cachePath else None
+    renderCache = RenderCache(getRenderCachePath(cachePath)) if cachePath else None
+    negativeCache = NegativeCache(getNegativeCachePath(cachePath), baseURL, cli.getNegativeTTL(),
+                                  cli.isRefreshForced()) if cachePath else None
+    topicParentPages = cli.getTopicParentPages()
+    # only topic indexes show authors
+    withAuthor = bool(topicParentPages) and not cli.isAuthorOmitted()
+    detailFilter = lambda allPages : selectAllTopicPages(allPages, topicParentPages)
+    projectId = cli.getProjectId()
+
+    if cli.isWatching() :
+        if cache is None :
+            # page details and rendered sections are reused from poll to poll
+            cache = CrawlCache(None, baseURL)
+            renderCache = RenderCache(None)
+        watch(redmineHandle, projectId, cli.getGlobalTargetPage(), topicParentPages,
+              cli.getInterval(), cli.getDebounce(), cli.getMaxWait(), workers = workers, cache = cache,
+              withAuthor = withAuthor, profiler = profiler, backend = backend,
+              detailFilter = detailFilter, profilePath = profilePath, renderCache = renderCache,
+              negativeCache = negativeCache, recent = cli.getRecentCount())
+        return
+
+    # a single run is checkpointed; nothing is published until its crawl finished
+    deadline = getDeadline(cli.getTimeBudget())
+    checkpoint = None
+    if cli.isResuming() or deadline is not None :
+        checkpointKey = 'combined:%s:%s' % ('|'.join(topicParentPages), withAuthor)
+        checkpoint = CrawlCheckpoint(getCheckpointPath(cachePath or getDefaultCachePath()), baseURL, checkpointKey,
+                                     cli.isResuming())
+    try :
+        (projectTree, projectPages) = crawl(redmineHandle, workers = workers, cache = cache,
+                                            withAuthor = withAuthor, profiler = profiler, backend = backend,
+                                            detailFilter = detailFilter, negativeCache = negativeCache,
+                                            checkpoint = checkpoint, deadline = deadline)
+    except TimeBudgetExceeded :
+        checkpoint.close()
+        print >> sys.stderr, "Time budget exhausted after %d projects, continue with --resume" % (len(checkpoint),)
+        if profilePath :
+            profiler.writeReport(profilePath)
+        return
+    if len(projectTree) == 0 :
+        print "You must provide a VALID Redmine API-Key!"
+        return
+
+    outputs = iterOutputs(baseURL, projectTree, projectPages,
+                          cli.getGlobalTargetPage(), topicParentPages, profiler = profiler, renderCache = renderCache,
+                          recent = cli.getRecentCount(), backend = backend)
+    publishOutputs(redmineHandle, projectId, outputs, profiler, renderCache = renderCache)
+    if checkpoint is not None :
+        checkpoint.remove()
+    if renderCache is not None :
+        renderCache.save()
+
+    if profilePath :
+        profiler.writeReport(profilePath)
+    return
+
+if __name__ == '__main__' :
+    try :
+        main()
+    except KeyboardInterrupt :
+        sys.exit(0)
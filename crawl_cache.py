@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+On-disk cache of the project and wiki page metadata of a crawl.
+"""
+
+#---
+#--- Python
+import os
+import cPickle as pickle
+import threading
+
+#---
+class CrawlCache(object) :
+    """
+    Project and page records of the last run, stored as a pickle file.
+
+    The cache only holds metadata of the projects visited in the last run;
+    projects that disappeared are dropped when the cache is saved. Without
+    a path the cache lives in memory only, e.g. for repeated crawls of one
+    long-running process.
+    """
+    FORMAT_VERSION = 2 # 2: records with __slots__ and encoded strings
+
+    def __init__(self, path, baseURL) :
+        """
+        @param path: Path of the pickle file or None
+        """
+        self._path = path
+        self._baseURL = baseURL
+        self._lock = threading.Lock()
+        self._projects = {} # project id -> (ProjectRecord, {title -> PageRecord})
+        self._visited = {} # project id -> (ProjectRecord, {title -> PageRecord})
+        self._load()
+
+    def _load(self) :
+        if self._path is None :
+            return
+        try :
+            with open(self._path, 'rb') as f :
+                data = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) :
+            return
+        if data.get('version') != self.FORMAT_VERSION or data.get('url') != self._baseURL :
+            return
+        self._projects = data['projects']
+
+    def getPages(self, project) :
+        """
+        @return: {title -> PageRecord} of the pages cached for C{project}
+        """
+        with self._lock :
+            return self._projects.get(project.id, (None, {}))[1]
+
+    def setPages(self, project, pages) :
+        with self._lock :
+            self._visited[project.id] = (project, dict((page.title, page) for page in pages))
+
+    def save(self) :
+        """
+        Writes the records of all projects visited since the cache was opened.
+        """
+        with self._lock :
+            data = {'version' : self.FORMAT_VERSION,
+                    'url' : self._baseURL,
+                    'projects' : self._visited}
+            if self._path is not None :
+                tmpPath = self._path + '.tmp'
+                with open(tmpPath, 'wb') as f :
+                    pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+                os.rename(tmpPath, self._path)
+            self._projects = self._visited
+            self._visited = {}
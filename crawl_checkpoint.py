@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Per-project crawl results of an unfinished run, to resume it later.
+"""
+
+#---
+#--- Python
+import os
+import time
+import threading
+import cPickle as pickle
+
+#---
+def getCheckpointPath(crawlCachePath) :
+    """
+    @return: Path of the checkpoint kept next to the crawl cache
+    """
+    return os.path.splitext(crawlCachePath)[0] + '.checkpoint'
+
+def getDeadline(timeBudget) :
+    """
+    @param timeBudget: Seconds the crawl may take or None
+    @return: time.time() value at which the crawl stops or None
+    """
+    return time.time() + timeBudget if timeBudget is not None else None
+
+#---
+class TimeBudgetExceeded(Exception) :
+    """
+    Raised by the crawl when the time budget ran out; the projects finished
+    so far are stored in the checkpoint.
+    """
+
+#---
+class CrawlCheckpoint(object) :
+    """
+    Wiki pages of the projects a crawl has finished, appended to a pickle
+    file one project at a time.
+
+    If a run dies or runs out of time the next run can resume from the
+    file: projects found in it are not requested again unless they changed
+    meanwhile. A record cut short by a crash is ignored. The C{key} names
+    the kind of crawl, e.g. with or without authors, so a checkpoint is
+    only resumed by the same script and options.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, path, baseURL, key = '', resume = False) :
+        """
+        @param key: Identifies the kind of crawl
+        @param resume: Keep the projects stored by an earlier run; otherwise
+                       the file is started afresh
+        """
+        self._path = path
+        self._header = {'version' : self.FORMAT_VERSION, 'url' : baseURL, 'key' : key}
+        self._lock = threading.Lock()
+        self._projects = {} # project id -> (ProjectRecord, [PageRecord, ...])
+        if resume :
+            self._load()
+        self._file = None
+        self._rewrite()
+
+    def _load(self) :
+        try :
+            with open(self._path, 'rb') as f :
+                if pickle.load(f) != self._header :
+                    return
+                while True :
+                    (project, allPages) = pickle.load(f)
+                    self._projects[project.id] = (project, allPages)
+        except (IOError, EOFError, ValueError, pickle.UnpicklingError, AttributeError, ImportError) :
+            # missing file or the end of the last complete record
+            return
+
+    def _rewrite(self) :
+        tmpPath = self._path + '.tmp'
+        with open(tmpPath, 'wb') as f :
+            pickle.dump(self._header, f, pickle.HIGHEST_PROTOCOL)
+            for record in self._projects.itervalues() :
+                pickle.dump(record, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmpPath, self._path)
+        self._file = open(self._path, 'ab')
+
+    def __len__(self) :
+        with self._lock :
+            return len(self._projects)
+
+    def getPages(self, project) :
+        """
+        @return: [PageRecord, ...] stored for C{project}, None if the project
+                 was not finished or changed since
+        """
+        with self._lock :
+            (storedProject, allPages) = self._projects.get(project.id, (None, None))
+        if storedProject is None or storedProject.updated_on != project.updated_on :
+            return None
+        return allPages
+
+    def addPages(self, project, allPages) :
+        """
+        Stores the pages of a finished project. Ignored once the checkpoint is closed.
+        """
+        with self._lock :
+            if self._file is None :
+                return
+            self._projects[project.id] = (project, allPages)
+            pickle.dump((project, allPages), self._file, pickle.HIGHEST_PROTOCOL)
+            self._file.flush()
+
+    def close(self) :
+        with self._lock :
+            if self._file is not None :
+                self._file.close()
+                self._file = None
+
+    def remove(self) :
+        """
+        Deletes the checkpoint once the run completed.
+        """
+        self.close()
+        try :
+            os.remove(self._path)
+        except OSError :
+            pass
+
+#---
+def addCheckpointArguments(parser) :
+    """
+    Adds the command line options controlling checkpoints to C{parser}.
+    """
+    parser.add_argument("--resume", action = "store_true",
+                        help = "Continue the crawl of an interrupted run from its checkpoint "
+                               "(kept next to the cache file). Checkpoints are only written by runs "
+                               "with --resume or --time-budget; without a checkpoint the crawl starts afresh")
+    parser.add_argument("--time-budget", dest = "timebudget", type = float,
+                        help = "Minutes after which the crawl stops and keeps its progress "
+                               "for a later run with --resume; nothing is published then",
+                        default = None)
+    return parser
@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in for the parts of the Redmine REST-API used by the index scripts.
+
+Serves a generated instance with deep project and page hierarchies:
+
+ - C{GET /projects.json} (offset/limit paging, at most 100 per request)
+ - C{GET /projects/<id>/wiki/index.json}
+ - C{GET /projects/<id>/wiki/<title>.json}
+ - C{PUT /projects/<id>/wiki/<title>.json} (accepted and discarded)
+ - C{GET /issues.json} (offset/limit paging, sorted by id, C{status_id},
+   C{updated_on=>=<timestamp>} and C{issue_id=>=<id>} filters)
+ - C{GET /issue_statuses.json}
+ - C{GET /_stats.json} request counters, C{POST /_reset} resets them
+
+The pages of a project are derived from a per-project seed and only the
+page lists of recently requested projects are kept, so even instances with
+hundreds of thousands of pages need little memory. Issues are derived from
+their id the same way; only issues changed by L{FakeInstance.updateIssue}
+are stored.
+
+Example::
+
+    python fake_redmine.py --port 3000 --projects 10000 --pages 200000 --latency 0.02
+"""
+
+#---
+#--- Python
+import sys
+import re
+import json
+import time
+import random
+import urllib
+import urlparse
+import argparse
+import threading
+import collections
+import BaseHTTPServer
+import SocketServer
+
+#---
+class FakeInstance(object) :
+    """
+    Deterministically generated projects and wiki pages.
+    """
+    NAMES = ['Verwaltung', 'Forschung', 'Lehre', 'Rechenzentrum', 'Bibliothek',
+             'Projekt', 'Arbeitsgruppe', u'Öffentlichkeit', 'Team', 'Archiv']
+    WORDS = ['Anleitung', 'Protokoll', 'Konzept', 'Übersicht', 'FAQ', 'Termine',
+             'Glossar', 'Howto', 'Notizen', 'Planung', 'Server', 'Dienst']
+    ISSUE_STATUSES = [(1, u'Neu', False), (2, u'In Bearbeitung', False), (3, u'Gelöst', False),
+                      (5, u'Erledigt', True), (6, u'Abgewiesen', True)]
+    TRACKERS = [(1, u'Fehler'), (2, u'Feature'), (3, u'Unterstützung')]
+    PRIORITIES = [(1, u'Niedrig'), (2, u'Normal'), (3, u'Hoch')]
+
+    def __init__(self, projectCount = 100, pageCount = 2000, maxDepth = 6,
+                 forbiddenRatio = 0.1, emptyRatio = 0.1, topic = 'Begriffe', seed = 1, issueCount = 0) :
+        self.projectCount = projectCount
+        self.issueCount = issueCount
+        self._changedIssues = {} # issue id -> issue
+        self.pageCount = pageCount
+        self.maxDepth = maxDepth
+        self.forbiddenRatio = forbiddenRatio
+        self.emptyRatio = emptyRatio
+        self.topic = topic
+        self.seed = seed
+        self._projects = self._createProjects()
+        self._projectsByKey = {}
+        self._recentPages = collections.OrderedDict() # project id -> pages, for detail requests
+        self._lock = threading.Lock()
+        for project in self._projects :
+            self._projectsByKey[str(project['id'])] = project
+            self._projectsByKey[project['identifier']] = project
+
+    def _timestamp(self, rnd) :
+        return "%04i-%02i-%02iT%02i:%02i:%02iZ" % (rnd.randint(2010, 2016), rnd.randint(1, 12), rnd.randint(1, 28),
+                                                    rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59))
+
+    def _createProjects(self) :
+        rnd = random.Random(self.seed)
+        projects = []
+        depths = {}
+        for projectId in xrange(1, self.projectCount + 1) :
+            project = {'id' : projectId,
+                       'name' : u"%s %i" % (rnd.choice(self.NAMES), projectId),
+                       'identifier' : "project-%i" % (projectId,),
+                       'description' : '',
+                       'status' : 1,
+                       'created_on' : self._timestamp(rnd),
+                       'updated_on' : self._timestamp(rnd)}
+            depths[projectId] = 1
+            if projects and rnd.random() < 0.8 :
+                parent = projects[rnd.randint(max(0, len(projects) - 50), len(projects) - 1)]
+                if depths[parent['id']] < self.maxDepth :
+                    project['parent'] = {'id' : parent['id'], 'name' : parent['name']}
+                    depths[projectId] = depths[parent['id']] + 1
+            projects.append(project)
+        return projects
+
+    def getProjects(self) :
+        return self._projects
+
+    def getProject(self, key) :
+        return self._projectsByKey.get(key)
+
+    def isForbidden(self, project) :
+        return random.Random((self.seed, project['id'], 'forbidden')).random() < self.forbiddenRatio
+
+    def getPages(self, project) :
+        """
+        @return: [page, ...] as delivered by the wiki index
+        """
+        with self._lock :
+            pages = self._recentPages.get(project['id'])
+        if pages is None :
+            pages = self._createPages(project)
+            with self._lock :
+                self._recentPages[project['id']] = pages
+                if len(self._recentPages) > 256 :
+                    self._recentPages.popitem(last = False)
+        return pages
+
+    def _createPages(self, project) :
+        rnd = random.Random((self.seed, project['id']))
+        if rnd.random() < self.emptyRatio :
+            return []
+        averageCount = float(self.pageCount) / max(self.projectCount, 1) / (1.0 - self.emptyRatio)
+        count = int(rnd.expovariate(1.0 / max(averageCount, 1.0)))
+
+        pages = []
+        depths = {}
+        titles = set()
+        if count > 0 and rnd.random() < 0.5 :
+            titles.add(self.topic)
+            depths[self.topic] = 1
+            pages.append({'title' : self.topic, 'version' : 1,
+                          'created_on' : self._timestamp(rnd), 'updated_on' : self._timestamp(rnd)})
+        while len(pages) < count :
+            title = u"%s_%i" % (rnd.choice(self.WORDS).decode('utf-8'), rnd.randint(1, 10 * count))
+            if title in titles :
+                continue
+            titles.add(title)
+            page = {'title' : title, 'version' : rnd.randint(1, 30),
+                    'created_on' : self._timestamp(rnd), 'updated_on' : self._timestamp(rnd)}
+            depths[title] = 1
+            if pages and rnd.random() < 0.85 :
+                parent = pages[rnd.randint(max(0, len(pages) - 20), len(pages) - 1)]
+                if depths[parent['title']] < self.maxDepth :
+                    page['parent'] = {'title' : parent['title']}
+                    depths[title] = depths[parent['title']] + 1
+            pages.append(page)
+        return pages
+
+    def getPage(self, project, title) :
+        """
+        @return: page with details or None
+        """
+        for page in self.getPages(project) :
+            if page['title'] == title :
+                rnd = random.Random((self.seed, project['id'], title))
+                details = dict(page)
+                details['author'] = {'id' : rnd.randint(1, 50), 'name' : u"Nutzer %i" % rnd.randint(1, 50)}
+                details['comments'] = ''
+                details['text'] = u"h1. %s\n\nSiehe [[%s]]." % (title, rnd.choice(self.WORDS).decode('utf-8'))
+                return details
+        return None
+
+    def getIssueStatuses(self) :
+        return [{'id' : statusId, 'name' : name, 'is_closed' : isClosed}
+                for (statusId, name, isClosed) in self.ISSUE_STATUSES]
+
+    def getIssue(self, issueId) :
+        with self._lock :
+            issue = self._changedIssues.get(issueId)
+        if issue is not None :
+            return issue
+        rnd = random.Random((self.seed, 'issue', issueId))
+        project = rnd.choice(self._projects)
+        (statusId, statusName, isClosed) = rnd.choice(self.ISSUE_STATUSES)
+        (trackerId, trackerName) = rnd.choice(self.TRACKERS)
+        (priorityId, priorityName) = rnd.choice(self.PRIORITIES)
+        issue = {'id' : issueId,
+                 'project' : {'id' : project['id'], 'name' : project['name']},
+                 'tracker' : {'id' : trackerId, 'name' : trackerName},
+                 'status' : {'id' : statusId, 'name' : statusName},
+                 'priority' : {'id' : priorityId, 'name' : priorityName},
+                 'author' : {'id' : 1, 'name' : u"Nutzer 1"},
+                 'subject' : u"%s %i" % (rnd.choice(self.WORDS).decode('utf-8'), issueId),
+                 'done_ratio' : rnd.choice([0, 10, 50, 90]),
+                 'created_on' : self._timestamp(rnd),
+                 'updated_on' : self._timestamp(rnd)}
+        if rnd.random() < 0.7 :
+            issue['assigned_to'] = {'id' : rnd.randint(1, 50), 'name' : u"Nutzer %i" % rnd.randint(1, 50)}
+        return issue
+
+    def updateIssue(self, issueId, statusId = None, subject = None) :
+        """
+        Changes an issue and sets its C{updated_on} to now.
+        """
+        issue = dict(self.getIssue(issueId))
+        if statusId is not None :
+            name = [name for (knownId, name, isClosed) in self.ISSUE_STATUSES if knownId == statusId][0]
+            issue['status'] = {'id' : statusId, 'name' : name}
+        if subject is not None :
+            issue['subject'] = subject
+        issue['updated_on'] = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())
+        with self._lock :
+            self._changedIssues[issueId] = issue
+
+    def getIssues(self, statusFilter = 'open', updatedSince = None, minId = 1) :
+        """
+        @param statusFilter: 'open', 'closed' or '*'
+        @param updatedSince: None or timestamp string the issues must not be older than
+        @param minId: Lowest issue id listed
+        @return: [issue, ...] sorted by id
+        """
+        closedIds = set(statusId for (statusId, name, isClosed) in self.ISSUE_STATUSES if isClosed)
+        issues = []
+        for issueId in xrange(max(minId, 1), self.issueCount + 1) :
+            issue = self.getIssue(issueId)
+            isClosed = issue['status']['id'] in closedIds
+            if statusFilter == 'open' and isClosed or statusFilter == 'closed' and not isClosed :
+                continue
+            if updatedSince is not None and issue['updated_on'] < updatedSince :
+                continue
+            issues.append(issue)
+        return issues
+
+#---
+class FakeRedmineHandler(BaseHTTPServer.BaseHTTPRequestHandler) :
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # keep-alive clients would otherwise wait for delayed ACKs
+
+    def log_message(self, format, *args) :
+        return
+
+    def _send(self, status, body = None) :
+        data = json.dumps(body) if body is not None else ''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.server.countResponse(self.command, self._endpoint, len(data))
+
+    def _route(self) :
+        url = urlparse.urlparse(self.path)
+        self._query = dict(urlparse.parse_qsl(url.query))
+        self._path = url.path
+        for (endpoint, pattern) in self.server.ROUTES :
+            match = re.match(pattern, url.path)
+            if match :
+                self._endpoint = endpoint
+                return [urllib.unquote(g).decode('utf-8') for g in match.groups()]
+        self._endpoint = 'other'
+        return None
+
+    def do_GET(self) :
+        args = self._route()
+        server = self.server
+        if self._endpoint == '_stats' :
+            return self._send(200, server.getStats())
+        if not server.enterRequest() :
+            return self._send(503)
+        try :
+            return self._get(args)
+        finally :
+            server.leaveRequest()
+
+    def _get(self, args) :
+        server = self.server
+        if server.latency :
+            time.sleep(server.latency)
+        instance = server.instance
+
+        if self._endpoint == 'projects' :
+            offset = int(self._query.get('offset', 0))
+            limit = min(int(self._query.get('limit', 25)), 100)
+            projects = instance.getProjects()
+            return self._send(200, {'projects' : projects[offset:offset + limit],
+                                    'total_count' : len(projects), 'offset' : offset, 'limit' : limit})
+
+        if self._endpoint == 'issues' :
+            offset = int(self._query.get('offset', 0))
+            limit = min(int(self._query.get('limit', 25)), 100)
+            updatedOn = self._query.get('updated_on', '')
+            updatedSince = updatedOn[2:] if updatedOn.startswith('>=') else None
+            issueId = self._query.get('issue_id', '')
+            minId = int(issueId[2:]) if issueId.startswith('>=') else 1
+            issues = instance.getIssues(self._query.get('status_id', 'open'), updatedSince, minId)
+            return self._send(200, {'issues' : issues[offset:offset + limit],
+                                    'total_count' : len(issues), 'offset' : offset, 'limit' : limit})
+
+        if self._endpoint == 'issue_statuses' :
+            return self._send(200, {'issue_statuses' : instance.getIssueStatuses()})
+
+        if self._endpoint in ('wiki_index', 'wiki_page') :
+            project = instance.getProject(args[0].encode('utf-8'))
+            if project is None :
+                return self._send(404)
+            if instance.isForbidden(project) :
+                return self._send(403)
+            if self._endpoint == 'wiki_index' :
+                return self._send(200, {'wiki_pages' : instance.getPages(project)})
+            page = instance.getPage(project, args[1])
+            if page is None :
+                return self._send(404)
+            return self._send(200, {'wiki_page' : page})
+
+        return self._send(404)
+
+    def do_PUT(self) :
+        self._route()
+        length = int(self.headers.get('Content-Length', 0))
+        self.rfile.read(length)
+        return self._send(200 if self._endpoint == 'wiki_page' else 404)
+
+    def do_POST(self) :
+        self._route()
+        if self._endpoint == '_reset' :
+            self.server.resetStats()
+            return self._send(200, {})
+        return self._send(404)
+
+#---
+class FakeRedmineServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer) :
+    """
+    Threaded HTTP server serving a L{FakeInstance}.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    ROUTES = [('projects', r'^/projects\.json$'),
+              ('wiki_index', r'^/projects/([^/]+)/wiki/index\.json$'),
+              ('wiki_page', r'^/projects/([^/]+)/wiki/(.+)\.json$'),
+              ('issues', r'^/issues\.json$'),
+              ('issue_statuses', r'^/issue_statuses\.json$'),
+              ('_stats', r'^/_stats\.json$'),
+              ('_reset', r'^/_reset$')]
+
+    def __init__(self, address, instance, latency = 0.0, maxInFlight = 0) :
+        """
+        @param maxInFlight: GET requests beyond this number in flight are answered
+                            with 503 like an overloaded proxy would; 0 for no limit
+        """
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeRedmineHandler)
+        self.instance = instance
+        self.latency = latency
+        self.maxInFlight = maxInFlight
+        self._inFlight = 0
+        self._lock = threading.Lock()
+        self.resetStats()
+
+    def enterRequest(self) :
+        """
+        @return: False if the request should be rejected as overload
+        """
+        with self._lock :
+            if self.maxInFlight and self._inFlight >= self.maxInFlight :
+                return False
+            self._inFlight += 1
+            return True
+
+    def leaveRequest(self) :
+        with self._lock :
+            self._inFlight -= 1
+
+    def getURL(self) :
+        return "http://%s:%i" % self.server_address[:2]
+
+    def countResponse(self, method, endpoint, size) :
+        if endpoint.startswith('_') :
+            return
+        key = "%s %s" % (method, endpoint)
+        with self._lock :
+            self._requests[key] = self._requests.get(key, 0) + 1
+            self._bytes += size
+
+    def resetStats(self) :
+        with self._lock :
+            self._requests = {}
+            self._bytes = 0
+
+    def getStats(self) :
+        with self._lock :
+            return {'requests' : sum(self._requests.values()),
+                    'endpoints' : dict(self._requests),
+                    'bytes' : self._bytes}
+
+def startServer(instance, host = '127.0.0.1', port = 0, latency = 0.0, maxInFlight = 0) :
+    """
+    Starts a L{FakeRedmineServer} in a background thread.
+    """
+    server = FakeRedmineServer((host, port), instance, latency, maxInFlight)
+    thread = threading.Thread(target = server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+#---
+def addInstanceArguments(parser) :
+    parser.add_argument("--projects", type = int, default = 100, help = "Number of projects")
+    parser.add_argument("--pages", type = int, default = 2000, help = "Approximate number of wiki pages")
+    parser.add_argument("--depth", type = int, default = 6, help = "Maximum depth of the project and page hierarchies")
+    parser.add_argument("--forbidden", type = float, default = 0.1, help = "Share of projects answering 403")
+    parser.add_argument("--empty", type = float, default = 0.1, help = "Share of projects without wiki pages")
+    parser.add_argument("--topic", default = "Begriffe", help = "Topic parent page placed in half of the wikis")
+    parser.add_argument("--issues", type = int, default = 0, help = "Number of issues")
+    parser.add_argument("--seed", type = int, default = 1)
+    parser.add_argument("--latency", type = float, default = 0.0, help = "Delay per request in seconds")
+    parser.add_argument("--max-inflight", dest = "maxinflight", type = int, default = 0,
+                        help = "Answer 503 beyond this number of concurrent requests, 0 for no limit")
+    return parser
+
+def createInstance(args) :
+    return FakeInstance(args.projects, args.pages, args.depth, args.forbidden, args.empty,
+                        args.topic.replace(' ', '_').decode('utf-8'), args.seed, args.issues)
+
+def main() :
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 3000)
+    addInstanceArguments(parser)
+    args = parser.parse_args()
+
+    server = FakeRedmineServer((args.host, args.port), createInstance(args), args.latency, args.maxinflight)
+    print "Serving fake Redmine at %s" % (server.getURL(),)
+    server.serve_forever()
+
+if __name__ == '__main__' :
+    try :
+        main()
+    except KeyboardInterrupt :
+        sys.exit(0)
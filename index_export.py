@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Export of the crawled project and page records as JSON.
+
+Tools that need the wiki structure read one export file instead of
+crawling Redmine themselves. The records follow the depth-first order of
+the index: each project record is followed by the records of its pages.
+"""
+
+#---
+#--- Python
+import os
+import sys
+import json
+import urllib
+import StringIO
+
+#---
+#--- Local
+from wiki_crawl import formatDatetime
+from wiki_tree import PageTree
+
+#---
+EXPORT_FORMATS = ('ndjson', 'json')
+JSON_SEPARATORS = (',', ':')
+
+#---
+def getPageURL(baseURL, projectIdent, title) :
+    return '%s/projects/%s/wiki/%s' % (baseURL, projectIdent, urllib.quote(title))
+
+def iterExportRecords(baseURL, projectTree, projectPages, pageFilter = None, withAuthor = True) :
+    """
+    Turns the crawled records into JSON objects.
+
+    A project record has the keys C{type} ('project'), C{id}, C{identifier},
+    C{name}, C{parent_id}, C{depth}, C{breadcrumbs} (names from the root
+    project on), C{updated_on} and C{url}. A page record has the keys
+    C{type} ('page'), C{project} (identifier), C{title}, C{parent_title},
+    C{depth}, C{breadcrumbs} (titles from the root page on), C{author},
+    C{created_on}, C{updated_on}, C{version} and C{url}. Timestamps are
+    ISO 8601 UTC strings. The author is null if the page details could not
+    be read, or for all pages if C{withAuthor} is off.
+
+    @param projectPages: (project, allPages) pairs in the order of C{projectTree.iter_dfs()}
+    @param pageFilter: function(allPages) returning the pages to export, default: all pages
+    @param withAuthor: Export the author names
+    @return: iterator over dicts
+    """
+    for (project, allPages) in projectPages :
+        projectIdent = project.identifier
+        yield {'type' : 'project',
+               'id' : project.id,
+               'identifier' : projectIdent,
+               'name' : project.name,
+               'parent_id' : project.parent_id,
+               'depth' : projectTree.getDepth(project),
+               'breadcrumbs' : list(projectTree.getBreadcrumbTrail(project)),
+               'updated_on' : formatDatetime(project.updated_on),
+               'url' : '%s/projects/%s' % (baseURL, projectIdent)}
+        if not allPages :
+            continue
+
+        pageTree = PageTree(project, allPages)
+        selectedTitles = set(page.title for page in pageFilter(allPages)) if pageFilter is not None else None
+        for page in pageTree.iter_dfs() :
+            if selectedTitles is not None and page.title not in selectedTitles :
+                continue
+            yield {'type' : 'page',
+                   'project' : projectIdent,
+                   'title' : page.title,
+                   'parent_title' : page.parent_title,
+                   'depth' : pageTree.getDepth(page),
+                   'breadcrumbs' : list(pageTree.getBreadcrumbTrail(page)),
+                   'author' : page.author_name if withAuthor else None,
+                   'created_on' : formatDatetime(page.created_on),
+                   'updated_on' : formatDatetime(page.updated_on),
+                   'version' : page.version,
+                   'url' : getPageURL(baseURL, projectIdent, page.title)}
+
+def writeExport(records, f, exportFormat = 'ndjson') :
+    """
+    Writes the records while they are crawled.
+
+    @param exportFormat: 'ndjson' for one object per line, 'json' for a single compact array
+    @return: Number of records written
+    """
+    recordCount = 0
+    if exportFormat == 'json' :
+        f.write('[')
+    for record in records :
+        if exportFormat == 'json' and recordCount > 0 :
+            f.write(',')
+        f.write(json.dumps(record, separators = JSON_SEPARATORS, sort_keys = True))
+        if exportFormat == 'ndjson' :
+            f.write('\n')
+        recordCount += 1
+    if exportFormat == 'json' :
+        f.write(']\n')
+    return recordCount
+
+def exportIndex(baseURL, projectTree, projectPages, exportFormat, outputPath = '-', **keywords) :
+    """
+    Writes the export file, or stdout for C{outputPath} '-'.
+
+    @keyword pageFilter: function(allPages) returning the pages to export
+    @keyword withAuthor: Export the author names
+    @keyword buffered: Write to stdout only once the crawl completed, e.g. if it may
+                       stop early; otherwise the records are streamed
+    @return: Number of records written
+    """
+    records = iterExportRecords(baseURL, projectTree, projectPages, keywords.get('pageFilter', None),
+                                keywords.get('withAuthor', True))
+    if outputPath == '-' :
+        if not keywords.get('buffered', False) :
+            return writeExport(records, sys.stdout, exportFormat)
+        buf = StringIO.StringIO()
+        recordCount = writeExport(records, buf, exportFormat)
+        sys.stdout.write(buf.getvalue())
+        return recordCount
+    # readers never see a partial file, even if the crawl stops early
+    tmpPath = outputPath + '.tmp'
+    try :
+        with open(tmpPath, 'wb') as f :
+            recordCount = writeExport(records, f, exportFormat)
+    except :
+        os.remove(tmpPath)
+        raise
+    os.rename(tmpPath, outputPath)
+    return recordCount
+
+#---
+def addExportArguments(parser) :
+    """
+    Adds the command line options of the export mode to C{parser}.
+    """
+    parser.add_argument("--export", choices = EXPORT_FORMATS,
+                        help = "Write the crawled projects and pages as JSON instead of rendering the index",
+                        default = None)
+    parser.add_argument("--output",
+                        help = "File the export is written to, '-' for stdout",
+                        default = "-")
+    return parser
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Request and phase instrumentation for the index scripts.
+"""
+
+#---
+#--- Python
+import re
+import sys
+import time
+import json
+import bisect
+import threading
+import contextlib
+import urlparse
+
+#---
+class Profiler(object) :
+    """
+    Collects per-endpoint request statistics and the time spent per phase.
+
+    Requests are recorded by a response hook of the C{requests} library,
+    see L{attach}. Phases are timed with L{phase}; phases running in several
+    threads at once add up their time, so the sum of all phases may exceed
+    the wall time of the run.
+    """
+    LATENCY_BUCKETS = [0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0] # upper bounds in seconds
+    ENDPOINT_PATTERNS = [(re.compile(r'^/projects/[^/]+/wiki/index\.json$'), '/projects/:id/wiki/index.json'),
+                         (re.compile(r'^/projects/[^/]+/wiki/[^/]+\.json$'), '/projects/:id/wiki/:title.json'),
+                         (re.compile(r'^/projects/[^/]+\.json$'), '/projects/:id.json'),
+                         (re.compile(r'^/issues/\d+\.json$'), '/issues/:id.json')]
+
+    def __init__(self) :
+        self._lock = threading.Lock()
+        self._startTime = time.time()
+        self._endpoints = {} # endpoint -> {'count', 'errors', 'seconds', 'bytes', 'histogram'}
+        self._phases = {} # phase -> {'count', 'seconds'}
+        self._phaseOrder = []
+
+    def attach(self, client) :
+        """
+        Records all requests made through C{client}.
+
+        @param client: C{redmine.Redmine} handle or C{requests.Session}
+        """
+        if hasattr(client, 'requests') :
+            hooks = client.requests.setdefault('hooks', {})
+        else :
+            hooks = client.hooks
+        responseHooks = hooks.get('response', [])
+        if callable(responseHooks) :
+            responseHooks = [responseHooks]
+        hooks['response'] = list(responseHooks) + [self.onResponse]
+        return client
+
+    def getEndpoint(self, method, url) :
+        path = urlparse.urlparse(url).path
+        for (pattern, endpoint) in self.ENDPOINT_PATTERNS :
+            if pattern.search(path) :
+                return "%s %s" % (method, endpoint)
+        return "%s %s" % (method, path)
+
+    def onResponse(self, response, *args, **keywords) :
+        """
+        Response hook for the C{requests} library.
+        """
+        endpoint = self.getEndpoint(response.request.method, response.url)
+        seconds = response.elapsed.total_seconds()
+        size = len(response.content or '')
+        self.recordRequest(endpoint, seconds, size, response.status_code >= 400)
+        return response
+
+    def recordRequest(self, endpoint, seconds, size, isError = False) :
+        bucket = bisect.bisect_left(self.LATENCY_BUCKETS, seconds)
+        with self._lock :
+            stats = self._endpoints.get(endpoint)
+            if stats is None :
+                stats = {'count' : 0, 'errors' : 0, 'seconds' : 0.0, 'bytes' : 0,
+                         'histogram' : [0] * (len(self.LATENCY_BUCKETS) + 1)}
+                self._endpoints[endpoint] = stats
+            stats['count'] += 1
+            stats['errors'] += int(isError)
+            stats['seconds'] += seconds
+            stats['bytes'] += size
+            stats['histogram'][bucket] += 1
+
+    @contextlib.contextmanager
+    def phase(self, name) :
+        """
+        Context manager adding the time spent in its block to phase C{name}.
+        """
+        startTime = time.time()
+        try :
+            yield
+        finally :
+            self.recordPhase(name, time.time() - startTime)
+
+    def recordPhase(self, name, seconds) :
+        with self._lock :
+            stats = self._phases.get(name)
+            if stats is None :
+                stats = {'count' : 0, 'seconds' : 0.0}
+                self._phases[name] = stats
+                self._phaseOrder.append(name)
+            stats['count'] += 1
+            stats['seconds'] += seconds
+
+    def toDict(self) :
+        with self._lock :
+            return {'wallTime' : time.time() - self._startTime,
+                    'latencyBuckets' : self.LATENCY_BUCKETS,
+                    'endpoints' : dict((k, dict(v, histogram = list(v['histogram'])))
+                                       for (k, v) in self._endpoints.iteritems()),
+                    'phases' : [dict(self._phases[name], name = name) for name in self._phaseOrder]}
+
+    def iterReportLines(self) :
+        data = self.toDict()
+        yield "Wall time: %.2fs" % (data['wallTime'],)
+        yield ""
+        yield "%-45s %8s %6s %10s %10s %12s" % ("Endpoint", "Requests", "Errors", "Total [s]", "Mean [ms]", "Bytes")
+        for (endpoint, stats) in sorted(data['endpoints'].iteritems()) :
+            meanTime = 1000.0 * stats['seconds'] / max(stats['count'], 1)
+            yield "%-45s %8i %6i %10.2f %10.1f %12i" % (endpoint, stats['count'], stats['errors'],
+                                                         stats['seconds'], meanTime, stats['bytes'])
+            bounds = ["<%gs" % b for b in self.LATENCY_BUCKETS] + [">%gs" % self.LATENCY_BUCKETS[-1]]
+            yield "    " + " ".join("%s:%i" % (b, n) for (b, n) in zip(bounds, stats['histogram']) if n)
+        yield ""
+        yield "%-45s %8s %10s" % ("Phase", "Count", "Total [s]")
+        for stats in data['phases'] :
+            yield "%-45s %8i %10.2f" % (stats['name'], stats['count'], stats['seconds'])
+
+    def writeReport(self, path) :
+        """
+        @param path: '-' prints a summary to stderr, otherwise JSON is written to C{path}
+        """
+        if path == '-' :
+            for line in self.iterReportLines() :
+                sys.stderr.write(line + "\n")
+            return
+        with open(path, 'w') as f :
+            json.dump(self.toDict(), f, indent = 2)
+
+#---
+class NullProfiler(object) :
+    """
+    Does nothing; used when profiling is off.
+    """
+    @contextlib.contextmanager
+    def phase(self, name) :
+        yield
+
+    def recordPhase(self, name, seconds) :
+        return
+
+NULL_PROFILER = NullProfiler()
+
+#---
+class ProgressReporter(object) :
+    """
+    Prints the progress of the crawl with an estimate of the remaining time.
+    """
+    def __init__(self, total, out = None) :
+        self._total = total
+        self._out = out or sys.stdout
+        self._startTime = time.time()
+
+    def formatETA(self, done) :
+        if done <= 0 :
+            return "--:--"
+        elapsed = time.time() - self._startTime
+        remaining = int(elapsed / done * (self._total - done))
+        return "%02i:%02i" % divmod(remaining, 60) if remaining < 3600 \
+            else "%i:%02i:%02i" % (remaining // 3600, remaining % 3600 // 60, remaining % 60)
+
+    def report(self, done, pageCount) :
+        """
+        @param done: Number of projects finished so far
+        """
+        self._out.write("%i/%i: %i pages, ETA %s\n" % (done, self._total, pageCount, self.formatETA(done)))
+        self._out.flush()
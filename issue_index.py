@@ -0,0 +1,469 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Generates one overview of the open issues per project and stores it in
+the wiki of that project.
+
+The issues are streamed from the REST-API into a local SQLite store.
+The listing is paged by issue id rather than by offset, so issues deleted
+during a run cannot make the following ones slip through. After the first
+run only issues changed since the last sync are fetched; C{--full} fetches
+all of them again and drops deleted issues.
+"""
+
+#---
+#--- Python
+import os
+import sys
+import argparse
+import logging
+import datetime
+import sqlite3
+import itertools
+import collections
+from multiprocessing.pool import ThreadPool
+
+#---
+#--- 3rd party
+from redmine import Redmine
+from redmine import exceptions as redmine_exceptions
+
+#---
+#--- Local
+from wiki_crawl import parseDatetime, formatDatetime, encodeText, fetchProjects, addCrawlArguments, createBackend, \
+    getDefaultCachePath
+from wiki_tree import ProjectTree
+from wiki_upload import updateWikiPage
+from render_cache import RenderCache, getRenderCachePath
+from instrumentation import Profiler, NULL_PROFILER
+
+# To disable all urllib3 warnings
+import urllib3
+urllib3.disable_warnings()
+
+# To capture warnings to your own log with the logging module
+logging.captureWarnings(True)
+
+#---
+# issues changed while the last sync ran, or stamped by a server clock
+# ahead of ours, are fetched again
+SYNC_OVERLAP = datetime.timedelta(minutes = 15)
+BATCH_SIZE = 1000 # issues written per statement
+
+def getIssueStorePath(crawlCachePath) :
+    """
+    @return: Path of the issue store kept next to the crawl cache
+    """
+    return os.path.splitext(crawlCachePath)[0] + '.issues'
+
+def getName(attributes, key) :
+    """
+    @return: UTF-8 encoded name of a referenced object like C{status} or None
+    """
+    return encodeText((attributes.get(key) or {}).get('name'))
+
+#---
+class IssueStore(object) :
+    """
+    The issues of all projects as of the last sync, stored in a SQLite file.
+
+    All strings are stored and returned as UTF-8 encoded byte strings.
+    """
+    FORMAT_VERSION = 1
+
+    TABLES = ('meta', 'statuses', 'issues')
+
+    SCHEMA = """
+        CREATE TABLE meta (
+            key TEXT PRIMARY KEY,
+            value TEXT);
+        CREATE TABLE statuses (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            is_closed INTEGER NOT NULL);
+        CREATE TABLE issues (
+            id INTEGER PRIMARY KEY,
+            project_id INTEGER NOT NULL,
+            tracker TEXT,
+            status_id INTEGER,
+            status TEXT,
+            priority TEXT,
+            subject TEXT,
+            assigned_to TEXT,
+            done_ratio INTEGER,
+            created_on TEXT,
+            updated_on TEXT,
+            sync_run INTEGER NOT NULL);
+        CREATE INDEX issues_project ON issues (project_id, status_id);
+        """
+
+    def __init__(self, path, baseURL) :
+        """
+        @param path: Path of the SQLite file, created if missing
+        """
+        self._baseURL = baseURL
+        self._connection = sqlite3.connect(path)
+        self._connection.text_factory = str
+        if self._getMeta('version') != str(self.FORMAT_VERSION) or self._getMeta('url') != baseURL :
+            self.clear()
+
+    def _getMeta(self, key) :
+        try :
+            row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        except sqlite3.OperationalError :
+            # new file
+            return None
+        return row[0] if row is not None else None
+
+    def _setMeta(self, key, value) :
+        self._connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def clear(self) :
+        """
+        Removes all issues, e.g. after the base URL or the format changed.
+        """
+        with self._connection :
+            for table in self.TABLES :
+                self._connection.execute("DROP TABLE IF EXISTS %s" % (table,))
+            self._connection.executescript(self.SCHEMA)
+            self._connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                         [('version', str(self.FORMAT_VERSION)), ('url', self._baseURL),
+                                          ('sync_run', '0')])
+
+    def close(self) :
+        self._connection.close()
+
+    def getSyncedSince(self) :
+        """
+        @return: Start time of the last completed sync or None
+        """
+        return parseDatetime(self._getMeta('synced_since'))
+
+    def beginSync(self) :
+        """
+        @return: Number of this sync; issues not stored since are stale after a full sync
+        """
+        syncRun = int(self._getMeta('sync_run')) + 1
+        with self._connection :
+            self._setMeta('sync_run', str(syncRun))
+        return syncRun
+
+    def finishSync(self, syncRun, startTime, isFull) :
+        """
+        Records a completed sync. After a full sync the issues it did not
+        deliver have been deleted or moved out of sight and are dropped.
+        """
+        with self._connection :
+            if isFull :
+                self._connection.execute("DELETE FROM issues WHERE sync_run < ?", (syncRun,))
+            self._setMeta('synced_since', formatDatetime(startTime))
+
+    def setStatuses(self, statuses) :
+        """
+        @param statuses: [attributes, ...] as returned by C{/issue_statuses.json}
+        """
+        with self._connection :
+            self._connection.execute("DELETE FROM statuses")
+            self._connection.executemany("INSERT INTO statuses (id, name, is_closed) VALUES (?, ?, ?)",
+                                         ((status['id'], encodeText(status['name']), bool(status.get('is_closed')))
+                                          for status in statuses))
+
+    def storeIssues(self, issues, syncRun) :
+        """
+        Writes the issues in batches of L{BATCH_SIZE}, so the caller may
+        stream any number of them.
+
+        @param issues: iterator over attributes as returned by C{/issues.json}
+        @return: Number of stored issues
+        """
+        rows = ((issue['id'], issue['project']['id'], getName(issue, 'tracker'),
+                 (issue.get('status') or {}).get('id'), getName(issue, 'status'), getName(issue, 'priority'),
+                 encodeText(issue.get('subject')), getName(issue, 'assigned_to'), issue.get('done_ratio'),
+                 formatDatetime(parseDatetime(issue.get('created_on'))),
+                 formatDatetime(parseDatetime(issue.get('updated_on'))), syncRun)
+                for issue in issues)
+        issueCount = 0
+        while True :
+            batch = list(itertools.islice(rows, BATCH_SIZE))
+            if not batch :
+                return issueCount
+            with self._connection :
+                self._connection.executemany("INSERT OR REPLACE INTO issues (id, project_id, tracker, status_id, status, "
+                                             "priority, subject, assigned_to, done_ratio, created_on, updated_on, sync_run) "
+                                             "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            issueCount += len(batch)
+
+    def getProjectIds(self) :
+        """
+        @return: set of the ids of all projects with stored issues, open or closed
+        """
+        return set(projectId for (projectId,) in self._connection.execute("SELECT DISTINCT project_id FROM issues"))
+
+    def iterOpenIssues(self, projectId) :
+        """
+        @return: iterator over (id, tracker, status, priority, subject, assignedTo, doneRatio, updatedOn)
+                 ordered by tracker and id
+        """
+        cursor = self._connection.execute("""
+            SELECT issues.id, tracker, status, priority, subject, assigned_to, done_ratio, updated_on
+            FROM issues LEFT JOIN statuses ON statuses.id = issues.status_id
+            WHERE project_id = ? AND NOT COALESCE(statuses.is_closed, 0)
+            ORDER BY tracker, issues.id""", (projectId,))
+        for row in cursor :
+            yield row[:7] + (parseDatetime(row[7]),)
+
+#---
+def syncIssues(backend, store, full = False, profiler = NULL_PROFILER) :
+    """
+    Fetches the issues changed since the last sync, or all issues.
+
+    The issues are streamed into C{store} as they arrive.
+
+    @param full: Fetch all issues even if the store was synced before
+    @return: Number of fetched issues
+    """
+    startTime = datetime.datetime.utcnow().replace(microsecond = 0)
+    syncedSince = store.getSyncedSince()
+    isFull = full or syncedSince is None
+    filters = {'status_id' : '*'}
+    if not isFull :
+        filters['updated_on'] = '>=' + formatDatetime(syncedSince - SYNC_OVERLAP)
+
+    syncRun = store.beginSync()
+    with profiler.phase('issue statuses') :
+        store.setStatuses(backend.getIssueStatuses())
+    with profiler.phase('issues') :
+        issueCount = store.storeIssues(backend.iterIssues(**filters), syncRun)
+    store.finishSync(syncRun, startTime, isFull)
+    return issueCount
+
+def escapeTableCell(text) :
+    return (text or '').replace('|', '&#124;')
+
+def iterIssueOverviewLines(store, projectTree, project) :
+    """
+    Renders the overview of the open issues of a single project, one
+    table per tracker.
+    """
+    breadcrumbTrail = " » ".join(projectTree.getBreadcrumbTrail(project))
+    yield "{{>toc}}"
+    yield ""
+    yield "h1. Offene Tickets: %(breadcrumbTrail)s" % locals()
+    yield ""
+    yield "Diese Seite wurde automatisch generiert. Manuelle Änderungen an dieser Seite werden beim nächsten Lauf überschrieben werden!"
+
+    issueCount = 0
+    for (tracker, issues) in itertools.groupby(store.iterOpenIssues(project.id), lambda issue : issue[1]) :
+        yield ""
+        yield "h2. %s" % (tracker or "Ohne Tracker",)
+        yield ""
+        yield "|_. Ticket |_. Status |_. Priorität |_. Zugewiesen an |_. Fortschritt |_. Zuletzt geändert |"
+        for (issueId, tracker, status, priority, subject, assignedTo, doneRatio, updatedOn) in issues :
+            subject = escapeTableCell(subject)
+            status = escapeTableCell(status)
+            priority = escapeTableCell(priority)
+            assignedTo = escapeTableCell(assignedTo)
+            doneRatio = doneRatio or 0
+            updatedOnDate = updatedOn.strftime("%d.%m.%Y") if updatedOn is not None else ""
+            yield "| #%(issueId)i %(subject)s | %(status)s | %(priority)s | %(assignedTo)s | %(doneRatio)i %% | %(updatedOnDate)s |" % locals()
+            issueCount += 1
+    if issueCount == 0 :
+        yield ""
+        yield "Keine offenen Tickets."
+
+def iterIssueOverviews(store, projectTree) :
+    """
+    Renders the overviews of all projects with issues in depth first order.
+
+    Projects whose issues are all closed get an overview, too, so pages
+    written earlier are emptied.
+
+    @return: iterator over (project, lines)
+    """
+    projectIds = store.getProjectIds()
+    for project in projectTree.iter_dfs() :
+        if project.id in projectIds :
+            yield (project, list(iterIssueOverviewLines(store, projectTree, project)))
+
+def publishIssueOverviews(redmineHandle, overviews, targetPage, workers = 1, renderCache = None) :
+    """
+    Stores each overview on C{targetPage} in the wiki of its project.
+
+    Projects whose wiki cannot be written are skipped.
+
+    @param overviews: iterator over (project, lines) of L{iterIssueOverviews}
+    @return: (number of updated pages, number of skipped projects)
+    """
+    def update((project, lines)) :
+        try :
+            return updateWikiPage(redmineHandle, project.identifier, targetPage, "\n".join(lines),
+                                  targetPage.replace('_', ' '), renderCache)
+        except (redmine_exceptions.ForbiddenError, redmine_exceptions.ResourceNotFoundError) :
+            return None
+
+    counts = {True : 0, False : 0, None : 0} # updated, unchanged, skipped
+    if workers <= 1 :
+        for overview in overviews :
+            counts[update(overview)] += 1
+        return (counts[True], counts[None])
+    # the overviews are rendered from the store in this thread; at most
+    # a few of them wait for their upload
+    pool = ThreadPool(workers)
+    try :
+        pending = collections.deque()
+        for overview in overviews :
+            pending.append(pool.apply_async(update, (overview,)))
+            if len(pending) >= 2 * workers :
+                counts[pending.popleft().get()] += 1
+        while pending :
+            counts[pending.popleft().get()] += 1
+    finally :
+        pool.terminate()
+    return (counts[True], counts[None])
+
+#---
+class CLI(object) :
+    """
+    Encapsulates the Command Line Interface.
+    """
+    def __init__(self) :
+        self._parser = parser = self._createParser()
+        self._args = args = parser.parse_args()
+        if args.apikey is None :
+            print "You must provide a Redmine API-Key as first argument."
+            sys.exit(1)
+            return
+
+    def _createParser(self) :
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--apikey", help = "Valid API-key to use the Python REST-API")
+        parser.add_argument("-t", "--targetpage",
+                            help = "Name of the Wiki page each project's overview should be stored on",
+                            default = "")
+        parser.add_argument("--issue-store", dest = "issuestore",
+                            help = "Path of the local issue store (default: next to the cache file)",
+                            default = None)
+        parser.add_argument("--full", action = "store_true",
+                            help = "Fetch all issues, not only those changed since the last run")
+        addCrawlArguments(parser)
+
+        return parser
+
+    def getBaseURL(self) :
+        """
+        Base URL of the Redmine instance.
+        """
+        baseURL = 'https://redmine.itz.uni-halle.de'
+        return baseURL
+
+    def getApiKey(self) :
+        """
+        Valid API-key to use the REST-API of Redmine.
+        """
+        return self._args.apikey
+
+    def getTargetPage(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.targetpage
+
+    def getIssueStorePath(self) :
+        """
+        Path of the SQLite file of the issue store.
+        """
+        if self._args.issuestore :
+            return self._args.issuestore
+        return getIssueStorePath(self._args.cache or getDefaultCachePath())
+
+    def isFullSync(self) :
+        """True if all issues should be fetched."""
+        return self._args.full
+
+    def getWorkers(self) :
+        """Number of concurrent requests."""
+        return max(self._args.workers, 1)
+
+    def getCachePath(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.cache
+
+    def getProfilePath(self) :
+        """
+        @return: None, '-' for a summary on stderr or the path of a JSON report
+        """
+        return self._args.profile
+
+    def getBackend(self) :
+        """Name of the crawl backend."""
+        return self._args.backend
+
+    def getPageSize(self) :
+        """Number of items per listing request."""
+        return max(self._args.pagesize, 1)
+
+    def getRetries(self) :
+        """Retries of requests failing with a transient error."""
+        return max(self._args.retries, 0)
+
+#---
+def main() :
+    cli = CLI()
+    baseURL = cli.getBaseURL()
+    apiKey = cli.getApiKey()
+
+    redmineHandle = Redmine(baseURL, key = apiKey)
+    profilePath = cli.getProfilePath()
+    profiler = Profiler() if profilePath else NULL_PROFILER
+    if profilePath :
+        profiler.attach(redmineHandle)
+
+    workers = cli.getWorkers()
+    backend = createBackend(cli.getBackend(), redmineHandle, workers, pageSize = cli.getPageSize(),
+                            retries = cli.getRetries(), profiler = profiler)
+    if profilePath and backend.session is not None :
+        profiler.attach(backend.session)
+
+    allProjects = fetchProjects(backend, profiler)
+    if len(allProjects) == 0 :
+        print "You must provide a VALID Redmine API-Key!"
+        return
+    with profiler.phase('project tree') :
+        projectTree = ProjectTree(allProjects)
+
+    store = IssueStore(cli.getIssueStorePath(), baseURL)
+    try :
+        issueCount = syncIssues(backend, store, cli.isFullSync(), profiler)
+        print "%i issues fetched" % (issueCount,)
+
+        targetPage = cli.getTargetPage()
+        overviews = iterIssueOverviews(store, projectTree)
+        if not targetPage :
+            for (project, lines) in overviews :
+                print "=== %s" % (project.identifier,)
+                for line in lines :
+                    print line
+        else :
+            cachePath = cli.getCachePath()
+            renderCache = RenderCache(getRenderCachePath(cachePath)) if cachePath else None
+            with profiler.phase('wiki page update') :
+                (updateCount, skipCount) = publishIssueOverviews(redmineHandle, overviews, targetPage, workers,
+                                                                 renderCache)
+            print "%i pages updated, %i projects without writable wiki" % (updateCount, skipCount)
+            if renderCache is not None :
+                renderCache.save()
+    finally :
+        store.close()
+
+    if profilePath :
+        profiler.writeReport(profilePath)
+    return
+
+if __name__ == '__main__' :
+    try :
+        main()
+    except KeyboardInterrupt :
+        sys.exit(0)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cross-project graph of the links between wiki pages.
+
+The links are extracted whenever the search index stores a page text, so
+the graph is kept up to date by the same incremental crawl (see
+L{updateSearchIndex}). Backlinks, orphaned pages and dead links are then
+looked up in the adjacency tables of the index file instead of scanning
+any text.
+
+The report is not part of the index runs: they fetch no page texts.
+Run this script after them, e.g. with C{--update --report}; thanks to the
+incremental update only texts of new or changed pages are requested.
+"""
+
+#---
+#--- Python
+import sys
+import itertools
+import operator
+
+#---
+#--- 3rd party
+from redmine import Redmine
+
+#---
+#--- Local
+from search_index import SearchIndex, CLI as SearchIndexCLI, update, publishPage
+from instrumentation import Profiler, NULL_PROFILER
+
+#---
+# title key of the start page of a new wiki; the REST API does not tell the configured one
+DEFAULT_START_PAGE_KEY = 'wiki'
+
+#---
+class LinkGraph(SearchIndex) :
+    """
+    Queries over the links stored in a L{SearchIndex}.
+
+    A link targets a project by identifier or name and a page by its title
+    regardless of case, like Redmine resolves it.
+    """
+    def iterBacklinks(self, projectIdent) :
+        """
+        @return: iterator over (title, [(sourceProjectIdent, sourceTitle, sourceBreadcrumbTrail), ...])
+                 of the pages of the project linked from other pages, ordered by title
+        """
+        cursor = self._connection.execute("""
+            SELECT target.title, sourceProject.identifier, source.title, sourceProject.breadcrumb_trail
+            FROM projects AS targetProject
+            JOIN pages AS target ON target.project_id = targetProject.id
+            JOIN links ON links.target_key = target.title_key
+                      AND links.target_project IN (targetProject.identifier, targetProject.name_key)
+            JOIN pages AS source ON source.id = links.source_page_id
+            JOIN projects AS sourceProject ON sourceProject.id = source.project_id
+            WHERE targetProject.identifier = ? AND source.id != target.id
+            ORDER BY target.title, sourceProject.identifier, source.title""", (projectIdent,))
+        for (title, rows) in itertools.groupby(cursor, operator.itemgetter(0)) :
+            yield (title, [row[1:] for row in rows])
+
+    def iterOrphanPages(self) :
+        """
+        Pages without a parent page that no other page links to, apart from
+        the start pages of the wikis.
+
+        The start page a wiki is configured with cannot be read through the
+        REST API. Of the pages without a parent, the one titled 'Wiki' is
+        taken for it, otherwise the oldest one: opening a new wiki creates
+        its start page first.
+
+        @return: iterator over (projectIdent, title, projectBreadcrumbTrail)
+                 ordered by project and title
+        """
+        return self._connection.execute("""
+            SELECT project.identifier, page.title, project.breadcrumb_trail
+            FROM pages AS page
+            JOIN projects AS project ON project.id = page.project_id
+            WHERE page.parent_title IS NULL
+              AND page.id != (SELECT root.id FROM pages AS root
+                              WHERE root.project_id = page.project_id AND root.parent_title IS NULL
+                              ORDER BY root.title_key = ? DESC, root.created_on IS NULL,
+                                       root.created_on, root.id
+                              LIMIT 1)
+              AND NOT EXISTS (SELECT 1 FROM links
+                              WHERE links.target_key = page.title_key
+                                AND links.target_project IN (project.identifier, project.name_key)
+                                AND links.source_page_id != page.id)
+            ORDER BY project.identifier, page.title""", (DEFAULT_START_PAGE_KEY,))
+
+    def iterDeadLinks(self) :
+        """
+        Links to missing pages of projects whose wiki was crawled. Links to
+        projects that are unknown or whose wiki is not accessible cannot
+        be checked and are skipped.
+
+        @return: iterator over (sourceProjectIdent, sourceTitle, targetProjectIdent, targetTitle)
+                 ordered by source page
+        """
+        return self._connection.execute("""
+            SELECT sourceProject.identifier, source.title, targetProject.identifier, links.target_title
+            FROM projects AS targetProject
+            JOIN links ON links.target_project IN (targetProject.identifier, targetProject.name_key)
+            JOIN pages AS source ON source.id = links.source_page_id
+            JOIN projects AS sourceProject ON sourceProject.id = source.project_id
+            WHERE EXISTS (SELECT 1 FROM pages WHERE pages.project_id = targetProject.id)
+              AND NOT EXISTS (SELECT 1 FROM pages
+                              WHERE pages.project_id = targetProject.id AND pages.title_key = links.target_key)
+            ORDER BY sourceProject.identifier, source.title, targetProject.identifier, links.target_title""")
+
+#---
+def iterBacklinkLines(linkGraph, projectIdent) :
+    """
+    Renders a section per page of the project listing the pages linking to it.
+    """
+    yield "h2. Verweise auf Seiten dieses Projekts"
+    yield ""
+    for (title, sources) in linkGraph.iterBacklinks(projectIdent) :
+        prettyPageTitle = title.replace('_', ' ')
+        yield ""
+        yield "h3. [[%(projectIdent)s:%(prettyPageTitle)s]]" % locals()
+        yield ""
+        for (sourceProjectIdent, sourceTitle, sourceBreadcrumbTrail) in sources :
+            prettySourceTitle = sourceTitle.replace('_', ' ')
+            yield "* [[%(sourceProjectIdent)s:%(prettySourceTitle)s]] (%(sourceBreadcrumbTrail)s)" % locals()
+
+def iterLinkReportLines(linkGraph) :
+    """
+    Renders the report of orphaned pages and dead links.
+    """
+    yield "{{>toc}}"
+    yield ""
+    yield "h1. Verwaiste Seiten und tote Links"
+    yield ""
+    yield "Diese Seite wurde automatisch generiert. Manuelle Änderungen an dieser Seite werden beim nächsten Lauf überschrieben werden!"
+    yield ""
+    yield "h2. Verwaiste Seiten"
+    yield ""
+    yield "Seiten ohne übergeordnete Seite, auf die keine andere Seite verweist."
+    yield ""
+    for (projectIdent, title, projectBreadcrumbTrail) in linkGraph.iterOrphanPages() :
+        prettyPageTitle = title.replace('_', ' ')
+        yield "* [[%(projectIdent)s:%(prettyPageTitle)s]] (%(projectBreadcrumbTrail)s)" % locals()
+    yield ""
+    yield "h2. Tote Links"
+    yield ""
+    for (sourceProjectIdent, sourceTitle, targetProjectIdent, targetTitle) in linkGraph.iterDeadLinks() :
+        prettySourceTitle = sourceTitle.replace('_', ' ')
+        yield "* [[%(sourceProjectIdent)s:%(prettySourceTitle)s]] verweist auf @%(targetProjectIdent)s:%(targetTitle)s@" % locals()
+
+#---
+class CLI(SearchIndexCLI) :
+    """
+    Encapsulates the Command Line Interface.
+    """
+    def _addOutputArguments(self, parser) :
+        parser.add_argument("--report", action = "store_true",
+                            help = "Render the report of orphaned pages and dead links")
+        parser.add_argument("--backlinks",
+                            help = "Render the pages linking to the pages of the project with this identifier",
+                            default = None)
+
+    def isReporting(self) :
+        """True if the orphan and dead link report should be rendered."""
+        return self._args.report
+
+    def getBacklinkProject(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.backlinks
+
+#---
+def main() :
+    cli = CLI()
+    baseURL = cli.getBaseURL()
+    apiKey = cli.getApiKey()
+
+    redmineHandle = Redmine(baseURL, key = apiKey)
+    profilePath = cli.getProfilePath()
+    profiler = Profiler() if profilePath else NULL_PROFILER
+    if profilePath :
+        profiler.attach(redmineHandle)
+
+    linkGraph = LinkGraph(cli.getIndexPath(), baseURL)
+    try :
+        if cli.isUpdating() :
+            update(cli, redmineHandle, linkGraph, profiler)
+
+        backlinkProject = cli.getBacklinkProject()
+        if backlinkProject :
+            with profiler.phase('backlinks') :
+                pageLines = list(iterBacklinkLines(linkGraph, backlinkProject))
+            publishPage(cli, redmineHandle, pageLines, 'Verweise', profiler)
+        elif cli.isReporting() :
+            with profiler.phase('link report') :
+                pageLines = list(iterLinkReportLines(linkGraph))
+            publishPage(cli, redmineHandle, pageLines, 'Verwaiste Seiten und tote Links', profiler)
+    finally :
+        linkGraph.close()
+
+    if profilePath :
+        profiler.writeReport(profilePath)
+    return
+
+if __name__ == '__main__' :
+    try :
+        main()
+    except KeyboardInterrupt :
+        sys.exit(0)
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+On-disk list of projects whose wiki could not be read or was empty.
+"""
+
+#---
+#--- Python
+import os
+import time
+import json
+import threading
+
+#---
+def getNegativeCachePath(crawlCachePath) :
+    """
+    @return: Path of the negative cache kept next to the crawl cache
+    """
+    return os.path.splitext(crawlCachePath)[0] + '.negative.json'
+
+#---
+class NegativeCache(object) :
+    """
+    Projects whose wiki index answered 403 or 404 or listed no page.
+
+    Such projects are skipped without a request until their entry is
+    C{ttl} seconds old or the project itself changed. Creating the first
+    wiki page does not change the project, so empty wikis are only skipped
+    for C{emptyTTL} seconds. The file is JSON so entries can be inspected
+    and removed by hand.
+    """
+    FORMAT_VERSION = 1
+    FORBIDDEN = 'forbidden'
+    NOT_FOUND = 'not found'
+    EMPTY = 'empty'
+
+    def __init__(self, path, baseURL, ttl = 24 * 3600, refresh = False, emptyTTL = 3600) :
+        """
+        @param ttl: Seconds an entry stays valid
+        @param refresh: Ignore the stored entries; the file is rewritten with fresh ones
+        @param emptyTTL: Seconds an L{EMPTY} entry stays valid, at most C{ttl}
+        """
+        self._path = path
+        self._baseURL = baseURL
+        self._ttl = ttl
+        self._emptyTTL = min(emptyTTL, ttl)
+        self._lock = threading.Lock()
+        self._entries = {} # str(project id) -> {'reason', 'checked', 'updated_on'}
+        if not refresh :
+            self._load()
+
+    def _load(self) :
+        try :
+            with open(self._path, 'rb') as f :
+                data = json.load(f)
+        except (IOError, ValueError) :
+            return
+        if data.get('version') != self.FORMAT_VERSION or data.get('url') != self._baseURL :
+            return
+        now = time.time()
+        self._entries = dict((projectId, entry) for (projectId, entry) in data['projects'].iteritems()
+                             if not self._isExpired(entry, now))
+
+    def _isExpired(self, entry, now) :
+        ttl = self._emptyTTL if entry['reason'] == self.EMPTY else self._ttl
+        return now - entry['checked'] >= ttl
+
+    def _getProjectVersion(self, project) :
+        return str(project.updated_on) if project.updated_on is not None else None
+
+    def isSkipped(self, project) :
+        """
+        @return: True if the wiki of C{project} was recently found inaccessible or empty
+        """
+        with self._lock :
+            entry = self._entries.get(str(project.id))
+        # a watching process keeps its entries for longer than the TTL
+        return entry is not None and entry['updated_on'] == self._getProjectVersion(project) \
+            and not self._isExpired(entry, time.time())
+
+    def add(self, project, reason) :
+        """
+        @param reason: L{FORBIDDEN}, L{NOT_FOUND} or L{EMPTY}
+        """
+        with self._lock :
+            self._entries[str(project.id)] = {'reason' : reason,
+                                              'checked' : time.time(),
+                                              'updated_on' : self._getProjectVersion(project)}
+
+    def remove(self, project) :
+        with self._lock :
+            self._entries.pop(str(project.id), None)
+
+    def save(self) :
+        with self._lock :
+            data = {'version' : self.FORMAT_VERSION,
+                    'url' : self._baseURL,
+                    'projects' : self._entries}
+            tmpPath = self._path + '.tmp'
+            with open(tmpPath, 'wb') as f :
+                json.dump(data, f, indent = 1, sort_keys = True)
+            os.rename(tmpPath, self._path)
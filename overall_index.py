@@ -11,7 +11,22 @@ import logging
 #---
 #--- 3rd party
 from redmine import Redmine
-from redmine import exceptions as redmine_exceptions
+
+#---
+#--- Local
+from wiki_crawl import fetchProjects, getProjectList, iterProjectPages, addCrawlArguments, getBackend, createBackend, \
+    getDefaultCachePath, fetchPageAuthor
+from crawl_cache import CrawlCache
+from negative_cache import NegativeCache, getNegativeCachePath
+from crawl_checkpoint import CrawlCheckpoint, TimeBudgetExceeded, getCheckpointPath, getDeadline, \
+    addCheckpointArguments
+from wiki_upload import updateWikiPage, updateWikiPages
+from render_cache import RenderCache, getRenderCachePath, getDigest
+from instrumentation import Profiler, ProgressReporter, NULL_PROFILER
+from wiki_tree import ProjectTree, PageTree
+from wiki_mirror import WikiMirror
+from index_export import exportIndex, addExportArguments
+from recent_pages import RecentPages, iterRecentPagesLines, addRecentArguments
 
 # To disable all urllib3 warnings
 import urllib3
@@ -21,131 +36,13 @@ urllib3.disable_warnings()
 logging.captureWarnings(True)
 
 #---
-class ProjectTree(object) :
-    def __init__(self, allProjects ) :
-        self._projects = list(allProjects)
-        self._projectsByName = {} # name -> project
-        for project in self._projects :
-            self._projectsByName[project.name.encode('utf-8')] = project
-        self._projects.sort(key = lambda p : self.getBreadcrumbTrail(p))
-
-    def iter_dfs(self) :
-        for project in self._projects :
-            yield project
-
-    def getParent(self, project) :
-        """
-        @return: None or project.parent
-        """
-        try :
-            parentProjectName = project.parent.name.encode('utf-8')
-        except AttributeError :
-            parentProjectName = ''
-
-        if not parentProjectName :
-            parentProject = None
-        else :
-            parentProject =  self._projectsByName.get(parentProjectName, None)
-            if 0 :
-                print "DEBUG: parentName = %r" % (parentProjectName,)
-                print "DEBUG: parentObject %r" % (parentProject,)
-        return parentProject
-
-    def getBreadcrumbTrail(self, project, encoding = 'utf-8') :
-        """
-        @return: (..., parentName, projectName)
-        """
-        return list(p.name.encode(encoding) for p in self.getAncestorsAndProject(project))
-
-    def getAncestorProjects(self, project) :
-
-        def _iterAncestors(project) :
-            parent = self.getParent(project)
-            if parent is None :
-                return
-            yield parent
-            for a in _iterAncestors(parent) :
-                yield a
-
-        return list(reversed(list(_iterAncestors(project))))
-
-    def getAncestorsAndProject(self, project) :
-        return self.getAncestorProjects(project) + [project]
-
-
-#---
-class PageTree(object) :
-    def __init__(self, project, allPages) :
-        self._project = project
-        self._pages = list(allPages)
-        self._pagesByTitle = {} # title -> page
-        for page in self._pages :
-            self._pagesByTitle[page.title.encode('utf-8')] = page
-
-
-        self._pagesWithParent = {} # title -> {page -> [childPages, ...]}
-        for page in self._pages :
-            if 0 :
-                print "DEBUG: %r %r" % (project, page,)
-            self._insert(page)
-
-        self._pages.sort(key = lambda p : self.getBreadcrumbTrail(p))
-
-    def getParent(self, page) :
-        """
-        @return: None or page.parent
-        """
-        try :
-            parentPageTitle = page.parent.title.encode('utf-8')
-        except AttributeError :
-            parentPageTitle = ''
-
-        if not parentPageTitle :
-            parentPage = None
-        else :
-            parentPage =  self._pagesByTitle.get(parentPageTitle, None)
-            if 0 :
-                print "DEBUG: parentPageTitle = %r" % (parentPageTitle,)
-                print "DEBUG: parentPage %r" % (parentPage,)
-        return parentPage
-
-
-    def getBreadcrumbTrail(self, page, encoding = 'utf-8') :
-        """
-        @return: (..., parentPage, page)
-        """
-        return list(p.title.encode(encoding) for p in self.getAncestorsAndPage(page))
-
-
-    def getAncestorPages(self, page) :
-
-        def _iterAncestors(page) :
-            parent = self.getParent(page)
-            if parent is None :
-                return
-            yield parent
-            for a in _iterAncestors(parent) :
-                yield a
-
-        return list(reversed(list(_iterAncestors(page))))
-
-    def getAncestorsAndPage(self, page) :
-        return self.getAncestorPages(page) + [page]
-
-    def _insert(self, page) :
-        #self._pages.append(page)
-        #if parentPage is None :
-        #    self.pagesWithParent[page] = []
-        return
-
-    def iter_dfs(self) :
-        for page in self._pages :
-            yield page
-
-#---
-def printGlobalIndex(redmineHandle) :
+def printGlobalIndex(redmineHandle, **keywords) :
+    lines = iterGlobaleIndexLines(redmineHandle, **keywords)
+    if keywords.get('deadline', None) is not None :
+        # a crawl stopped by the time budget prints nothing
+        lines = list(lines)
     lineCount = 0
-    for line in iterGlobaleIndexLines(redmineHandle) :
+    for line in lines :
         lineCount += 1
         print line
     return lineCount
@@ -156,38 +53,104 @@ def iterGlobaleIndexLines(redmineHandle, **keywords) :
 
     @keyword printProgress: If True progress information will be printed to stdout
     @type    printProgress: bool
+    @keyword workers: Number of projects whose wiki pages are fetched concurrently
+    @type    workers: int
+    @keyword cache: Page metadata of earlier runs
+    @type    cache: None or L{CrawlCache}
+    @keyword profiler: Records requests and the time spent per phase
+    @type    profiler: L{Profiler}
+    @keyword backend: Backend used for the crawl, default: the Redmine client
+    @type    backend: L{RedmineBackend} or L{RestBackend}
+    @keyword projects: Project list fetched earlier in this run, default: fetch it
+    @type    projects: None or [ProjectRecord, ...]
+    @keyword negativeCache: Projects without accessible wiki pages of earlier runs
+    @type    negativeCache: None or L{NegativeCache}
+    @keyword mirror: Render from this mirror instead of crawling Redmine
+    @type    mirror: None or L{WikiMirror}
+    @keyword checkpoint: Projects finished by an interrupted run; updated during the crawl
+    @type    checkpoint: None or L{CrawlCheckpoint}
+    @keyword deadline: time.time() value at which the crawl stops with L{TimeBudgetExceeded}
+    @type    deadline: None or float
     """
-    printProgress = keywords.get('printProgress', False)
-    baseURL = redmineHandle.url
-    r = redmineHandle
+    (projectTree, projectPages) = crawlGlobalIndex(redmineHandle, **keywords)
+    for line in iterGlobaleIndexLinesFromPages(redmineHandle.url, projectTree, projectPages, **keywords) :
+        yield line
 
-    allProjects = r.project.all()
-    projectCount = len(allProjects)
-    if projectCount == 0 :
-        return
+def crawlGlobalIndex(redmineHandle, **keywords) :
+    """
+    Fetches the projects and, lazily, their wiki pages, by default without page details.
+
+    Takes the same keywords as L{iterGlobaleIndexLines}.
 
-    projectTree = ProjectTree(allProjects)
+    @keyword withAuthor: Fetch page details to learn the author names, e.g. for an export
+    @type    withAuthor: bool
+    @return: (projectTree, iterator over (project, allPages))
+    """
+    mirror = keywords.get('mirror', None)
+    if mirror is not None :
+        projectTree = mirror.getProjectTree()
+        return (projectTree, mirror.iterProjectPages(projectTree))
+
+    r = redmineHandle
+    profiler = keywords.get('profiler', NULL_PROFILER)
+    backend = getBackend(r, **keywords)
+
+    allProjects = getProjectList(backend, keywords.get('projects', None), profiler)
+    if len(allProjects) == 0 :
+        return (ProjectTree([]), iter([]))
+
+    with profiler.phase('project tree') :
+        projectTree = ProjectTree(allProjects)
+
+    workers = keywords.get('workers', 1)
+    cache = keywords.get('cache', None)
+    # the global index shows no authors, so by default no page details are fetched
+    projectPages = iterProjectPages(backend, projectTree.iter_dfs(), workers = workers, cache = cache,
+                                    withAuthor = keywords.get('withAuthor', False), profiler = profiler,
+                                    negativeCache = keywords.get('negativeCache', None),
+                                    checkpoint = keywords.get('checkpoint', None),
+                                    deadline = keywords.get('deadline', None))
+    return (projectTree, projectPages)
+
+def iterGlobaleIndexLinesFromPages(baseURL, projectTree, projectPages, **keywords) :
+    """
+    Renders the global index from already fetched wiki pages.
+
+    @param projectPages: (project, allPages) pairs in the order of C{projectTree.iter_dfs()}
+    @keyword printProgress: If True progress information will be printed to stdout
+    @type    printProgress: bool
+    @keyword profiler: Records the time spent per phase
+    @type    profiler: L{Profiler}
+    @keyword renderCache: Sections rendered earlier; only sections of projects whose
+                          pages changed are rendered again
+    @type    renderCache: None or L{RenderCache}
+    @keyword recent: Number of the most recently changed pages listed at the end, default: none
+    @type    recent: int
+    @keyword backend: Fetches the authors of the recently changed pages, as the index
+                      is crawled without them; without a backend they are left out
+    @type    backend: None or L{RedmineBackend} or L{RestBackend}
+    """
+    printProgress = keywords.get('printProgress', False)
+    profiler = keywords.get('profiler', NULL_PROFILER)
+    renderCache = keywords.get('renderCache', None)
+    recent = keywords.get('recent', 0)
+    recentPages = RecentPages(recent) if recent > 0 else None
+    progress = ProgressReporter(len(projectTree))
 
     FIRST_TIME = True
 
-    for (projNum, project) in enumerate(projectTree.iter_dfs()) :
+    for (projNum, (project, allPages)) in enumerate(projectPages) :
         breadcrumbTrail = " » ".join(projectTree.getBreadcrumbTrail(project))
         pid = project.id # numeric
-        projectIdent = project.identifier.encode('utf-8', 'ignore') # symbolic
+        projectIdent = project.identifier # symbolic
         pname = project.name
 
         # singlePage = r.wiki_page.get('Mitarbeiter', project_id = PID)
         # yield singlePage.text
 
-        allPagesQuery =  r.wiki_page.filter(project_id = pid)
-        try :
-            allPages = list(allPagesQuery)
-        except redmine_exceptions.ForbiddenError :
-            #print "Cannot access pages of project '%(pident)s'!" % locals()
-            allPages = []
         if len(allPages) > 0 :
             if printProgress :
-                print "%i/%i:" %(projNum+1, projectCount),
+                progress.report(projNum+1, len(allPages))
             if FIRST_TIME :
                 yield "{{>toc}}"
                 yield ""
@@ -195,33 +158,124 @@ def iterGlobaleIndexLines(redmineHandle, **keywords) :
                 yield ""
                 FIRST_TIME = False
 
-            yield ""
-            yield "h2. %(breadcrumbTrail)s" % locals()
-            yield ""
-
-            pageTree = PageTree(project, allPages)
-            for (pageNum,page) in enumerate(pageTree.iter_dfs()) :
-                if printProgress :
-                    print ".",
-
-                pageTitle = page.title.encode('utf-8', 'ignore')
-                prettyPageTitle = pageTitle.replace('_', ' ')
-                pageAuthor = page.author.name.encode('utf-8', 'ignore')
-                pageCreatedOn = page.created_on
-                pageUpdatedOn = page.updated_on
-                ancestors = pageTree.getAncestorsAndPage(page) # getAncestorPages(page)
-                indentCount = len(ancestors) + 1
-                indent = "*" * indentCount
-                yield "%(indent)s [[%(projectIdent)s:%(prettyPageTitle)s]]" % locals()
-                # yield "%(indent)s %(pageTitle)s (von %(pageAuthor)s) -> %(ancestors)r" % locals()
+            for line in getProjectSectionLines(baseURL, breadcrumbTrail, project, allPages, renderCache, profiler) :
+                yield line
+            if recentPages is not None :
+                with profiler.phase('recent pages') :
+                    recentPages.addPages(project, breadcrumbTrail, allPages)
 
-            if printProgress :
-                print ""
+    if recentPages is not None and not FIRST_TIME :
+        backend = keywords.get('backend', None)
+        if backend is not None :
+            recentPages.fillAuthors(lambda project, title : fetchPageAuthor(backend, project, title, profiler))
+        for line in iterRecentPagesLines(recentPages.getEntries()) :
+            yield line
+
+def getShardPage(targetPage, rootProject) :
+    """
+    @return: Name of the wiki page holding the index of C{rootProject} and its subprojects
+    """
+    return "%s_%s" % (targetPage, rootProject.identifier)
 
-            yield ""
-            yield '"Hauptseite":%(baseURL)s/projects/%(projectIdent)s/wiki' % locals()
-            yield '"Seiten nach Titel sortiert":%(baseURL)s/projects/%(projectIdent)s/wiki/index' % locals()
-            yield '"Seiten nach Datum sortiert":%(baseURL)s/projects/%(projectIdent)s/wiki/date_index' % locals()
+def iterGlobalIndexShardsFromPages(baseURL, projectTree, projectPages, targetPage, **keywords) :
+    """
+    Renders the global index as one document per top-level project and a
+    root document linking them.
+
+    Top-level projects without any wiki page in their subtree get no
+    document.
+
+    @param projectPages: (project, allPages) pairs in the order of C{projectTree.iter_dfs()}
+    @param targetPage: Name of the root page; the shards are named after it, see L{getShardPage}
+    @keyword profiler: Records the time spent per phase
+    @type    profiler: L{Profiler}
+    @keyword renderCache: Sections rendered earlier
+    @type    renderCache: None or L{RenderCache}
+    @return: iterator over (shardPage, title, lines); the root document comes last
+    """
+    profiler = keywords.get('profiler', NULL_PROFILER)
+    renderCache = keywords.get('renderCache', None)
+
+    shards = [] # (shardPage, rootName)
+    rootProject = None
+    shardLines = []
+
+    def finishShard() :
+        if shardLines :
+            shardPage = getShardPage(targetPage, rootProject)
+            shards.append((shardPage, rootProject.name))
+            lines = ["{{>toc}}", "", "h1. Global Index: %s" % (rootProject.name,), ""] + shardLines
+            return (shardPage, shardPage.replace('_', ' '), lines)
+        return None
+
+    for (project, allPages) in projectPages :
+        if projectTree.getDepth(project) == 1 :
+            shard = finishShard()
+            if shard is not None :
+                yield shard
+            rootProject = project
+            shardLines = []
+        if len(allPages) > 0 :
+            breadcrumbTrail = " » ".join(projectTree.getBreadcrumbTrail(project))
+            shardLines.extend(getProjectSectionLines(baseURL, breadcrumbTrail, project, allPages,
+                                                     renderCache, profiler))
+    shard = finishShard()
+    if shard is not None :
+        yield shard
+
+    lines = ["h1. Global Index", ""]
+    for (shardPage, rootName) in shards :
+        lines.append("* [[%s|%s]]" % (shardPage, rootName))
+    yield (targetPage, targetPage.replace('_', ' '), lines)
+
+def getProjectSectionLines(baseURL, breadcrumbTrail, project, allPages, renderCache = None,
+                           profiler = NULL_PROFILER) :
+    """
+    @return: Lines of the section of C{project}, taken from C{renderCache} if its pages did not change
+    """
+    if renderCache is None :
+        return iterProjectSectionLines(baseURL, breadcrumbTrail, project, allPages, profiler)
+    sectionKey = getSectionKey(baseURL, breadcrumbTrail, project, allPages)
+    sectionLines = renderCache.getSection(sectionKey)
+    if sectionLines is None :
+        sectionLines = list(iterProjectSectionLines(baseURL, breadcrumbTrail, project, allPages, profiler))
+        renderCache.setSection(sectionKey, sectionLines)
+    return sectionLines
+
+SECTION_FORMAT_VERSION = 1 # increase whenever iterProjectSectionLines changes
+
+def getSectionKey(baseURL, breadcrumbTrail, project, allPages) :
+    """
+    @return: Fingerprint of everything the section of C{project} depends on
+    """
+    return getDigest(SECTION_FORMAT_VERSION, baseURL, breadcrumbTrail, project.identifier,
+                     [(page.title, page.parent_title) for page in allPages])
+
+def iterProjectSectionLines(baseURL, breadcrumbTrail, project, allPages, profiler = NULL_PROFILER) :
+    """
+    Renders the C{h2.} section of a single project of the global index.
+    """
+    projectIdent = project.identifier # symbolic
+    yield ""
+    yield "h2. %(breadcrumbTrail)s" % locals()
+    yield ""
+
+    with profiler.phase('page tree') :
+        pageTree = PageTree(project, allPages)
+    for (pageNum,page) in enumerate(pageTree.iter_dfs()) :
+        pageTitle = page.title
+        prettyPageTitle = pageTitle.replace('_', ' ')
+        pageCreatedOn = page.created_on
+        pageUpdatedOn = page.updated_on
+        indentCount = pageTree.getDepth(page) + 1
+        indent = "*" * indentCount
+        yield "%(indent)s [[%(projectIdent)s:%(prettyPageTitle)s]]" % locals()
+        # yield "%(indent)s %(pageTitle)s (von %(pageAuthor)s) -> %(ancestors)r" % locals()
+
+    yield ""
+    yield '"Hauptseite":%(baseURL)s/projects/%(projectIdent)s/wiki' % locals()
+    yield '"Seiten nach Titel sortiert":%(baseURL)s/projects/%(projectIdent)s/wiki/index' % locals()
+    yield '"Seiten nach Datum sortiert":%(baseURL)s/projects/%(projectIdent)s/wiki/date_index' % locals()
 
 #---
 class CLI(object) :
@@ -245,6 +299,15 @@ class CLI(object) :
         parser.add_argument("-p", "--projectid",
                             help = "Id of the project the target wiki page belongs to",
                             default = "")
+        parser.add_argument("--mirror",
+                            help = "Render from the SQLite mirror written by wiki_mirror.py instead of crawling Redmine",
+                            default = None)
+        parser.add_argument("--shard", action = "store_true",
+                            help = "Write one child page per top-level project and a root page linking them")
+        addCrawlArguments(parser)
+        addCheckpointArguments(parser)
+        addExportArguments(parser)
+        addRecentArguments(parser)
 
         return parser
 
@@ -271,6 +334,76 @@ class CLI(object) :
     def getProjectId(self) :
         return self._args.projectid
 
+    def getWorkers(self) :
+        """Number of concurrent wiki page requests."""
+        return max(self._args.workers, 1)
+
+    def getCachePath(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.cache
+
+    def getProfilePath(self) :
+        """
+        @return: None, '-' for a summary on stderr or the path of a JSON report
+        """
+        return self._args.profile
+
+    def getBackend(self) :
+        """Name of the crawl backend."""
+        return self._args.backend
+
+    def getPageSize(self) :
+        """Number of projects per listing request."""
+        return max(self._args.pagesize, 1)
+
+    def getRetries(self) :
+        """Retries of requests failing with a transient error."""
+        return max(self._args.retries, 0)
+
+    def getNegativeTTL(self) :
+        """Seconds projects without accessible wiki pages are skipped."""
+        return self._args.negativettl * 3600
+
+    def isRefreshForced(self) :
+        """True if projects skipped in earlier runs should be checked again."""
+        return self._args.refresh
+
+    def isSharded(self) :
+        """True if the index should be split into one page per top-level project."""
+        return self._args.shard
+
+    def getMirrorPath(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.mirror
+
+    def isResuming(self) :
+        """True if the crawl should continue from the checkpoint of an interrupted run."""
+        return self._args.resume
+
+    def getTimeBudget(self) :
+        """
+        @return: Seconds the crawl may take or None
+        """
+        return self._args.timebudget * 60 if self._args.timebudget is not None else None
+
+    def getExportFormat(self) :
+        """
+        @return: None or the JSON format of the export mode
+        """
+        return self._args.export
+
+    def getOutputPath(self) :
+        """Path of the export, '-' for stdout."""
+        return self._args.output
+
+    def getRecentCount(self) :
+        """Number of recently changed pages listed at the end, 0 for none."""
+        return max(self._args.recent, 0)
+
 #---
 def main() :
     cli = CLI()
@@ -278,32 +411,109 @@ def main() :
     apiKey = cli.getApiKey()
 
     redmineHandle = Redmine(baseURL, key = apiKey, requests={'verify': False})
-
-
-    allProjects = redmineHandle.project.all()
-    projectCount = len(allProjects)
-    if projectCount == 0 :
-        print "You must provide a VALID Redmine API-Key!"
-        return
+    profilePath = cli.getProfilePath()
+    profiler = Profiler() if profilePath else NULL_PROFILER
+    if profilePath :
+        profiler.attach(redmineHandle)
+
+    workers = cli.getWorkers()
+    mirrorPath = cli.getMirrorPath()
+    mirror = WikiMirror(mirrorPath, baseURL) if mirrorPath else None
+    if mirror is not None :
+        # no requests at all until the upload
+        if not mirror.isSynced() :
+            print "The mirror is empty, run wiki_mirror.py first!"
+            return
+        (backend, allProjects) = (None, None)
+    else :
+        backend = createBackend(cli.getBackend(), redmineHandle, workers, verify = False, pageSize = cli.getPageSize(),
+                                retries = cli.getRetries(), profiler = profiler)
+        if profilePath and backend.session is not None :
+            profiler.attach(backend.session)
+
+        # fetched once: validates the API key and feeds the index
+        allProjects = fetchProjects(backend, profiler)
+        projectCount = len(allProjects)
+        if projectCount == 0 :
+            print "You must provide a VALID Redmine API-Key!"
+            return
 
     targetPage = cli.getTargetPage()
     projectId = cli.getProjectId()
-    print projectId, targetPage
-    if not targetPage or not projectId:
-        lineCount = printGlobalIndex(redmineHandle)
-    else :
-        pageLines = list(iterGlobaleIndexLines(redmineHandle, printProgress = True))
-        newText = "\n".join(pageLines)
-        oldPage = redmineHandle.wiki_page.get(targetPage, project_id=projectId)
-        oldText = oldPage.text.encode('utf-8')
-        if oldText != newText :
-            redmineHandle.wiki_page.update(targetPage,
-                                           project_id = projectId,
-                                           title = 'Global index',
-                                           text = newText,
-                                           parent_title ='',
-                                           comments = 'automatisch aktualisiert')
+    cachePath = cli.getCachePath()
+    cache = CrawlCache(cachePath, baseURL) if cachePath else None
+    renderCache = RenderCache(getRenderCachePath(cachePath)) if cachePath else None
+    negativeCache = NegativeCache(getNegativeCachePath(cachePath), baseURL, cli.getNegativeTTL(),
+                                  cli.isRefreshForced()) if cachePath else None
+    exportFormat = cli.getExportFormat()
+    if not exportFormat :
+        print projectId, targetPage
+    # nothing is published until the crawl finished, possibly over several runs
+    deadline = getDeadline(cli.getTimeBudget())
+    checkpoint = None
+    if mirror is None and (cli.isResuming() or deadline is not None) :
+        # an export crawls the authors as well
+        checkpointKey = 'global:export' if exportFormat else 'global'
+        checkpoint = CrawlCheckpoint(getCheckpointPath(cachePath or getDefaultCachePath()), baseURL, checkpointKey,
+                                     cli.isResuming())
+    try :
+        if exportFormat :
+            # the export carries the authors; with --cache only new or changed pages need a detail request
+            (projectTree, projectPages) = crawlGlobalIndex(redmineHandle, workers = workers, cache = cache,
+                                                           profiler = profiler, backend = backend, projects = allProjects,
+                                                           negativeCache = negativeCache, mirror = mirror,
+                                                           checkpoint = checkpoint, deadline = deadline,
+                                                           withAuthor = True)
+            exportIndex(baseURL, projectTree, projectPages, exportFormat, cli.getOutputPath(),
+                        buffered = deadline is not None)
+        elif cli.isSharded() :
+            (projectTree, projectPages) = crawlGlobalIndex(redmineHandle, workers = workers, cache = cache,
+                                                           profiler = profiler, backend = backend, projects = allProjects,
+                                                           negativeCache = negativeCache, mirror = mirror,
+                                                           checkpoint = checkpoint, deadline = deadline)
+            documents = iterGlobalIndexShardsFromPages(baseURL, projectTree, projectPages, targetPage or "Global_index",
+                                                       profiler = profiler, renderCache = renderCache)
+            if not targetPage or not projectId :
+                if deadline is not None :
+                    documents = list(documents)
+                for (shardPage, title, lines) in documents :
+                    print "=== %s" % (shardPage,)
+                    for line in lines :
+                        print line
+            else :
+                documents = [(shardPage, title, "\n".join(lines), targetPage if shardPage != targetPage else '')
+                             for (shardPage, title, lines) in documents]
+                with profiler.phase('wiki page update') :
+                    # the root page must exist before the shards can become its children
+                    updateWikiPages(redmineHandle, projectId, documents[-1:], 1, renderCache)
+                    updateWikiPages(redmineHandle, projectId, documents[:-1], workers, renderCache)
+        elif not targetPage or not projectId:
+            lineCount = printGlobalIndex(redmineHandle, workers = workers, cache = cache, profiler = profiler,
+                                         backend = backend, projects = allProjects, renderCache = renderCache,
+                                         negativeCache = negativeCache, mirror = mirror,
+                                         checkpoint = checkpoint, deadline = deadline, recent = cli.getRecentCount())
+        else :
+            pageLines = list(iterGlobaleIndexLines(redmineHandle, printProgress = True, workers = workers, cache = cache,
+                                                   profiler = profiler, backend = backend, projects = allProjects,
+                                                   renderCache = renderCache, negativeCache = negativeCache,
+                                                   mirror = mirror, checkpoint = checkpoint, deadline = deadline,
+                                                   recent = cli.getRecentCount()))
+            newText = "\n".join(pageLines)
+            with profiler.phase('wiki page update') :
+                updateWikiPage(redmineHandle, projectId, targetPage, newText, 'Global index', renderCache)
+    except TimeBudgetExceeded :
+        checkpoint.close()
+        print >> sys.stderr, "Time budget exhausted after %d projects, continue with --resume" % (len(checkpoint),)
+        if profilePath :
+            profiler.writeReport(profilePath)
+        return
+    if checkpoint is not None :
+        checkpoint.remove()
+    if renderCache is not None :
+        renderCache.save()
 
+    if profilePath :
+        profiler.writeReport(profilePath)
     return
 
 if __name__ == '__main__' :
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+The most recently changed wiki pages, collected while the index is rendered.
+"""
+
+#---
+#--- Python
+import heapq
+
+#---
+class RecentPages(object) :
+    """
+    Keeps the C{limit} pages with the latest C{updated_on} in a bounded
+    min-heap, so a single pass over all pages needs memory for C{limit}
+    entries only. Of pages changed at the same time the one seen first wins.
+
+    Entries have the shape of the topic index entries: (prettyPageTitle,
+    projectIdent, projectBreadcrumbTrail, pageAuthor, pageUpdatedOn, pageCreatedOn).
+    """
+    def __init__(self, limit) :
+        self._limit = limit
+        self._heap = [] # (pageUpdatedOn, -sequence, entry, source), the oldest page on top
+        self._sequence = 0
+
+    def isCandidate(self, updatedOn) :
+        """
+        @return: True if a page changed at C{updatedOn} would currently be kept
+        """
+        if updatedOn is None or self._limit <= 0 :
+            return False
+        return len(self._heap) < self._limit or updatedOn > self._heap[0][0]
+
+    def add(self, entry, source = None) :
+        """
+        @param source: (project, pageTitle) the entry was built from, if known
+        """
+        updatedOn = entry[4]
+        self._sequence += 1
+        if not self.isCandidate(updatedOn) :
+            return
+        item = (updatedOn, -self._sequence, entry, source)
+        if len(self._heap) < self._limit :
+            heapq.heappush(self._heap, item)
+        else :
+            heapq.heapreplace(self._heap, item)
+
+    def addPages(self, project, projectBreadcrumbTrail, allPages) :
+        """
+        Offers the pages of a project; entries are only built for pages that are kept.
+        """
+        projectIdent = project.identifier
+        for page in allPages :
+            if self.isCandidate(page.updated_on) :
+                self.add((page.title.replace('_', ' '), projectIdent, projectBreadcrumbTrail,
+                          page.author_name, page.updated_on, page.created_on), (project, page.title))
+            else :
+                self._sequence += 1
+
+    def iterEntries(self, entries) :
+        """
+        Passes C{entries} through while offering each of them.
+        """
+        for entry in entries :
+            self.add(entry)
+            yield entry
+
+    def fillAuthors(self, fetchAuthor) :
+        """
+        Looks up the authors missing from the kept entries, e.g. of a crawl
+        without page details; this costs one call per kept page at most.
+
+        @param fetchAuthor: function(project, pageTitle) returning the author name or None
+        """
+        for (index, (updatedOn, sequence, entry, source)) in enumerate(self._heap) :
+            if entry[3] is None and source is not None :
+                entry = entry[:3] + (fetchAuthor(*source),) + entry[4:]
+                self._heap[index] = (updatedOn, sequence, entry, source)
+
+    def getEntries(self) :
+        """
+        @return: [entry, ...] the most recently changed page first
+        """
+        return [entry for (updatedOn, sequence, entry, source) in sorted(self._heap, reverse = True)]
+
+#---
+def iterRecentPagesLines(entries) :
+    """
+    Renders the section listing the entries of L{RecentPages.getEntries}.
+    """
+    yield ""
+    yield "h2. Zuletzt geänderte Seiten"
+    yield ""
+    for (prettyPageTitle, projectIdent, projectBreadcrumbTrail, pageAuthor, pageUpdatedOn, pageCreatedOn) in entries :
+        updatedOn = pageUpdatedOn.strftime("%d.%m.%Y %H:%M")
+        if pageAuthor is None :
+            yield "* [[%(projectIdent)s:%(prettyPageTitle)s]] (%(projectBreadcrumbTrail)s) (geändert am %(updatedOn)s)" % locals()
+        else :
+            yield "* [[%(projectIdent)s:%(prettyPageTitle)s]] (%(projectBreadcrumbTrail)s) (geändert am %(updatedOn)s von %(pageAuthor)s)" % locals()
+
+def addRecentArguments(parser) :
+    """
+    Adds the command line option of the recently changed pages section to C{parser}.
+    """
+    parser.add_argument("--recent", type = int,
+                        help = "Append a section listing the N most recently changed wiki pages",
+                        default = 0)
+    return parser
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+On-disk cache of rendered index sections and of the uploaded page texts.
+"""
+
+#---
+#--- Python
+import os
+import hashlib
+import threading
+import cPickle as pickle
+
+#---
+def getDigest(*parts) :
+    """
+    @return: Hex digest over the C{repr} of all C{parts}
+    """
+    digest = hashlib.sha1()
+    for part in parts :
+        digest.update(repr(part))
+    return digest.hexdigest()
+
+def getRenderCachePath(crawlCachePath) :
+    """
+    @return: Path of the render cache kept next to the crawl cache
+    """
+    return os.path.splitext(crawlCachePath)[0] + '.render'
+
+#---
+class RenderCache(object) :
+    """
+    Rendered sections keyed by a fingerprint of their input, and digests
+    of the last text uploaded to each target page.
+
+    Like the L{CrawlCache} only the sections used since the cache was
+    opened are written back by L{save}.
+    """
+    FORMAT_VERSION = 1
+
+    def __init__(self, path) :
+        """
+        @param path: Path of the pickle file or None
+        """
+        self._path = path
+        self._lock = threading.Lock() # uploads may run concurrently
+        self._sections = {} # key -> [line, ...]
+        self._usedSections = {} # key -> [line, ...]
+        self._uploadDigests = {} # (projectId, targetPage) -> digest
+        self._load()
+
+    def _load(self) :
+        if self._path is None :
+            return
+        try :
+            with open(self._path, 'rb') as f :
+                data = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) :
+            return
+        if data.get('version') != self.FORMAT_VERSION :
+            return
+        self._sections = data['sections']
+        self._uploadDigests = data['uploads']
+
+    def getSection(self, key) :
+        """
+        @return: [line, ...] rendered earlier for C{key} or None
+        """
+        lines = self._usedSections.get(key)
+        if lines is None :
+            lines = self._sections.get(key)
+            if lines is not None :
+                self._usedSections[key] = lines
+        return lines
+
+    def setSection(self, key, lines) :
+        self._usedSections[key] = lines
+
+    def getUploadDigest(self, projectId, targetPage) :
+        """
+        @return: Digest of the text last uploaded to C{targetPage} or None
+        """
+        with self._lock :
+            return self._uploadDigests.get((projectId, targetPage))
+
+    def setUploadDigest(self, projectId, targetPage, digest) :
+        with self._lock :
+            self._uploadDigests[(projectId, targetPage)] = digest
+
+    def save(self) :
+        """
+        Writes the sections used since the last save and all upload digests.
+        """
+        if self._path is not None :
+            data = {'version' : self.FORMAT_VERSION,
+                    'sections' : self._usedSections,
+                    'uploads' : self._uploadDigests}
+            tmpPath = self._path + '.tmp'
+            with open(tmpPath, 'wb') as f :
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmpPath, self._path)
+        self._sections = self._usedSections
+        self._usedSections = {}
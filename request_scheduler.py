@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Retries and adaptive concurrency for the requests of the crawl.
+
+Under load Redmine (or the proxy in front of it) answers with 429, 502,
+503 or 504, or drops connections. L{RequestScheduler} retries such
+requests with jittered exponential backoff and adapts the number of
+requests in flight AIMD-style: it grows by one per round of successful
+requests and is halved on a transient error or when the latency climbs
+well above the best latency seen so far.
+"""
+
+#---
+#--- Python
+import re
+import time
+import random
+import threading
+
+#---
+#--- 3rd party
+import requests
+from redmine import exceptions as redmine_exceptions
+
+#---
+#--- Local
+from instrumentation import NULL_PROFILER
+
+#---
+TRANSIENT_STATUS_CODES = (429, 502, 503, 504)
+
+def getErrorStatus(error) :
+    """
+    @return: HTTP status code of a C{redmine.exceptions.UnknownError} or None
+    """
+    status = getattr(error, 'status', None)
+    if status is None :
+        match = re.search(r'code (\d+)', str(error))
+        if match :
+            status = int(match.group(1))
+    return status
+
+def isTransientError(error) :
+    """
+    @return: True if the request may succeed when it is repeated later
+    """
+    if isinstance(error, redmine_exceptions.ServerError) :
+        return True
+    if isinstance(error, redmine_exceptions.UnknownError) :
+        return getErrorStatus(error) in TRANSIENT_STATUS_CODES
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+#---
+class RequestScheduler(object) :
+    """
+    Runs requests with at most L{getLimit} of them in flight and retries
+    transient errors.
+    """
+    LATENCY_FACTOR = 3.0 # back off if the smoothed latency exceeds the baseline by this factor
+    MIN_LATENCY_INCREASE = 0.05 # seconds; smaller increases are noise
+    DECREASE_INTERVAL = 1.0 # seconds between two decreases of the limit
+
+    def __init__(self, maxConcurrency = 1, retries = 5, baseDelay = 0.5, maxDelay = 30.0,
+                 profiler = NULL_PROFILER) :
+        """
+        @param maxConcurrency: Upper bound of the requests in flight
+        @param retries: Number of retries of a request failing with a transient error
+        @param baseDelay: Upper bound of the first backoff in seconds, doubled per retry
+        @param maxDelay: Upper bound of any backoff in seconds
+        """
+        self._maxConcurrency = max(maxConcurrency, 1)
+        self._retries = retries
+        self._baseDelay = baseDelay
+        self._maxDelay = maxDelay
+        self._profiler = profiler
+        self._condition = threading.Condition()
+        self._limit = float(self._maxConcurrency)
+        self._active = 0
+        self._latency = None # smoothed
+        self._baseline = None # lowest smoothed latency, slowly following the current one
+        self._lastDecrease = 0.0
+        self.retryCount = 0
+
+    def getLimit(self) :
+        """
+        @return: Current number of requests allowed in flight
+        """
+        return max(1, int(self._limit))
+
+    def _acquire(self) :
+        with self._condition :
+            while self._active >= self.getLimit() :
+                self._condition.wait()
+            self._active += 1
+
+    def _release(self) :
+        with self._condition :
+            self._active -= 1
+            self._condition.notify_all()
+
+    def _decrease(self) :
+        now = time.time()
+        if now - self._lastDecrease >= self.DECREASE_INTERVAL :
+            self._lastDecrease = now
+            self._limit = max(1.0, self._limit / 2)
+
+    def _onCompleted(self, seconds) :
+        with self._condition :
+            if self._latency is None :
+                self._latency = self._baseline = seconds
+            else :
+                self._latency = 0.8 * self._latency + 0.2 * seconds
+                self._baseline = min(self._latency, self._baseline + 0.01 * (self._latency - self._baseline))
+            if self._latency > max(self.LATENCY_FACTOR * self._baseline,
+                                   self._baseline + self.MIN_LATENCY_INCREASE) :
+                self._decrease()
+            else :
+                # additive increase: one more slot per round of successful requests
+                self._limit = min(float(self._maxConcurrency), self._limit + 1.0 / self._limit)
+            self._condition.notify_all()
+
+    def _onTransientError(self) :
+        with self._condition :
+            self.retryCount += 1
+            self._decrease()
+
+    def call(self, function, *args, **keywords) :
+        """
+        @return: C{function(*args, **keywords)}
+        @raise Exception: what C{function} raised, transient errors only after all retries
+        """
+        attempt = 0
+        while True :
+            self._acquire()
+            startTime = time.time()
+            try :
+                result = function(*args, **keywords)
+            except Exception as error :
+                self._release()
+                if not isTransientError(error) :
+                    # the server answered properly, e.g. 403 or 404
+                    self._onCompleted(time.time() - startTime)
+                    raise
+                self._onTransientError()
+                if attempt >= self._retries :
+                    raise
+                delay = random.uniform(0, min(self._maxDelay, self._baseDelay * 2 ** attempt))
+                attempt += 1
+                with self._profiler.phase('backoff') :
+                    time.sleep(delay)
+                continue
+            self._release()
+            self._onCompleted(time.time() - startTime)
+            return result
+
+#---
+class DirectScheduler(object) :
+    """
+    Runs every request at once and never retries.
+    """
+    def call(self, function, *args, **keywords) :
+        return function(*args, **keywords)
+
+DIRECT_SCHEDULER = DirectScheduler()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Crawl backend talking to the Redmine REST-API over one pooled HTTP session.
+
+The C{redmine} client opens a new connection for every request. This
+backend keeps up to C{concurrency} keep-alive connections in a single
+C{requests.Session} and never runs more than C{concurrency} requests at
+once, no matter how many threads use it.
+"""
+
+#---
+#--- Python
+import urllib
+import threading
+
+#---
+#--- 3rd party
+import requests
+from requests.adapters import HTTPAdapter
+from redmine import exceptions as redmine_exceptions
+
+#---
+#--- Local
+from wiki_crawl import PAGE_SIZE, fetchPagedList, iterIdPagedList
+from request_scheduler import DIRECT_SCHEDULER
+
+#---
+class RestBackend(object) :
+    """
+    Delivers the same attribute dicts as L{wiki_crawl.RedmineBackend}.
+    """
+    TIMEOUT = 60 # seconds
+
+    def __init__(self, url, key, concurrency = 1, verify = True, pageSize = PAGE_SIZE, scheduler = DIRECT_SCHEDULER) :
+        """
+        @param scheduler: Runs every request, e.g. a L{RequestScheduler}
+        """
+        self.url = url.rstrip('/')
+        self._scheduler = scheduler
+        self._key = key
+        self._concurrency = max(concurrency, 1)
+        self._pageSize = pageSize
+        self._slots = threading.BoundedSemaphore(max(concurrency, 1))
+        self.session = requests.Session()
+        self.session.verify = verify
+        self.session.headers.update({'X-Redmine-API-Key' : key,
+                                     'Accept' : 'application/json'})
+        adapter = HTTPAdapter(pool_connections = 1, pool_maxsize = max(concurrency, 1))
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, path, **params) :
+        """
+        GETs C{path} below the base URL.
+
+        @return: decoded JSON response
+        @raise BaseRedmineError: the exception the C{redmine} client would raise
+        """
+        return self._scheduler.call(self._request, path, params)
+
+    def _request(self, path, params) :
+        with self._slots :
+            response = self.session.get(self.url + path, params = params, timeout = self.TIMEOUT)
+            status = response.status_code
+            if status == 200 :
+                return response.json()
+        if status == 401 :
+            raise redmine_exceptions.AuthError()
+        if status == 403 :
+            raise redmine_exceptions.ForbiddenError()
+        if status == 404 :
+            raise redmine_exceptions.ResourceNotFoundError()
+        if status == 500 :
+            raise redmine_exceptions.ServerError()
+        error = redmine_exceptions.UnknownError(status)
+        error.status = status
+        raise error
+
+    def getProjects(self) :
+        """
+        @return: [attributes, ...] of all projects visible to the API key
+        """
+        requestWindow = lambda offset, limit : self.request('/projects.json', offset = offset, limit = limit)
+        return fetchPagedList(requestWindow, 'projects', self._pageSize, self._concurrency)
+
+    def iterIssues(self, **filters) :
+        """
+        @param filters: Query parameters of C{/issues.json}, e.g. C{status_id = '*'}
+        @return: iterator over the attributes of the matching issues ordered by id
+        """
+        requestWindow = lambda minId, limit : self.request('/issues.json', sort = 'id', issue_id = '>=%d' % (minId,),
+                                                           limit = limit, **filters)
+        return iterIdPagedList(requestWindow, 'issues', self._pageSize)
+
+    def getIssueStatuses(self) :
+        """
+        @return: [attributes, ...] of all issue statuses
+        """
+        return self.request('/issue_statuses.json')['issue_statuses']
+
+    def getWikiIndex(self, projectId) :
+        """
+        @return: [attributes, ...] of all wiki pages of the project
+        @raise ForbiddenError: if the pages cannot be accessed
+        """
+        return self.request('/projects/%s/wiki/index.json' % (projectId,))['wiki_pages']
+
+    def getWikiPage(self, projectId, title) :
+        """
+        @return: attributes of the current version of the page including author and text
+        @raise ResourceNotFoundError: if the page does not exist
+        """
+        if isinstance(title, unicode) :
+            title = title.encode('utf-8')
+        path = '/projects/%s/wiki/%s.json' % (projectId, urllib.quote(title, safe = ''))
+        return self.request(path)['wiki_page']
@@ -0,0 +1,567 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Local full-text search over the texts of all wiki pages.
+
+The texts are crawled into an inverted index kept in a SQLite file. On
+later runs only pages whose version or modification time changed are
+fetched again. Queries are answered from the file alone, so pages
+listing all wiki pages mentioning a term can be generated without any
+request to Redmine.
+"""
+
+#---
+#--- Python
+import os
+import re
+import sys
+import argparse
+import logging
+import sqlite3
+import itertools
+import collections
+from multiprocessing.pool import ThreadPool
+
+#---
+#--- 3rd party
+from redmine import Redmine
+from redmine import exceptions as redmine_exceptions
+
+#---
+#--- Local
+from wiki_crawl import PageRecord, parseDatetime, formatDatetime, fetchProjects, crawlProjectPages, \
+    addCrawlArguments, createBackend, getDefaultCachePath
+from crawl_cache import CrawlCache
+from negative_cache import NegativeCache, getNegativeCachePath
+from wiki_upload import updateWikiPage
+from render_cache import RenderCache, getRenderCachePath
+from instrumentation import Profiler, ProgressReporter, NULL_PROFILER
+from wiki_links import iterLinks, getTitleKey, getProjectKey
+from topic_index import iterTopicEntryLines, getTopicEntrySortKey
+
+# To disable all urllib3 warnings
+import urllib3
+urllib3.disable_warnings()
+
+# To capture warnings to your own log with the logging module
+logging.captureWarnings(True)
+
+#---
+WORD_PATTERN = re.compile(r'\w+', re.UNICODE)
+MIN_TERM_LENGTH = 2
+
+def iterTerms(text) :
+    """
+    Splits a text into lower case words.
+
+    @param text: UTF-8 encoded byte string or unicode
+    @return: iterator over UTF-8 encoded terms
+    """
+    if isinstance(text, str) :
+        text = text.decode('utf-8', 'replace')
+    for word in WORD_PATTERN.findall(text.lower()) :
+        if len(word) >= MIN_TERM_LENGTH :
+            yield word.encode('utf-8')
+
+def parseQuery(query) :
+    """
+    Splits a query into the terms that must all occur in a page.
+
+    A word ending in C{*} matches every term starting with it.
+
+    @return: [(term, isPrefix), ...]
+    """
+    terms = []
+    for word in query.split() :
+        wordTerms = list(iterTerms(word))
+        for (termNum, term) in enumerate(wordTerms) :
+            terms.append((term, word.endswith('*') and termNum == len(wordTerms) - 1))
+    return terms
+
+def getSearchIndexPath(crawlCachePath) :
+    """
+    @return: Path of the search index kept next to the crawl cache
+    """
+    return os.path.splitext(crawlCachePath)[0] + '.search'
+
+#---
+class SearchIndex(object) :
+    """
+    Inverted index from terms to the wiki pages containing them.
+
+    The links found in each page text are stored along with its terms,
+    see L{LinkGraph}. All strings are stored and returned as UTF-8 encoded byte strings,
+    like the fields of L{PageRecord}. Only the thread that opened the
+    index may use it.
+    """
+    FORMAT_VERSION = 2 # 2: links, parent titles and project names
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT);
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY,
+            identifier TEXT NOT NULL,
+            name_key TEXT NOT NULL,
+            breadcrumb_trail TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS projects_identifier ON projects (identifier);
+        CREATE INDEX IF NOT EXISTS projects_name ON projects (name_key);
+        CREATE TABLE IF NOT EXISTS pages (
+            id INTEGER PRIMARY KEY,
+            project_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            title_key TEXT NOT NULL,
+            parent_title TEXT,
+            author_name TEXT,
+            created_on TEXT,
+            updated_on TEXT,
+            version INTEGER,
+            UNIQUE (project_id, title));
+        CREATE INDEX IF NOT EXISTS pages_key ON pages (project_id, title_key);
+        CREATE TABLE IF NOT EXISTS postings (
+            term TEXT NOT NULL,
+            page_id INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (term, page_id));
+        CREATE INDEX IF NOT EXISTS postings_page ON postings (page_id);
+        CREATE TABLE IF NOT EXISTS links (
+            target_key TEXT NOT NULL,
+            target_project TEXT NOT NULL,
+            source_page_id INTEGER NOT NULL,
+            target_title TEXT NOT NULL,
+            PRIMARY KEY (target_key, target_project, source_page_id));
+        CREATE INDEX IF NOT EXISTS links_project ON links (target_project, target_key);
+        CREATE INDEX IF NOT EXISTS links_source ON links (source_page_id);
+        """
+
+    TABLES = ('meta', 'projects', 'pages', 'postings', 'links')
+
+    def __init__(self, path, baseURL) :
+        """
+        @param path: Path of the SQLite file, created if missing
+        """
+        self._baseURL = baseURL
+        self._connection = sqlite3.connect(path)
+        self._connection.text_factory = str
+        if self._getMeta('version') != str(self.FORMAT_VERSION) or self._getMeta('url') != baseURL :
+            self.clear()
+
+    def _getMeta(self, key) :
+        try :
+            row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        except sqlite3.OperationalError :
+            # new file
+            return None
+        return row[0] if row is not None else None
+
+    def clear(self) :
+        """
+        Removes all pages, e.g. after the base URL or the format changed.
+        """
+        with self._connection :
+            for table in self.TABLES :
+                self._connection.execute("DROP TABLE IF EXISTS %s" % (table,))
+            self._connection.executescript(self.SCHEMA)
+            self._connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                         [('version', str(self.FORMAT_VERSION)), ('url', self._baseURL)])
+
+    def close(self) :
+        self._connection.close()
+
+    def commit(self) :
+        self._connection.commit()
+
+    def setProject(self, project, breadcrumbTrail) :
+        self._connection.execute("INSERT OR REPLACE INTO projects (id, identifier, name_key, breadcrumb_trail) "
+                                 "VALUES (?, ?, ?, ?)",
+                                 (project.id, project.identifier, getProjectKey(project.name), breadcrumbTrail))
+
+    def getPageVersions(self, project) :
+        """
+        @return: {title -> (version, updated_on)} of the indexed pages of C{project}
+        """
+        cursor = self._connection.execute("SELECT title, version, updated_on FROM pages WHERE project_id = ?",
+                                          (project.id,))
+        return dict((title, (version, parseDatetime(updatedOn))) for (title, version, updatedOn) in cursor)
+
+    def setPage(self, project, page, text) :
+        """
+        Indexes C{text} as the current text of C{page} together with its links.
+
+        @type page: L{PageRecord}
+        """
+        termCounts = collections.Counter(iterTerms(text or ''))
+        connection = self._connection
+        row = connection.execute("SELECT id FROM pages WHERE project_id = ? AND title = ?",
+                                 (project.id, page.title)).fetchone()
+        values = (page.parent_title, page.author_name, formatDatetime(page.created_on),
+                  formatDatetime(page.updated_on), page.version)
+        if row is None :
+            pageId = connection.execute("INSERT INTO pages (parent_title, author_name, created_on, updated_on, version, "
+                                        "project_id, title, title_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        values + (project.id, page.title, getTitleKey(page.title))).lastrowid
+        else :
+            pageId = row[0]
+            connection.execute("UPDATE pages SET parent_title = ?, author_name = ?, created_on = ?, updated_on = ?, "
+                               "version = ? WHERE id = ?", values + (pageId,))
+            connection.execute("DELETE FROM postings WHERE page_id = ?", (pageId,))
+            connection.execute("DELETE FROM links WHERE source_page_id = ?", (pageId,))
+        connection.executemany("INSERT INTO postings (term, page_id, count) VALUES (?, ?, ?)",
+                               ((term, pageId, count) for (term, count) in termCounts.iteritems()))
+        connection.executemany("INSERT INTO links (target_project, target_key, target_title, source_page_id) "
+                               "VALUES (?, ?, ?, ?)",
+                               (link + (pageId,) for link in iterLinks(text, project.identifier)))
+
+    def _removePageRows(self, condition, parameters) :
+        pageIds = [(pageId,) for (pageId,) in self._connection.execute("SELECT id FROM pages WHERE " + condition,
+                                                                       parameters)]
+        self._connection.executemany("DELETE FROM postings WHERE page_id = ?", pageIds)
+        self._connection.executemany("DELETE FROM links WHERE source_page_id = ?", pageIds)
+        self._connection.executemany("DELETE FROM pages WHERE id = ?", pageIds)
+
+    def removePages(self, project, titles) :
+        for title in titles :
+            self._removePageRows("project_id = ? AND title = ?", (project.id, title))
+
+    def removeProjectsExcept(self, projectIds) :
+        """
+        Removes the projects not in C{projectIds} with all their pages.
+        """
+        projectIds = set(projectIds)
+        staleIds = [projectId for (projectId,) in self._connection.execute("SELECT id FROM projects")
+                    if projectId not in projectIds]
+        for projectId in staleIds :
+            self._removePageRows("project_id = ?", (projectId,))
+            self._connection.execute("DELETE FROM projects WHERE id = ?", (projectId,))
+
+    def _getTermScores(self, term, isPrefix) :
+        """
+        @return: {page id -> number of occurrences}
+        """
+        if isPrefix :
+            # all UTF-8 encoded terms starting with term sort below this bound
+            upperBound = term[:-1] + chr(ord(term[-1]) + 1)
+            cursor = self._connection.execute("SELECT page_id, SUM(count) FROM postings "
+                                              "WHERE term >= ? AND term < ? GROUP BY page_id", (term, upperBound))
+        else :
+            cursor = self._connection.execute("SELECT page_id, count FROM postings WHERE term = ?", (term,))
+        return dict(cursor)
+
+    def search(self, query, limit = None) :
+        """
+        Finds the pages containing all words of C{query}, see L{parseQuery}.
+
+        @param limit: Maximum number of results, default: all
+        @return: [(prettyPageTitle, projectIdent, projectBreadcrumbTrail,
+                 pageAuthor, pageUpdatedOn, pageCreatedOn), ...] like the topic
+                 entries, pages with the most occurrences first
+        """
+        scores = None
+        for (term, isPrefix) in parseQuery(query) :
+            termScores = self._getTermScores(term, isPrefix)
+            if scores is None :
+                scores = termScores
+            else :
+                scores = dict((pageId, score + termScores[pageId]) for (pageId, score) in scores.iteritems()
+                              if pageId in termScores)
+            if not scores :
+                return []
+        if scores is None :
+            return []
+
+        ranking = sorted(scores.iteritems(), key = lambda (pageId, score) : (-score, pageId))
+        if limit is not None :
+            ranking = ranking[:limit]
+        entries = []
+        for (pageId, score) in ranking :
+            (title, projectIdent, breadcrumbTrail, author, updatedOn, createdOn) = self._connection.execute(
+                "SELECT pages.title, projects.identifier, projects.breadcrumb_trail, "
+                "pages.author_name, pages.updated_on, pages.created_on "
+                "FROM pages JOIN projects ON projects.id = pages.project_id WHERE pages.id = ?", (pageId,)).fetchone()
+            entries.append((title.replace('_', ' '), projectIdent, breadcrumbTrail, author,
+                            parseDatetime(updatedOn), parseDatetime(createdOn)))
+        return entries
+
+#---
+def fetchPageText(backend, project, page) :
+    """
+    @return: (PageRecord, text) of the current version or None if the page vanished
+    """
+    try :
+        attributes = backend.getWikiPage(project.id, page.title)
+    except (redmine_exceptions.ResourceNotFoundError, redmine_exceptions.ForbiddenError) :
+        return None
+    return (PageRecord.fromAttributes(attributes), attributes.get('text'))
+
+def updateSearchIndex(backend, searchIndex, projectTree, projectPages, workers = 1,
+                      printProgress = False, profiler = NULL_PROFILER) :
+    """
+    Brings C{searchIndex} up to date with the crawled wiki pages.
+
+    Only the texts of pages that are new or whose version or modification
+    time changed are fetched.
+
+    @param projectPages: (project, allPages) pairs in the order of C{projectTree.iter_dfs()}
+    @param workers: Number of page texts fetched concurrently
+    @return: Number of fetched page texts
+    """
+    progress = ProgressReporter(len(projectTree))
+    pool = ThreadPool(workers) if workers > 1 else None
+    mapFunction = pool.imap if pool is not None else itertools.imap
+    fetchCount = 0
+    projectIds = []
+    try :
+        for (projNum, (project, allPages)) in enumerate(projectPages) :
+            projectIds.append(project.id)
+            searchIndex.setProject(project, " » ".join(projectTree.getBreadcrumbTrail(project)))
+            indexedVersions = searchIndex.getPageVersions(project)
+            changedPages = [page for page in allPages
+                            if indexedVersions.get(page.title) != (page.version, page.updated_on)]
+            fetch = lambda page : fetchPageText(backend, project, page)
+            with profiler.phase('page texts') :
+                for result in mapFunction(fetch, changedPages) :
+                    if result is not None :
+                        searchIndex.setPage(project, *result)
+            fetchCount += len(changedPages)
+
+            titles = set(page.title for page in allPages)
+            searchIndex.removePages(project, [title for title in indexedVersions if title not in titles])
+            searchIndex.commit()
+            if printProgress and allPages :
+                progress.report(projNum+1, len(allPages))
+        searchIndex.removeProjectsExcept(projectIds)
+        searchIndex.commit()
+    finally :
+        if pool is not None :
+            pool.terminate()
+    return fetchCount
+
+def iterSearchTermIndexLines(searchIndex, query) :
+    """
+    Renders a page listing all wiki pages containing the words of C{query},
+    laid out like a topic index.
+    """
+    yield "{{>toc}}"
+    yield ""
+    yield "h1. Seiten mit \"%s\"" % (query,)
+    yield ""
+    yield "Diese Seite wurde automatisch generiert. Manuelle Änderungen an dieser Seite werden beim nächsten Lauf überschrieben werden!"
+    yield ""
+
+    entries = sorted(searchIndex.search(query), key = getTopicEntrySortKey)
+    for line in iterTopicEntryLines(entries) :
+        yield line
+
+#---
+class CLI(object) :
+    """
+    Encapsulates the Command Line Interface.
+    """
+    def __init__(self) :
+        self._parser = parser = self._createParser()
+        self._args = args = parser.parse_args()
+        if args.update and args.apikey is None :
+            print "You must provide a Redmine API-Key to update the index."
+            sys.exit(1)
+            return
+
+    def _createParser(self) :
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--apikey", help = "Valid API-key to use the Python REST-API")
+        parser.add_argument("--index",
+                            help = "Path of the search index (default: next to the cache file)",
+                            default = None)
+        parser.add_argument("--update", action = "store_true",
+                            help = "Fetch the texts of new and changed wiki pages into the index")
+        parser.add_argument("-t", "--targetpage",
+                            help = "Name of a Wiki page the rendered page should be stored on",
+                            default = "")
+        parser.add_argument("-p", "--projectid",
+                            help = "Id of the project the target wiki page belongs to",
+                            default = "")
+        self._addOutputArguments(parser)
+        addCrawlArguments(parser)
+
+        return parser
+
+    def _addOutputArguments(self, parser) :
+        parser.add_argument("-q", "--query",
+                            help = "Print the pages containing all words; a trailing * matches any ending",
+                            default = None)
+        parser.add_argument("--termpage", action = "store_true",
+                            help = "Render the result of --query as a wiki page like a topic index")
+        parser.add_argument("--limit", type = int,
+                            help = "Maximum number of pages printed for --query",
+                            default = 20)
+
+    def getBaseURL(self) :
+        """
+        Base URL of the Redmine instance.
+        """
+        baseURL = 'https://redmine.itz.uni-halle.de'
+        return baseURL
+
+    def getApiKey(self) :
+        """
+        Valid API-key to use the REST-API of Redmine.
+        """
+        return self._args.apikey
+
+    def getIndexPath(self) :
+        """
+        Path of the SQLite file of the search index.
+        """
+        if self._args.index :
+            return self._args.index
+        return getSearchIndexPath(self._args.cache or getDefaultCachePath())
+
+    def isUpdating(self) :
+        """True if the index should be updated from Redmine first."""
+        return self._args.update
+
+    def getQuery(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.query
+
+    def isTermPage(self) :
+        """True if the query result should be rendered as a wiki page."""
+        return self._args.termpage
+
+    def getLimit(self) :
+        """Maximum number of printed search results."""
+        return max(self._args.limit, 1)
+
+    def getTargetPage(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.targetpage
+
+    def getProjectId(self) :
+        """Target Project ID"""
+        return self._args.projectid
+
+    def getWorkers(self) :
+        """Number of concurrent wiki page requests."""
+        return max(self._args.workers, 1)
+
+    def getCachePath(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.cache
+
+    def getProfilePath(self) :
+        """
+        @return: None, '-' for a summary on stderr or the path of a JSON report
+        """
+        return self._args.profile
+
+    def getBackend(self) :
+        """Name of the crawl backend."""
+        return self._args.backend
+
+    def getPageSize(self) :
+        """Number of projects per listing request."""
+        return max(self._args.pagesize, 1)
+
+    def getRetries(self) :
+        """Retries of requests failing with a transient error."""
+        return max(self._args.retries, 0)
+
+    def getNegativeTTL(self) :
+        """Seconds projects without accessible wiki pages are skipped."""
+        return self._args.negativettl * 3600
+
+    def isRefreshForced(self) :
+        """True if projects skipped in earlier runs should be checked again."""
+        return self._args.refresh
+
+#---
+def update(cli, redmineHandle, searchIndex, profiler) :
+    """
+    Crawls all projects and refreshes the texts of changed pages.
+    """
+    baseURL = cli.getBaseURL()
+    workers = cli.getWorkers()
+    backend = createBackend(cli.getBackend(), redmineHandle, workers, pageSize = cli.getPageSize(),
+                            retries = cli.getRetries(), profiler = profiler)
+    if profiler is not NULL_PROFILER and backend.session is not None :
+        profiler.attach(backend.session)
+
+    allProjects = fetchProjects(backend, profiler)
+    if len(allProjects) == 0 :
+        print "You must provide a VALID Redmine API-Key!"
+        return
+
+    cachePath = cli.getCachePath()
+    cache = CrawlCache(cachePath, baseURL) if cachePath else None
+    negativeCache = NegativeCache(getNegativeCachePath(cachePath), baseURL, cli.getNegativeTTL(),
+                                  cli.isRefreshForced()) if cachePath else None
+    # the page texts come with their authors, so the page lists are fetched without details
+    (projectTree, projectPages) = crawlProjectPages(redmineHandle, workers = workers, cache = cache,
+                                                    noAuthor = True, profiler = profiler, backend = backend,
+                                                    projects = allProjects, negativeCache = negativeCache)
+    fetchCount = updateSearchIndex(backend, searchIndex, projectTree, projectPages, workers = workers,
+                                   printProgress = True, profiler = profiler)
+    print "%i page texts fetched" % (fetchCount,)
+
+def publishPage(cli, redmineHandle, pageLines, title, profiler) :
+    """
+    Stores the page on the target page given on the command line or prints it.
+    """
+    targetPage = cli.getTargetPage()
+    targetProjectId = cli.getProjectId()
+    if not targetPage or not targetProjectId :
+        for line in pageLines :
+            print line
+        return
+    cachePath = cli.getCachePath()
+    renderCache = RenderCache(getRenderCachePath(cachePath)) if cachePath else None
+    with profiler.phase('wiki page update') :
+        updateWikiPage(redmineHandle, targetProjectId, targetPage, "\n".join(pageLines), title, renderCache)
+    if renderCache is not None :
+        renderCache.save()
+
+def main() :
+    cli = CLI()
+    baseURL = cli.getBaseURL()
+    apiKey = cli.getApiKey()
+
+    redmineHandle = Redmine(baseURL, key = apiKey)
+    profilePath = cli.getProfilePath()
+    profiler = Profiler() if profilePath else NULL_PROFILER
+    if profilePath :
+        profiler.attach(redmineHandle)
+
+    searchIndex = SearchIndex(cli.getIndexPath(), baseURL)
+    try :
+        if cli.isUpdating() :
+            update(cli, redmineHandle, searchIndex, profiler)
+
+        query = cli.getQuery()
+        if query and cli.isTermPage() :
+            with profiler.phase('search') :
+                pageLines = list(iterSearchTermIndexLines(searchIndex, query))
+            publishPage(cli, redmineHandle, pageLines, 'Seiten mit %s' % (query,), profiler)
+        elif query :
+            with profiler.phase('search') :
+                entries = searchIndex.search(query, cli.getLimit())
+            for (prettyPageTitle, projectIdent, projectBreadcrumbTrail, pageAuthor, pageUpdatedOn, pageCreatedOn) in entries :
+                print "%s:%s (%s)" % (projectIdent, prettyPageTitle, projectBreadcrumbTrail)
+    finally :
+        searchIndex.close()
+
+    if profilePath :
+        profiler.writeReport(profilePath)
+    return
+
+if __name__ == '__main__' :
+    try :
+        main()
+    except KeyboardInterrupt :
+        sys.exit(0)
@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Crawls the wiki in shards of top-level projects and merges the results
+into the global or a topic index.
+
+The subtrees of the top-level projects are distributed over C{N} shards
+of about the same number of projects. Each shard is crawled by its own
+process, either by a process pool of this script or by separate
+invocations with C{--shard I/N}, possibly on several hosts, and writes a
+partial result file. The merge step reads them all and renders the text
+exactly like C{overall_index.py} or C{topic_index.py} would.
+"""
+
+#---
+#--- Python
+import os
+import sys
+import hashlib
+import argparse
+import logging
+import multiprocessing
+import cPickle as pickle
+
+#---
+#--- 3rd party
+from redmine import Redmine
+
+#---
+#--- Local
+from wiki_crawl import fetchProjects, iterProjectPages, addCrawlArguments, createBackend, getDefaultCachePath
+from crawl_cache import CrawlCache
+from negative_cache import NegativeCache, getNegativeCachePath
+from wiki_upload import updateWikiPage
+from instrumentation import Profiler, NULL_PROFILER
+from wiki_tree import ProjectTree
+from overall_index import iterGlobaleIndexLinesFromPages
+from topic_index import iterTopicEntriesFromPages, iterTopicIndexLines, selectTopicPages
+
+# To disable all urllib3 warnings
+import urllib3
+urllib3.disable_warnings()
+
+# To capture warnings to your own log with the logging module
+logging.captureWarnings(True)
+
+#---
+PARTIAL_FORMAT_VERSION = 1
+
+class ShardMismatch(Exception) :
+    """
+    The partial results are missing or were not crawled from the same
+    project list with the same options.
+    """
+
+#---
+def getSubtrees(projectTree) :
+    """
+    @return: [[project, ...], ...] the projects of each top-level subtree in depth-first order
+    """
+    subtrees = []
+    for project in projectTree.iter_dfs() :
+        if projectTree.getDepth(project) == 1 :
+            subtrees.append([])
+        subtrees[-1].append(project)
+    return subtrees
+
+def selectShardProjects(projectTree, shard, shardCount) :
+    """
+    Distributes the top-level subtrees over the shards, largest first to
+    the shard with the fewest projects. Every invocation seeing the same
+    project list thus computes the same distribution.
+
+    @param shard: 0 based index of the shard
+    @return: [project, ...] of the shard in depth-first order
+    """
+    subtrees = getSubtrees(projectTree)
+    loads = [0] * shardCount
+    selected = set()
+    order = sorted(range(len(subtrees)), key = lambda position : (-len(subtrees[position]), position))
+    for position in order :
+        target = min(range(shardCount), key = lambda index : (loads[index], index))
+        loads[target] += len(subtrees[position])
+        if target == shard :
+            selected.add(position)
+    return [project for position in sorted(selected) for project in subtrees[position]]
+
+def getProjectListDigest(allProjects) :
+    """
+    Only the fields shaping the tree and the shards are included, so the
+    shards still fit together if a project was merely touched in between.
+
+    @return: Digest of the project list a shard was crawled from
+    """
+    digest = hashlib.sha1()
+    for project in sorted(allProjects, key = lambda project : project.id) :
+        digest.update(repr((project.id, project.parent_id, project.name, project.identifier)))
+    return digest.hexdigest()
+
+def getCrawlKind(topicParentPage, noAuthor) :
+    """
+    @return: Name of the document the shards are crawled for
+    """
+    if not topicParentPage :
+        return 'global'
+    return 'topic:%s:%s' % (topicParentPage, noAuthor)
+
+def getPartialPath(partialDir, shard, shardCount) :
+    """
+    @param shard: 0 based index of the shard
+    """
+    return os.path.join(partialDir, 'shard-%d-of-%d.partial' % (shard + 1, shardCount))
+
+def getShardCachePath(cachePath, shard, shardCount) :
+    """
+    Shards crawled at the same time must not share a cache file.
+    """
+    (base, extension) = os.path.splitext(cachePath)
+    return '%s.shard-%d-of-%d%s' % (base, shard + 1, shardCount, extension)
+
+#---
+def crawlShard(backend, allProjects, shard, shardCount, topicParentPage = '', noAuthor = False, **keywords) :
+    """
+    Fetches the wiki pages of the projects of one shard.
+
+    @param topicParentPage: Crawl for this topic index, empty for the global index
+    @keyword workers: Number of projects whose wiki pages are fetched concurrently
+    @keyword cache: Page metadata of earlier runs of this shard
+    @type    cache: None or L{CrawlCache}
+    @keyword negativeCache: Projects without accessible wiki pages of earlier runs
+    @type    negativeCache: None or L{NegativeCache}
+    @keyword profiler: Records requests and the time spent per phase
+    @return: [(project, allPages), ...] in depth-first order
+    """
+    profiler = keywords.get('profiler', NULL_PROFILER)
+    with profiler.phase('project tree') :
+        projectTree = ProjectTree(allProjects)
+    projects = selectShardProjects(projectTree, shard, shardCount)
+    if topicParentPage :
+        # only the pages below the topic page show their authors
+        withAuthor = not noAuthor
+        detailFilter = lambda allPages : selectTopicPages(allPages, topicParentPage)
+    else :
+        # the global index shows no authors
+        (withAuthor, detailFilter) = (False, None)
+    return list(iterProjectPages(backend, projects, workers = keywords.get('workers', 1),
+                                 cache = keywords.get('cache', None), withAuthor = withAuthor,
+                                 profiler = profiler, detailFilter = detailFilter,
+                                 negativeCache = keywords.get('negativeCache', None)))
+
+def writePartialResult(path, baseURL, kind, shard, shardCount, allProjects, projectPages) :
+    """
+    Stores the crawl result of one shard.
+    """
+    data = {'version' : PARTIAL_FORMAT_VERSION,
+            'url' : baseURL,
+            'kind' : kind,
+            'shard' : shard,
+            'shardCount' : shardCount,
+            'projectListDigest' : getProjectListDigest(allProjects),
+            'projects' : allProjects,
+            'projectPages' : projectPages}
+    tmpPath = path + '.tmp'
+    with open(tmpPath, 'wb') as f :
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmpPath, path)
+
+def readPartialResults(partialDir, baseURL, kind, shardCount) :
+    """
+    Merges the partial results of all shards.
+
+    @return: (projectTree, [(project, allPages), ...]) as the crawl of all
+             projects by a single process would have returned them
+    @raise ShardMismatch: A shard is missing or the shards do not fit together
+    """
+    (allProjects, projectListDigest) = (None, None)
+    pagesById = {} # project id -> (project, allPages)
+    for shard in range(shardCount) :
+        path = getPartialPath(partialDir, shard, shardCount)
+        try :
+            with open(path, 'rb') as f :
+                data = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError, AttributeError, ImportError) :
+            raise ShardMismatch("Result of shard %d/%d is missing: %s" % (shard + 1, shardCount, path))
+        if (data.get('version'), data.get('url'), data.get('kind')) != (PARTIAL_FORMAT_VERSION, baseURL, kind) :
+            raise ShardMismatch("Result of shard %d/%d was crawled with other options: %s" % (shard + 1, shardCount, path))
+        if projectListDigest is not None and data['projectListDigest'] != projectListDigest :
+            raise ShardMismatch("The projects changed while the shards were crawled")
+        (allProjects, projectListDigest) = (data['projects'], data['projectListDigest'])
+        for (project, allPages) in data['projectPages'] :
+            pagesById[project.id] = (project, allPages)
+
+    # the project list in its original order builds exactly the tree of a single crawl
+    projectTree = ProjectTree(allProjects)
+    if any(project.id not in pagesById for project in projectTree.iter_dfs()) :
+        raise ShardMismatch("The shards do not cover all projects")
+    return (projectTree, [pagesById[project.id] for project in projectTree.iter_dfs()])
+
+def iterMergedIndexLines(baseURL, projectTree, projectPages, topicParentPage = '', **keywords) :
+    """
+    Renders the global index, or the topic index of C{topicParentPage}, from merged shards.
+    """
+    if not topicParentPage :
+        return iterGlobaleIndexLinesFromPages(baseURL, projectTree, projectPages, **keywords)
+    entries = iterTopicEntriesFromPages(projectTree, projectPages, topicParentPage, **keywords)
+    return iterTopicIndexLines(topicParentPage, entries)
+
+#---
+def crawlShardJob(job) :
+    """
+    Crawls one shard in a process of the pool and writes its partial result.
+
+    @param job: dict of the shard and the crawl options; C{projects} is the
+                project list shared by all shards or None to fetch it
+    @return: (shard, projectCount, pageCount)
+    """
+    redmineHandle = Redmine(job['baseURL'], key = job['apiKey'])
+    backend = createBackend(job['backend'], redmineHandle, job['workers'], pageSize = job['pageSize'],
+                            retries = job['retries'])
+    allProjects = job['projects']
+    if allProjects is None :
+        allProjects = fetchProjects(backend)
+    (shard, shardCount) = (job['shard'], job['shardCount'])
+    cachePath = job['cachePath']
+    if cachePath :
+        cachePath = getShardCachePath(cachePath, shard, shardCount)
+        cache = CrawlCache(cachePath, job['baseURL'])
+        negativeCache = NegativeCache(getNegativeCachePath(cachePath), job['baseURL'], job['negativeTTL'],
+                                      job['refresh'])
+    else :
+        (cache, negativeCache) = (None, None)
+    projectPages = crawlShard(backend, allProjects, shard, shardCount, job['topicParentPage'], job['noAuthor'],
+                              workers = job['workers'], cache = cache, negativeCache = negativeCache)
+    writePartialResult(job['partialPath'], job['baseURL'], getCrawlKind(job['topicParentPage'], job['noAuthor']),
+                       shard, shardCount, allProjects, projectPages)
+    return (shard, len(projectPages), sum(len(allPages) for (project, allPages) in projectPages))
+
+def parseShard(value) :
+    """
+    argparse type of C{--shard}: "I/N" with 1 <= I <= N.
+
+    @return: (0 based shard index, shardCount)
+    """
+    try :
+        (index, count) = [int(part) for part in value.split('/')]
+    except ValueError :
+        raise argparse.ArgumentTypeError("expected I/N, e.g. 2/8")
+    if not 1 <= index <= count :
+        raise argparse.ArgumentTypeError("shard %s does not exist" % (value,))
+    return (index - 1, count)
+
+#---
+class CLI(object) :
+    """
+    Encapsulates the Command Line Interface.
+    """
+    def __init__(self) :
+        self._parser = parser = self._createParser()
+        self._args = args = parser.parse_args()
+        if args.apikey is None :
+            print "You must provide a Redmine API-Key as first argument."
+            sys.exit(1)
+            return
+
+    def _createParser(self) :
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--apikey", help = "Valid API-key to use the Python REST-API")
+        parser.add_argument("-t", "--targetpage",
+                            help = "Fully qualified Name of a Wiki page the result should be stored on",
+                            default = "")
+        parser.add_argument("-p", "--projectid",
+                            help = "Id of the project the target wiki page belongs to",
+                            default = "")
+        parser.add_argument("--topicparentpage",
+                            help = "Render the topic index of this parent page instead of the global index",
+                            default = "")
+        parser.add_argument("--no-author", dest = "noauthor", action = "store_true",
+                            help = "Do not fetch page details; the topic index shows no author names")
+        parser.add_argument("--shards", type = int,
+                            help = "Number of shards the top-level projects are distributed over",
+                            default = multiprocessing.cpu_count())
+        parser.add_argument("--processes", type = int,
+                            help = "Number of shards crawled at the same time (default: all)",
+                            default = None)
+        parser.add_argument("--shard", type = parseShard,
+                            help = "Only crawl shard I of N (1 based) and write its partial result",
+                            default = None)
+        parser.add_argument("--merge", action = "store_true",
+                            help = "Only merge the partial results of --shards shards and publish the index")
+        parser.add_argument("--partial-dir", dest = "partialdir",
+                            help = "Directory of the partial results (default: next to the cache file)",
+                            default = None)
+        addCrawlArguments(parser)
+
+        return parser
+
+    def getBaseURL(self) :
+        """
+        Base URL of the Redmine instance.
+        """
+        baseURL = 'https://redmine.itz.uni-halle.de'
+        return baseURL
+
+    def getApiKey(self) :
+        """
+        Valid API-key to use the REST-API of Redmine.
+        """
+        return self._args.apikey
+
+    def getTargetPage(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.targetpage
+
+    def getProjectId(self) :
+        return self._args.projectid
+
+    def getTopicParentPage(self) :
+        """Empty for the global index."""
+        return self._args.topicparentpage.replace('_', ' ')
+
+    def isAuthorOmitted(self) :
+        """True if no page details should be fetched."""
+        return self._args.noauthor
+
+    def getShard(self) :
+        """
+        @return: None or (0 based shard index, shardCount) of the single shard to crawl
+        """
+        return self._args.shard
+
+    def getShardCount(self) :
+        """Number of shards; given by C{--shard} if present."""
+        if self._args.shard is not None :
+            return self._args.shard[1]
+        return max(self._args.shards, 1)
+
+    def getProcesses(self) :
+        """Number of processes crawling shards."""
+        if self._args.processes is None :
+            return self.getShardCount()
+        return max(self._args.processes, 1)
+
+    def isMerging(self) :
+        """True if only the partial results should be merged."""
+        return self._args.merge
+
+    def getPartialDir(self) :
+        """
+        Directory of the partial results, created if missing.
+        """
+        partialDir = self._args.partialdir
+        if not partialDir :
+            partialDir = os.path.splitext(self._args.cache or getDefaultCachePath())[0] + '.partial'
+        if not os.path.isdir(partialDir) :
+            os.makedirs(partialDir)
+        return partialDir
+
+    def getWorkers(self) :
+        """Number of concurrent wiki page requests per shard."""
+        return max(self._args.workers, 1)
+
+    def getCachePath(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.cache
+
+    def getProfilePath(self) :
+        """
+        @return: None, '-' for a summary on stderr or the path of a JSON report
+        """
+        return self._args.profile
+
+    def getBackend(self) :
+        """Name of the crawl backend."""
+        return self._args.backend
+
+    def getPageSize(self) :
+        """Number of projects per listing request."""
+        return max(self._args.pagesize, 1)
+
+    def getRetries(self) :
+        """Retries of requests failing with a transient error."""
+        return max(self._args.retries, 0)
+
+    def getNegativeTTL(self) :
+        """Seconds projects without accessible wiki pages are skipped."""
+        return self._args.negativettl * 3600
+
+    def isRefreshForced(self) :
+        """True if projects skipped in earlier runs should be checked again."""
+        return self._args.refresh
+
+    def getJob(self, shard, projects = None) :
+        """
+        @return: Argument of L{crawlShardJob} for the 0 based C{shard}
+        """
+        shardCount = self.getShardCount()
+        return {'baseURL' : self.getBaseURL(),
+                'apiKey' : self.getApiKey(),
+                'backend' : self.getBackend(),
+                'workers' : self.getWorkers(),
+                'pageSize' : self.getPageSize(),
+                'retries' : self.getRetries(),
+                'cachePath' : self.getCachePath(),
+                'negativeTTL' : self.getNegativeTTL(),
+                'refresh' : self.isRefreshForced(),
+                'topicParentPage' : self.getTopicParentPage(),
+                'noAuthor' : self.isAuthorOmitted(),
+                'shard' : shard,
+                'shardCount' : shardCount,
+                'projects' : projects,
+                'partialPath' : getPartialPath(self.getPartialDir(), shard, shardCount)}
+
+#---
+def main() :
+    cli = CLI()
+    baseURL = cli.getBaseURL()
+    apiKey = cli.getApiKey()
+    shardCount = cli.getShardCount()
+    topicParentPage = cli.getTopicParentPage()
+
+    if cli.getShard() is not None :
+        (shard, projectCount, pageCount) = crawlShardJob(cli.getJob(cli.getShard()[0]))
+        print "Shard %i/%i: %i projects and %i pages" % (shard + 1, shardCount, projectCount, pageCount)
+        return
+
+    redmineHandle = Redmine(baseURL, key = apiKey)
+    profilePath = cli.getProfilePath()
+    profiler = Profiler() if profilePath else NULL_PROFILER
+    if profilePath :
+        profiler.attach(redmineHandle)
+
+    if not cli.isMerging() :
+        backend = createBackend(cli.getBackend(), redmineHandle, 1, pageSize = cli.getPageSize(),
+                                retries = cli.getRetries(), profiler = profiler)
+        # fetched once, so all shards are cut from the same project list
+        allProjects = fetchProjects(backend, profiler)
+        if len(allProjects) == 0 :
+            print "You must provide a VALID Redmine API-Key!"
+            return
+        jobs = [cli.getJob(shard, allProjects) for shard in range(shardCount)]
+        with profiler.phase('shard crawl') :
+            pool = multiprocessing.Pool(min(cli.getProcesses(), shardCount))
+            try :
+                for (shard, projectCount, pageCount) in pool.imap_unordered(crawlShardJob, jobs) :
+                    print "Shard %i/%i: %i projects and %i pages" % (shard + 1, shardCount, projectCount, pageCount)
+                pool.close()
+            finally :
+                pool.terminate()
+
+    try :
+        with profiler.phase('shard merge') :
+            (projectTree, projectPages) = readPartialResults(cli.getPartialDir(), baseURL,
+                                                             getCrawlKind(topicParentPage, cli.isAuthorOmitted()),
+                                                             shardCount)
+    except ShardMismatch as error :
+        print error
+        return
+
+    targetPage = cli.getTargetPage()
+    projectId = cli.getProjectId()
+    lines = iterMergedIndexLines(baseURL, projectTree, projectPages, topicParentPage, profiler = profiler)
+    if not targetPage or not projectId :
+        for line in lines :
+            print line
+    else :
+        print projectId, targetPage
+        newText = "\n".join(lines)
+        with profiler.phase('wiki page update') :
+            updateWikiPage(redmineHandle, projectId, targetPage, newText, topicParentPage or 'Global index')
+
+    if profilePath :
+        profiler.writeReport(profilePath)
+    return
+
+if __name__ == '__main__' :
+    try :
+        main()
+    except KeyboardInterrupt :
+        sys.exit(0)
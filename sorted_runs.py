@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Sorting of large item streams in bounded memory.
+
+Items arrive in groups that are sorted one at a time and spilled to a
+temporary file as runs. Iterating merges all runs lazily, holding only a
+small buffer per run in memory.
+"""
+
+#---
+#--- Python
+import heapq
+import cPickle
+import tempfile
+
+#---
+class SortedRuns(object) :
+    """
+    Sorted runs kept in one temporary file and merged on iteration.
+
+    @note: Items comparing equal keep no particular order, so keys should
+           either be unique or the items themselves comparable.
+    """
+    BUFFER_SIZE = 64 # items read at once per run while merging
+
+    def __init__(self, key = None) :
+        """
+        @param key: function(item) returning the sort key, default: the item itself
+        """
+        self._key = key
+        self._file = tempfile.TemporaryFile()
+        self._runs = [] # (offset, count)
+        self._itemCount = 0
+
+    def __len__(self) :
+        return self._itemCount
+
+    def addRun(self, items) :
+        """
+        Sorts C{items} and appends them as a new run.
+        """
+        if self._key is None :
+            records = sorted(items)
+        else :
+            records = sorted((self._key(item), item) for item in items)
+        if not records :
+            return
+        self._file.seek(0, 2)
+        offset = self._file.tell()
+        for record in records :
+            cPickle.dump(record, self._file, cPickle.HIGHEST_PROTOCOL)
+        self._runs.append((offset, len(records)))
+        self._itemCount += len(records)
+
+    def _iterRun(self, offset, count) :
+        f = self._file
+        while count > 0 :
+            # other runs move the file position in between, so every batch seeks
+            f.seek(offset)
+            batch = [cPickle.load(f) for i in xrange(min(count, self.BUFFER_SIZE))]
+            offset = f.tell()
+            count -= len(batch)
+            for record in batch :
+                yield record
+
+    def __iter__(self) :
+        merged = heapq.merge(*[self._iterRun(offset, count) for (offset, count) in self._runs])
+        if self._key is None :
+            return merged
+        return (item for (key, item) in merged)
+
+    def close(self) :
+        self._file.close()
@@ -6,138 +6,37 @@
 import sys
 import StringIO
 import argparse
+import operator
+import itertools
 
 #---
 #--- 3rd party
 from redmine import Redmine
-from redmine import exceptions as redmine_exceptions
 
 #---
-class ProjectTree(object) :
-    def __init__(self, allProjects ) :
-        self._projects = list(allProjects)
-        self._projectsByName = {} # name -> project
-        for project in self._projects :
-            self._projectsByName[project.name.encode('utf-8')] = project
-        self._projects.sort(key = lambda p : self.getBreadcrumbTrail(p))
-
-    def iter_dfs(self) :
-        for project in self._projects :
-            yield project
-
-    def getParent(self, project) :
-        """
-        @return: None or project.parent
-        """
-        try :
-            parentProjectName = project.parent.name.encode('utf-8')
-        except AttributeError :
-            parentProjectName = ''
-
-        if not parentProjectName :
-            parentProject = None
-        else :
-            parentProject =  self._projectsByName.get(parentProjectName, None)
-            if 0 :
-                print "DEBUG: parentName = %r" % (parentProjectName,)
-                print "DEBUG: parentObject %r" % (parentProject,)
-        return parentProject
-
-    def getBreadcrumbTrail(self, project, encoding = 'utf-8') :
-        """
-        @return: (..., parentName, projectName)
-        """
-        return list(p.name.encode(encoding) for p in self.getAncestorsAndProject(project))
-
-    def getAncestorProjects(self, project) :
-
-        def _iterAncestors(project) :
-            parent = self.getParent(project)
-            if parent is None :
-                return
-            yield parent
-            for a in _iterAncestors(parent) :
-                yield a
-
-        return list(reversed(list(_iterAncestors(project))))
-
-    def getAncestorsAndProject(self, project) :
-        return self.getAncestorProjects(project) + [project]
-
+#--- Local
+from wiki_crawl import fetchProjects, crawlProjectPages, addCrawlArguments, createBackend, getDefaultCachePath
+from crawl_cache import CrawlCache
+from negative_cache import NegativeCache, getNegativeCachePath
+from crawl_checkpoint import CrawlCheckpoint, TimeBudgetExceeded, getCheckpointPath, getDeadline, \
+    addCheckpointArguments
+from wiki_upload import updateWikiPage
+from render_cache import RenderCache, getRenderCachePath
+from instrumentation import Profiler, ProgressReporter, NULL_PROFILER
+from wiki_tree import PageChildIndex
+from sorted_runs import SortedRuns
+from wiki_mirror import WikiMirror
+from index_export import exportIndex, addExportArguments
+from recent_pages import RecentPages, iterRecentPagesLines, addRecentArguments
 
 #---
-class PageTree(object) :
-    def __init__(self, project, allPages) :
-        self._project = project
-        self._pages = list(allPages)
-        self._pagesByTitle = {} # title -> page
-        for page in self._pages :
-            self._pagesByTitle[page.title.encode('utf-8')] = page
-
-
-        self._pagesWithParent = {} # title -> {page -> [childPages, ...]}
-        for page in self._pages :
-            if 0 :
-                print "DEBUG: %r %r" % (project, page,)
-            self._insert(page)
-
-        self._pages.sort(key = lambda p : self.getBreadcrumbTrail(p))
-
-    def getParent(self, page) :
-        """
-        @return: None or page.parent
-        """
-        try :
-            parentPageTitle = page.parent.title.encode('utf-8')
-        except AttributeError :
-            parentPageTitle = ''
-
-        if not parentPageTitle :
-            parentPage = None
-        else :
-            parentPage =  self._pagesByTitle.get(parentPageTitle, None)
-            if 0 :
-                print "DEBUG: parentPageTitle = %r" % (parentPageTitle,)
-                print "DEBUG: parentPage %r" % (parentPage,)
-        return parentPage
-
-
-    def getBreadcrumbTrail(self, page, encoding = 'utf-8') :
-        """
-        @return: (..., parentPage, page)
-        """
-        return list(p.title.encode(encoding).replace('_', ' ') for p in self.getAncestorsAndPage(page))
-
-
-    def getAncestorPages(self, page) :
-
-        def _iterAncestors(page) :
-            parent = self.getParent(page)
-            if parent is None :
-                return
-            yield parent
-            for a in _iterAncestors(parent) :
-                yield a
-
-        return list(reversed(list(_iterAncestors(page))))
-
-    def getAncestorsAndPage(self, page) :
-        return self.getAncestorPages(page) + [page]
-
-    def _insert(self, page) :
-        #self._pages.append(page)
-        #if parentPage is None :
-        #    self.pagesWithParent[page] = []
-        return
-
-    def iter_dfs(self) :
-        for page in self._pages :
-            yield page
-
-#---
-def printGlobalTopicIndex(redmineHandle, topicParentPage) :
+def printGlobalTopicIndex(redmineHandle, topicParentPage, **keywords) :
+    lines = iterGlobaleTopicIndexLines(redmineHandle, topicParentPage, **keywords)
+    if keywords.get('deadline', None) is not None :
+        # a crawl stopped by the time budget prints nothing
+        lines = list(lines)
     lineCount = 0
-    for line in iterGlobaleTopicIndexLines(redmineHandle, topicParentPage) :
+    for line in lines :
         lineCount += 1
         print line
     return lineCount
@@ -148,7 +47,42 @@ def iterGlobaleTopicIndexLines(redmineHandle, topicParentPage, **keywords) :
 
     @keyword printProgress: If True progress information will be printed to stdout
     @type    printProgress: bool
+    @keyword workers: Number of projects whose wiki pages are fetched concurrently
+    @type    workers: int
+    @keyword cache: Page metadata of earlier runs
+    @type    cache: None or L{CrawlCache}
+    @keyword noAuthor: If True no page details are fetched and no authors are shown
+    @type    noAuthor: bool
+    @keyword profiler: Records requests and the time spent per phase
+    @type    profiler: L{Profiler}
+    @keyword backend: Backend used for the crawl, default: the Redmine client
+    @type    backend: L{RedmineBackend} or L{RestBackend}
+    @keyword projects: Project list fetched earlier in this run, default: fetch it
+    @type    projects: None or [ProjectRecord, ...]
+    @keyword negativeCache: Projects without accessible wiki pages of earlier runs
+    @type    negativeCache: None or L{NegativeCache}
+    @keyword mirror: Render from this mirror instead of crawling Redmine
+    @type    mirror: None or L{WikiMirror}
+    @keyword checkpoint: Projects finished by an interrupted run; updated during the crawl
+    @type    checkpoint: None or L{CrawlCheckpoint}
+    @keyword deadline: time.time() value at which the crawl stops with L{TimeBudgetExceeded}
+    @type    deadline: None or float
+    @keyword recent: Number of the most recently changed topic pages listed at the end, default: none
+    @type    recent: int
     """
+    entries = iterTopicEntries(redmineHandle, topicParentPage, **keywords)
+    for line in iterTopicIndexLines(topicParentPage, entries, keywords.get('recent', 0)) :
+        yield line
+
+def iterTopicIndexLines(topicParentPage, entries, recent = 0) :
+    """
+    Renders the topic index page from the entries of L{iterTopicEntries}.
+
+    @param recent: Number of the most recently changed pages listed at the end
+    """
+    recentPages = RecentPages(recent) if recent > 0 else None
+    if recentPages is not None :
+        entries = recentPages.iterEntries(entries)
     yield "{{>toc}}"
     yield ""
     yield "h1. %s" % (topicParentPage,)
@@ -162,8 +96,20 @@ def iterGlobaleTopicIndexLines(redmineHandle, topicParentPage, **keywords) :
     yield "h2. In diesem Projekt und Unterprojekten"
     yield ""
 
+    for line in iterTopicEntryLines(iterSortedTopicEntries(entries)) :
+        yield line
+    if recentPages is not None :
+        for line in iterRecentPagesLines(recentPages.getEntries()) :
+            yield line
+
+def iterTopicEntryLines(entries) :
+    """
+    Renders one list item per entry below a heading per first letter.
+
+    @param entries: Entries like those of L{iterTopicEntries}, sorted by title
+    """
     letterHeading = None
-    for entry in sorted(iterTopicEntries(redmineHandle, topicParentPage, **keywords)) :
+    for entry in entries :
         prettyPageTitle = entry[0]
         projectIdent = entry[1]
         projectBreadcrumbTrail = entry[2]
@@ -181,64 +127,154 @@ def iterGlobaleTopicIndexLines(redmineHandle, topicParentPage, **keywords) :
             yield ""
             letterHeading = firstLetter
         indent = "*"
-        yield "%(indent)s [[%(projectIdent)s:%(prettyPageTitle)s]] (%(projectBreadcrumbTrail)s) (zuletzt geändert am %(updatedOnDate)s von %(pageAuthor)s) " % locals()
+        if pageAuthor is None :
+            yield "%(indent)s [[%(projectIdent)s:%(prettyPageTitle)s]] (%(projectBreadcrumbTrail)s) (zuletzt geändert am %(updatedOnDate)s) " % locals()
+        else :
+            yield "%(indent)s [[%(projectIdent)s:%(prettyPageTitle)s]] (%(projectBreadcrumbTrail)s) (zuletzt geändert am %(updatedOnDate)s von %(pageAuthor)s) " % locals()
 
 
 def iterTopicEntries(redmineHandle, topicParentPage, **keywords) :
-    printProgress = keywords.get('printProgress', False)
-    baseURL = redmineHandle.url
-    r = redmineHandle
+    mirror = keywords.get('mirror', None)
+    if mirror is not None :
+        entries = iterTopicEntriesFromMirror(mirror, topicParentPage, not keywords.get('noAuthor', False),
+                                             keywords.get('profiler', NULL_PROFILER))
+        for entry in entries :
+            yield entry
+        return
 
+    (projectTree, projectPages) = crawlTopicIndex(redmineHandle, topicParentPage, **keywords)
+    for entry in iterTopicEntriesFromPages(projectTree, projectPages, topicParentPage, **keywords) :
+        yield entry
 
-    allProjects = r.project.all()
-    projectCount = len(allProjects)
-    if projectCount == 0 :
-        return
+def crawlTopicIndex(redmineHandle, topicParentPage, **keywords) :
+    """
+    Fetches the projects and, lazily, their wiki pages with the authors of
+    the pages below the topic page.
 
-    projectTree = ProjectTree(allProjects)
+    Takes the same keywords as L{iterGlobaleTopicIndexLines}.
+
+    @return: (projectTree, iterator over (project, allPages))
+    """
+    mirror = keywords.get('mirror', None)
+    if mirror is not None :
+        projectTree = mirror.getProjectTree()
+        return (projectTree, mirror.iterProjectPages(projectTree))
+
+    # only the pages below the topic page show their authors
+    detailFilter = lambda allPages : selectTopicPages(allPages, topicParentPage)
+    return crawlProjectPages(redmineHandle, detailFilter = detailFilter, **keywords)
+
+def getTopicEntrySortKey(entry) :
+    """
+    A page title is unique within its project and the project identifier
+    is unique, so this key orders the entries exactly like the whole tuple.
+    """
+    return entry[:2] # (prettyPageTitle, projectIdent)
+
+def iterSortedTopicEntries(entries) :
+    """
+    Sorts the entries of L{iterTopicEntriesFromPages} without holding them all in memory.
+
+    The entries of each project are sorted on their own and spilled to a
+    temporary file; the runs are then merged lazily.
+    """
+    runs = SortedRuns(getTopicEntrySortKey)
+    try :
+        for (projectIdent, projectEntries) in itertools.groupby(entries, operator.itemgetter(1)) :
+            runs.addRun(projectEntries)
+        for entry in runs :
+            yield entry
+    finally :
+        runs.close()
+
+def selectTopicPages(allPages, topicParentPage) :
+    """
+    Selects the pages below the topic page of a single project.
+
+    Projects without a page titled C{topicParentPage} cost a single scan
+    over the titles; otherwise only the topic subtree is walked.
+
+    @param topicParentPage: UTF-8 encoded title of the topic page, with spaces or underscores
+    @return: [page, ...] below the topic page, not including it
+    """
+    topicTitle = topicParentPage.replace(' ', '_')
+    topicPages = [page for page in allPages if page.title.replace(' ', '_') == topicTitle]
+    if not topicPages :
+        return []
+
+    childIndex = PageChildIndex(allPages)
+    selectedPages = []
+    selectedTitles = set()
+    for topicPage in topicPages :
+        for page in childIndex.iterDescendants(topicPage) :
+            if page.title not in selectedTitles :
+                selectedTitles.add(page.title)
+                selectedPages.append(page)
+    return selectedPages
+
+def iterTopicEntriesFromPages(projectTree, projectPages, topicParentPage, **keywords) :
+    """
+    Collects the pages below C{topicParentPage} from already fetched wiki pages.
+
+    @param projectPages: (project, allPages) pairs in the order of C{projectTree.iter_dfs()}
+    @return: iterator over (prettyPageTitle, projectIdent, projectBreadcrumbTrail,
+             pageAuthor, pageUpdatedOn, pageCreatedOn)
+    """
+    printProgress = keywords.get('printProgress', False)
+    profiler = keywords.get('profiler', NULL_PROFILER)
+    progress = ProgressReporter(len(projectTree))
 
     FIRST_TIME = True
 
-    for (projNum, project) in enumerate(projectTree.iter_dfs()) :
+    for (projNum, (project, allPages)) in enumerate(projectPages) :
         projectBreadcrumbTrail = " » ".join(projectTree.getBreadcrumbTrail(project))
         pid = project.id # numeric
-        projectIdent = project.identifier.encode('utf-8', 'ignore') # symbolic
+        projectIdent = project.identifier # symbolic
         pname = project.name
 
         # singlePage = r.wiki_page.get('Mitarbeiter', project_id = PID)
         # yield singlePage.text
 
-        allPagesQuery =  r.wiki_page.filter(project_id = pid)
-        try :
-            allPages = list(allPagesQuery)
-        except redmine_exceptions.ForbiddenError :
-            #print "Cannot access pages of project '%(pident)s'!" % locals()
-            allPages = []
         if len(allPages) > 0 :
             if printProgress :
-                print "%i/%i:" %(projNum+1, projectCount),
+                progress.report(projNum+1, len(allPages))
             if FIRST_TIME :
                 FIRST_TIME = False
 
-            pageTree = PageTree(project, allPages)
-            for (pageNum,page) in enumerate(pageTree.iter_dfs()) :
-                if printProgress :
-                    print ".",
-
-                pageTitle = page.title.encode('utf-8', 'ignore')
+            with profiler.phase('topic subtree') :
+                topicPages = selectTopicPages(allPages, topicParentPage)
+            for page in topicPages :
+                pageTitle = page.title
                 prettyPageTitle = pageTitle.replace('_', ' ')
-                pageAuthor = page.author.name.encode('utf-8', 'ignore')
+                pageAuthor = page.author_name
                 pageCreatedOn = page.created_on
                 pageUpdatedOn = page.updated_on
-                pageBreadcrumbTrail = pageTree.getBreadcrumbTrail(page)[:-1]
+                yield (prettyPageTitle, projectIdent, projectBreadcrumbTrail, pageAuthor, pageUpdatedOn, pageCreatedOn)
 
-                if topicParentPage in pageBreadcrumbTrail :
-                    indent = "*"
-                    yield (prettyPageTitle, projectIdent, projectBreadcrumbTrail, pageAuthor, pageUpdatedOn, pageCreatedOn)
-                    # yield "%(indent)s %(pageTitle)s (von %(pageAuthor)s) -> %(ancestors)r" % locals()
+def iterTopicEntriesFromMirror(mirror, topicParentPage, withAuthor = True, profiler = NULL_PROFILER) :
+    """
+    Collects the pages below C{topicParentPage} with a single query of the mirror.
 
-            if printProgress :
-                print ""
+    @type  mirror: L{WikiMirror}
+    @param withAuthor: Show the author names stored in the mirror
+    @return: iterator over entries like L{iterTopicEntriesFromPages}, grouped by project
+    """
+    with profiler.phase('project tree') :
+        projectTree = mirror.getProjectTree()
+    projectsById = dict((project.id, project) for project in projectTree.iter_dfs())
+    breadcrumbTrails = {} # project id -> breadcrumb trail
+
+    with profiler.phase('topic subtree') :
+        topicPages = list(mirror.iterTopicPages(topicParentPage))
+    for (projectId, page) in topicPages :
+        project = projectsById[projectId]
+        projectBreadcrumbTrail = breadcrumbTrails.get(projectId)
+        if projectBreadcrumbTrail is None :
+            projectBreadcrumbTrail = " » ".join(projectTree.getBreadcrumbTrail(project))
+            breadcrumbTrails[projectId] = projectBreadcrumbTrail
+        prettyPageTitle = page.title.replace('_', ' ')
+        pageAuthor = page.author_name if withAuthor else None
+        yield (prettyPageTitle, project.identifier, projectBreadcrumbTrail, pageAuthor, page.updated_on, page.created_on)
 
 #---
 class CLI(object) :
@@ -265,6 +301,15 @@ class CLI(object) :
         parser.add_argument("--topicparentpage",
                             help = "Name of the parent page whose child pages should be collected.",
                             default = "")
+        parser.add_argument("--no-author", dest = "noauthor", action = "store_true",
+                            help = "Do not fetch page details; the index shows no author names")
+        parser.add_argument("--mirror",
+                            help = "Render from the SQLite mirror written by wiki_mirror.py instead of crawling Redmine",
+                            default = None)
+        addCrawlArguments(parser)
+        addCheckpointArguments(parser)
+        addExportArguments(parser)
+        addRecentArguments(parser)
 
         return parser
 
@@ -296,6 +341,76 @@ class CLI(object) :
         """Pages with this parent page will be listet on the target page."""
         return self._args.topicparentpage.replace('_', ' ')
 
+    def getWorkers(self) :
+        """Number of concurrent wiki page requests."""
+        return max(self._args.workers, 1)
+
+    def isAuthorOmitted(self) :
+        """True if no page details should be fetched."""
+        return self._args.noauthor
+
+    def getCachePath(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.cache
+
+    def getProfilePath(self) :
+        """
+        @return: None, '-' for a summary on stderr or the path of a JSON report
+        """
+        return self._args.profile
+
+    def getBackend(self) :
+        """Name of the crawl backend."""
+        return self._args.backend
+
+    def getPageSize(self) :
+        """Number of projects per listing request."""
+        return max(self._args.pagesize, 1)
+
+    def getRetries(self) :
+        """Retries of requests failing with a transient error."""
+        return max(self._args.retries, 0)
+
+    def getNegativeTTL(self) :
+        """Seconds projects without accessible wiki pages are skipped."""
+        return self._args.negativettl * 3600
+
+    def isRefreshForced(self) :
+        """True if projects skipped in earlier runs should be checked again."""
+        return self._args.refresh
+
+    def getMirrorPath(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.mirror
+
+    def isResuming(self) :
+        """True if the crawl should continue from the checkpoint of an interrupted run."""
+        return self._args.resume
+
+    def getTimeBudget(self) :
+        """
+        @return: Seconds the crawl may take or None
+        """
+        return self._args.timebudget * 60 if self._args.timebudget is not None else None
+
+    def getExportFormat(self) :
+        """
+        @return: None or the JSON format of the export mode
+        """
+        return self._args.export
+
+    def getOutputPath(self) :
+        """Path of the export, '-' for stdout."""
+        return self._args.output
+
+    def getRecentCount(self) :
+        """Number of recently changed pages listed at the end, 0 for none."""
+        return max(self._args.recent, 0)
+
 #---
 def main() :
     cli = CLI()
@@ -303,32 +418,91 @@ def main() :
     apiKey = cli.getApiKey()
 
     redmineHandle = Redmine(baseURL, key = apiKey)
+    profilePath = cli.getProfilePath()
+    profiler = Profiler() if profilePath else NULL_PROFILER
+    if profilePath :
+        profiler.attach(redmineHandle)
     topicParentPage = cli.getTopicParentPage()
 
-    allProjects = redmineHandle.project.all()
-    projectCount = len(allProjects)
-    if projectCount == 0 :
-        print "You must provide a VALID Redmine API-Key!"
-        return
+    workers = cli.getWorkers()
+    mirrorPath = cli.getMirrorPath()
+    mirror = WikiMirror(mirrorPath, baseURL) if mirrorPath else None
+    if mirror is not None :
+        # no requests at all until the upload
+        if not mirror.isSynced() :
+            print "The mirror is empty, run wiki_mirror.py first!"
+            return
+        (backend, allProjects) = (None, None)
+    else :
+        backend = createBackend(cli.getBackend(), redmineHandle, workers, pageSize = cli.getPageSize(),
+                                retries = cli.getRetries(), profiler = profiler)
+        if profilePath and backend.session is not None :
+            profiler.attach(backend.session)
+
+        # fetched once: validates the API key and feeds the index
+        allProjects = fetchProjects(backend, profiler)
+        projectCount = len(allProjects)
+        if projectCount == 0 :
+            print "You must provide a VALID Redmine API-Key!"
+            return
 
     targetPage = cli.getTargetPage()
     targetProjectId = cli.getProjectId()
-    print targetProjectId, targetPage
-    if not targetPage or not targetProjectId:
-        lineCount = printGlobalTopicIndex(redmineHandle, topicParentPage)
-    else :
-        pageLines = list(iterGlobaleTopicIndexLines(redmineHandle, topicParentPage, printProgress = True))
-        newText = "\n".join(pageLines)
-        oldPage = redmineHandle.wiki_page.get(targetPage, project_id = targetProjectId)
-        oldText = oldPage.text.encode('utf-8')
-        if oldText != newText :
-            redmineHandle.wiki_page.update(targetPage,
-                                           project_id = targetProjectId,
-                                           title = 'Global index',
-                                           text = newText,
-                                           parent_title ='',
-                                           comments = 'automatisch aktualisiert')
+    cachePath = cli.getCachePath()
+    cache = CrawlCache(cachePath, baseURL) if cachePath else None
+    renderCache = RenderCache(getRenderCachePath(cachePath)) if cachePath else None
+    negativeCache = NegativeCache(getNegativeCachePath(cachePath), baseURL, cli.getNegativeTTL(),
+                                  cli.isRefreshForced()) if cachePath else None
+    noAuthor = cli.isAuthorOmitted()
+    exportFormat = cli.getExportFormat()
+    if not exportFormat :
+        print targetProjectId, targetPage
+    # nothing is published until the crawl finished, possibly over several runs
+    deadline = getDeadline(cli.getTimeBudget())
+    checkpoint = None
+    if mirror is None and (cli.isResuming() or deadline is not None) :
+        checkpointKey = 'topic:%s:%s' % (topicParentPage, noAuthor)
+        checkpoint = CrawlCheckpoint(getCheckpointPath(cachePath or getDefaultCachePath()), baseURL, checkpointKey,
+                                     cli.isResuming())
+    try :
+        if exportFormat :
+            (projectTree, projectPages) = crawlTopicIndex(redmineHandle, topicParentPage, workers = workers,
+                                                          cache = cache, noAuthor = noAuthor, profiler = profiler,
+                                                          backend = backend, projects = allProjects,
+                                                          negativeCache = negativeCache, mirror = mirror,
+                                                          checkpoint = checkpoint, deadline = deadline)
+            exportIndex(baseURL, projectTree, projectPages, exportFormat, cli.getOutputPath(),
+                        pageFilter = lambda allPages : selectTopicPages(allPages, topicParentPage),
+                        withAuthor = not noAuthor, buffered = deadline is not None)
+        elif not targetPage or not targetProjectId:
+            lineCount = printGlobalTopicIndex(redmineHandle, topicParentPage, workers = workers, cache = cache,
+                                              noAuthor = noAuthor, profiler = profiler, backend = backend,
+                                              projects = allProjects, negativeCache = negativeCache, mirror = mirror,
+                                              checkpoint = checkpoint, deadline = deadline,
+                                              recent = cli.getRecentCount())
+        else :
+            pageLines = list(iterGlobaleTopicIndexLines(redmineHandle, topicParentPage, printProgress = True,
+                                                        workers = workers, cache = cache,
+                                                        noAuthor = noAuthor, profiler = profiler, backend = backend,
+                                                        projects = allProjects, negativeCache = negativeCache,
+                                                        mirror = mirror, checkpoint = checkpoint, deadline = deadline,
+                                                        recent = cli.getRecentCount()))
+            newText = "\n".join(pageLines)
+            with profiler.phase('wiki page update') :
+                updateWikiPage(redmineHandle, targetProjectId, targetPage, newText, 'Global index', renderCache)
+            if renderCache is not None :
+                renderCache.save()
+    except TimeBudgetExceeded :
+        checkpoint.close()
+        print >> sys.stderr, "Time budget exhausted after %d projects, continue with --resume" % (len(checkpoint),)
+        if profilePath :
+            profiler.writeReport(profilePath)
+        return
+    if checkpoint is not None :
+        checkpoint.remove()
 
+    if profilePath :
+        profiler.writeReport(profilePath)
     return
 
 if __name__ == '__main__' :
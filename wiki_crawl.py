@@ -0,0 +1,608 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Shared crawling helpers for the wiki index scripts.
+"""
+
+#---
+#--- Python
+import os
+import sys
+import time
+import itertools
+import datetime
+from multiprocessing.pool import ThreadPool
+
+#---
+#--- 3rd party
+from redmine import exceptions as redmine_exceptions
+
+#---
+#--- Local
+from instrumentation import NULL_PROFILER
+from request_scheduler import RequestScheduler, DIRECT_SCHEDULER
+from negative_cache import NegativeCache
+from crawl_checkpoint import TimeBudgetExceeded
+from wiki_tree import ProjectTree
+
+#---
+REDMINE_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+PAGE_SIZE = 100 # default maximum limit accepted by Redmine
+
+def parseDatetime(value) :
+    """
+    @param value: None, datetime or timestamp string as returned by the REST-API
+    """
+    if value is None or isinstance(value, datetime.datetime) :
+        return value
+    return datetime.datetime.strptime(value, REDMINE_DATETIME_FORMAT)
+
+def formatDatetime(value) :
+    """
+    @return: None or the timestamp string L{parseDatetime} reads back
+    """
+    return value.strftime(REDMINE_DATETIME_FORMAT) if value is not None else None
+
+def encodeText(value) :
+    """
+    @param value: None or text as returned by the REST-API
+    @return: None or the UTF-8 encoded byte string
+    """
+    if value is None or isinstance(value, str) :
+        return value
+    return value.encode('utf-8')
+
+def getAttributes(resource) :
+    """
+    Returns the attributes delivered with C{resource}.
+
+    Reading a missing attribute of a resource makes the client library
+    silently reload it from Redmine. The crawl therefore only reads the raw
+    attribute dict. (A plain C{dict(resource)} would look up a C{keys}
+    attribute first and trigger just such a reload.)
+
+    @rtype: dict
+    """
+    return dict(iter(resource))
+
+#---
+class ProjectRecord(object) :
+    """
+    Metadata of a project as used by L{ProjectTree} and the renderers.
+
+    Name and identifier are UTF-8 encoded byte strings.
+    """
+    __slots__ = ('id', 'parent_id', 'name', 'identifier', 'updated_on')
+
+    def __init__(self, id, parent_id, name, identifier, updated_on) :
+        self.id = id
+        self.parent_id = parent_id
+        self.name = name
+        self.identifier = identifier
+        self.updated_on = updated_on
+
+    @classmethod
+    def fromAttributes(cls, attributes) :
+        """
+        @param attributes: Project as returned by C{/projects.json}
+        @type  attributes: dict
+        """
+        parent = attributes.get('parent') or {}
+        return cls(attributes['id'], parent.get('id'),
+                   encodeText(attributes['name']), encodeText(attributes['identifier']),
+                   parseDatetime(attributes.get('updated_on')))
+
+    def __repr__(self) :
+        return "<ProjectRecord #%s %r>" % (self.id, self.identifier)
+
+#---
+class PageRecord(object) :
+    """
+    Metadata of a wiki page as used by L{PageTree} and the renderers.
+
+    Title, parent title and author name are UTF-8 encoded byte strings.
+    C{author_name} is None if the details of the page were not fetched.
+    """
+    __slots__ = ('title', 'parent_title', 'author_name', 'created_on', 'updated_on', 'version')
+
+    def __init__(self, title, parent_title, author_name, created_on, updated_on, version) :
+        self.title = title
+        self.parent_title = parent_title
+        self.author_name = author_name
+        self.created_on = created_on
+        self.updated_on = updated_on
+        self.version = version
+
+    @classmethod
+    def fromAttributes(cls, attributes) :
+        """
+        @param attributes: Page as returned by C{/projects/<id>/wiki/index.json}
+                           or C{/projects/<id>/wiki/<title>.json}
+        @type  attributes: dict
+        """
+        parent = attributes.get('parent') or {}
+        author = attributes.get('author') or {}
+        return cls(encodeText(attributes['title']), encodeText(parent.get('title')), encodeText(author.get('name')),
+                   parseDatetime(attributes.get('created_on')),
+                   parseDatetime(attributes.get('updated_on')),
+                   attributes.get('version'))
+
+    def isUnchanged(self, cachedPage) :
+        """
+        @return: True if C{cachedPage} describes the same version of this page
+        """
+        return cachedPage.version == self.version and cachedPage.updated_on == self.updated_on
+
+    def __repr__(self) :
+        return "<PageRecord %r>" % (self.title,)
+
+#---
+def fetchPagedList(requestWindow, container, pageSize = PAGE_SIZE, concurrency = 1) :
+    """
+    Fetches all items of an offset/limit paged listing of the REST-API.
+
+    The first window tells the total count and the limit the server
+    actually applied; the remaining windows are then requested at once by
+    up to C{concurrency} threads.
+
+    @param requestWindow: function(offset, limit) returning the decoded JSON response
+    @param container: Key of the item list in the response, e.g. 'projects'
+    @param pageSize: Requested number of items per window
+    @return: [item, ...] in server order
+    """
+    first = requestWindow(0, pageSize)
+    items = list(first[container])
+    totalCount = first.get('total_count', len(items))
+    windowSize = first.get('limit') or len(items)
+    if not windowSize :
+        return items
+    offsets = range(windowSize, totalCount, windowSize)
+    if not offsets :
+        return items
+
+    fetch = lambda offset : requestWindow(offset, windowSize)[container]
+    if concurrency <= 1 or len(offsets) == 1 :
+        windows = map(fetch, offsets)
+    else :
+        pool = ThreadPool(min(concurrency, len(offsets)))
+        try :
+            windows = pool.map(fetch, offsets)
+        finally :
+            pool.terminate()
+    for window in windows :
+        items.extend(window)
+    return items
+
+def iterIdPagedList(requestWindow, container, pageSize = PAGE_SIZE) :
+    """
+    Streams all items of a listing ordered by id, paged by id instead of offset.
+
+    Each window asks for the items following the last id seen. Items
+    deleted or added meanwhile thus cannot shift a later item out of the
+    listing as with offset paging. Since every window depends on the one
+    before, the windows are requested one after another; only the current
+    window is held in memory.
+
+    @param requestWindow: function(minId, limit) returning the decoded JSON
+                          response with the items whose id is >= minId, ordered by id
+    @param container: Key of the item list in the response, e.g. 'issues'
+    @return: iterator over the items ordered by id
+    """
+    minId = 1
+    while True :
+        response = requestWindow(minId, pageSize)
+        items = response[container]
+        for item in items :
+            yield item
+        windowSize = response.get('limit') or pageSize
+        if len(items) < windowSize :
+            return
+        minId = items[-1]['id'] + 1
+
+#---
+class RedmineBackend(object) :
+    """
+    Crawl backend using the blocking C{redmine.Redmine} client.
+
+    All backends deliver projects and pages as the attribute dicts of the
+    REST-API and raise the exceptions of C{redmine.exceptions}.
+    """
+    session = None # no own HTTP session, see L{RestBackend}
+
+    def __init__(self, redmineHandle, concurrency = 1, pageSize = PAGE_SIZE, scheduler = DIRECT_SCHEDULER) :
+        """
+        @param scheduler: Runs every request, e.g. a L{RequestScheduler}
+        """
+        self._redmine = redmineHandle
+        self._concurrency = concurrency
+        self._pageSize = pageSize
+        self._scheduler = scheduler
+        self.url = redmineHandle.url
+
+    def getProjects(self) :
+        """
+        @return: [attributes, ...] of all projects visible to the API key
+        """
+        # project.all() would page sequentially, so the windows are requested directly
+        url = '%s/projects.json' % (self.url,)
+        requestWindow = lambda offset, limit : self._scheduler.call(self._redmine.request, 'get', url,
+                                                                     params = {'offset' : offset, 'limit' : limit})
+        return fetchPagedList(requestWindow, 'projects', self._pageSize, self._concurrency)
+
+    def iterIssues(self, **filters) :
+        """
+        @param filters: Query parameters of C{/issues.json}, e.g. C{status_id = '*'}
+        @return: iterator over the attributes of the matching issues ordered by id
+        """
+        url = '%s/issues.json' % (self.url,)
+        requestWindow = lambda minId, limit : self._scheduler.call(self._redmine.request, 'get', url,
+                                                                    params = dict(filters, sort = 'id',
+                                                                                  issue_id = '>=%d' % (minId,),
+                                                                                  limit = limit))
+        return iterIdPagedList(requestWindow, 'issues', self._pageSize)
+
+    def getIssueStatuses(self) :
+        """
+        @return: [attributes, ...] of all issue statuses
+        """
+        url = '%s/issue_statuses.json' % (self.url,)
+        return self._scheduler.call(self._redmine.request, 'get', url)['issue_statuses']
+
+    def getWikiIndex(self, projectId) :
+        """
+        @return: [attributes, ...] of all wiki pages of the project
+        @raise ForbiddenError: if the pages cannot be accessed
+        """
+        fetch = lambda : [getAttributes(page) for page in self._redmine.wiki_page.filter(project_id = projectId)]
+        return self._scheduler.call(fetch)
+
+    def getWikiPage(self, projectId, title) :
+        """
+        @return: attributes of the current version of the page including author and text
+        @raise ResourceNotFoundError: if the page does not exist
+        """
+        if isinstance(title, str) :
+            title = title.decode('utf-8')
+        fetch = lambda : getAttributes(self._redmine.wiki_page.get(title, project_id = projectId))
+        return self._scheduler.call(fetch)
+
+def getBackend(redmineHandle, **keywords) :
+    """
+    @keyword backend: Backend to use instead of the Redmine client
+    @return: C{keywords['backend']} or a L{RedmineBackend} for C{redmineHandle}
+    """
+    backend = keywords.get('backend', None)
+    if backend is None :
+        backend = RedmineBackend(redmineHandle)
+    return backend
+
+BACKENDS = ['redmine', 'rest']
+
+DEFAULT_RETRIES = 5
+
+def createBackend(name, redmineHandle, concurrency = 1, verify = True, pageSize = PAGE_SIZE,
+                  retries = DEFAULT_RETRIES, profiler = NULL_PROFILER) :
+    """
+    @param name: One of L{BACKENDS}
+    @param concurrency: Maximum number of parallel requests of the backend
+    @param pageSize: Number of projects requested per listing window
+    @param retries: Number of retries of requests failing with a transient error;
+                    the requests are run by a L{RequestScheduler}
+    """
+    scheduler = RequestScheduler(concurrency, retries, profiler = profiler)
+    if name == 'rest' :
+        from rest_backend import RestBackend
+        return RestBackend(redmineHandle.url, redmineHandle.key, concurrency, verify = verify, pageSize = pageSize,
+                           scheduler = scheduler)
+    return RedmineBackend(redmineHandle, concurrency, pageSize, scheduler)
+
+#---
+def fetchProjects(backend, profiler = NULL_PROFILER) :
+    """
+    @return: [ProjectRecord, ...] of all projects visible to the API key
+    """
+    with profiler.phase('project list') :
+        projects = []
+        projectIds = set()
+        for attributes in backend.getProjects() :
+            # windows fetched concurrently may overlap if projects are added meanwhile
+            if attributes['id'] in projectIds :
+                continue
+            projectIds.add(attributes['id'])
+            projects.append(ProjectRecord.fromAttributes(attributes))
+        return projects
+
+def getProjectList(backend, projects = None, profiler = NULL_PROFILER) :
+    """
+    @param projects: Project list fetched earlier in this run
+    @type  projects: None or [ProjectRecord, ...]
+    @return: C{projects} or the freshly fetched project list
+    """
+    if projects is None :
+        projects = fetchProjects(backend, profiler)
+    return projects
+
+def fetchPageAuthor(backend, project, title, profiler = NULL_PROFILER) :
+    """
+    Fetches the details of a single wiki page.
+
+    @return: Name of the author of the current page version or None
+    """
+    try :
+        with profiler.phase('page details') :
+            attributes = backend.getWikiPage(project.id, title)
+    except redmine_exceptions.ResourceNotFoundError :
+        # deleted since the index was fetched
+        return None
+    return encodeText((attributes.get('author') or {}).get('name'))
+
+def fetchWikiPages(backend, project, cache = None, withAuthor = True, mapFunction = map,
+                   profiler = NULL_PROFILER, detailFilter = None, negativeCache = None) :
+    """
+    Fetches the list of wiki pages of a single project.
+
+    The wiki index delivers everything but the author of a page. Authors
+    are taken from the cache for unchanged pages; with C{withAuthor} the
+    remaining ones are fetched by one detail request per page. A project
+    thus costs one request plus one per new or changed page.
+
+    @param cache: If given, page metadata of unchanged pages is taken from
+                  it and the cache is updated with the fetched pages.
+    @type  cache: None or L{CrawlCache}
+    @param withAuthor: Fetch page details to learn the author names
+    @type  withAuthor: bool
+    @param mapFunction: map() replacement used for the detail requests
+    @param profiler: Records the time spent per phase
+    @param detailFilter: function(allPages) returning the pages whose authors are
+                         needed, default: all pages
+    @param negativeCache: Projects known to have no accessible wiki pages are
+                          skipped without a request; it is updated with the result.
+    @type  negativeCache: None or L{NegativeCache}
+    @return: list of L{PageRecord}, empty if the pages of the project
+             cannot be accessed
+    """
+    if negativeCache is not None and negativeCache.isSkipped(project) :
+        if cache is not None :
+            cache.setPages(project, [])
+        return []
+
+    negativeReason = None
+    try :
+        with profiler.phase('wiki index') :
+            allPages = [PageRecord.fromAttributes(attributes) for attributes in backend.getWikiIndex(project.id)]
+    except redmine_exceptions.ForbiddenError :
+        #print "Cannot access pages of project '%(pident)s'!" % locals()
+        allPages = []
+        negativeReason = NegativeCache.FORBIDDEN
+    except redmine_exceptions.ResourceNotFoundError :
+        # wiki module disabled
+        allPages = []
+        negativeReason = NegativeCache.NOT_FOUND
+    if negativeCache is not None :
+        if negativeReason is None and not allPages :
+            negativeReason = NegativeCache.EMPTY
+        if negativeReason is not None :
+            negativeCache.add(project, negativeReason)
+        else :
+            negativeCache.remove(project)
+
+    cachedPages = cache.getPages(project) if cache is not None else {}
+    withoutAuthor = []
+    for page in allPages :
+        cachedPage = cachedPages.get(page.title)
+        if cachedPage is not None and cachedPage.author_name is not None and page.isUnchanged(cachedPage) :
+            page.author_name = cachedPage.author_name
+        else :
+            withoutAuthor.append(page)
+
+    if withAuthor and withoutAuthor and detailFilter is not None :
+        neededTitles = set(page.title for page in detailFilter(allPages))
+        withoutAuthor = [page for page in withoutAuthor if page.title in neededTitles]
+    if withAuthor and withoutAuthor :
+        fetch = lambda page : fetchPageAuthor(backend, project, page.title, profiler)
+        for (page, authorName) in zip(withoutAuthor, mapFunction(fetch, withoutAuthor)) :
+            page.author_name = authorName
+
+    if cache is not None :
+        cache.setPages(project, allPages)
+    return allPages
+
+def fillPageAuthors(backend, projectPages, cache = None, workers = 1, profiler = NULL_PROFILER,
+                    detailFilter = None) :
+    """
+    Fetches the authors missing from pages crawled without page details,
+    one detail request per page.
+
+    @param projectPages: (project, allPages) pairs; the pages are updated in place
+    @param cache: If given, it is updated with the authors and saved
+    @type  cache: None or L{CrawlCache}
+    @param detailFilter: function(allPages) returning the pages whose authors are
+                         needed, default: all pages
+    """
+    missing = []
+    for (project, allPages) in projectPages :
+        pages = detailFilter(allPages) if detailFilter is not None else allPages
+        missing.extend((project, page) for page in pages if page.author_name is None)
+    if not missing :
+        return
+
+    fetch = lambda item : fetchPageAuthor(backend, item[0], item[1].title, profiler)
+    pool = ThreadPool(min(workers, len(missing))) if workers > 1 else None
+    try :
+        authorNames = pool.map(fetch, missing) if pool is not None else map(fetch, missing)
+    finally :
+        if pool is not None :
+            pool.terminate()
+    for ((project, page), authorName) in zip(missing, authorNames) :
+        page.author_name = authorName
+
+    if cache is not None :
+        with profiler.phase('cache save') :
+            for (project, allPages) in projectPages :
+                cache.setPages(project, allPages)
+            cache.save()
+
+def iterProjectPages(backend, projects, workers = 1, cache = None, withAuthor = True,
+                     profiler = NULL_PROFILER, detailFilter = None, negativeCache = None,
+                     checkpoint = None, deadline = None) :
+    """
+    Iterates over (project, allPages) pairs in the order of C{projects}.
+
+    With more than one worker the page lists and page details are fetched
+    by bounded pools of threads; the results are still yielded in input
+    order. When all projects have been visited the cache is written back;
+    a crawl stopped by the time budget leaves the cache untouched.
+
+    @param workers: Number of concurrent requests
+    @type  workers: int
+    @param cache: Persistent page metadata of earlier runs
+    @type  cache: None or L{CrawlCache}
+    @param withAuthor: Fetch page details to learn the author names
+    @type  withAuthor: bool
+    @param profiler: Records the time spent per phase
+    @param detailFilter: function(allPages) returning the pages whose authors are
+                         needed, default: all pages
+    @param negativeCache: Projects without accessible wiki pages of earlier runs
+    @type  negativeCache: None or L{NegativeCache}
+    @param checkpoint: Projects finished by an interrupted run are taken from it,
+                       every project fetched now is added to it.
+    @type  checkpoint: None or L{CrawlCheckpoint}
+    @param deadline: time.time() value after which no further project is
+                     fetched and L{TimeBudgetExceeded} is raised
+    @type  deadline: None or float
+    """
+    def fetch(project, mapFunction) :
+        if checkpoint is not None :
+            allPages = checkpoint.getPages(project)
+            if allPages is not None :
+                if cache is not None :
+                    cache.setPages(project, allPages)
+                return allPages
+        if deadline is not None and time.time() >= deadline :
+            return None
+        allPages = fetchWikiPages(backend, project, cache, withAuthor, mapFunction, profiler, detailFilter,
+                                  negativeCache)
+        if checkpoint is not None :
+            checkpoint.addPages(project, allPages)
+        return allPages
+
+    if workers <= 1 :
+        for project in projects :
+            allPages = fetch(project, map)
+            if allPages is None :
+                raise TimeBudgetExceeded()
+            yield (project, allPages)
+    else :
+        projects = list(projects)
+        pool = ThreadPool(min(workers, max(len(projects), 1)))
+        detailPool = ThreadPool(workers) if withAuthor else None
+        mapFunction = detailPool.map if withAuthor else map
+        fetchProject = lambda project : fetch(project, mapFunction)
+        try :
+            for (project, allPages) in itertools.izip(projects, pool.imap(fetchProject, projects)) :
+                if allPages is None :
+                    # projects still being fetched are checkpointed until the checkpoint is closed
+                    raise TimeBudgetExceeded()
+                yield (project, allPages)
+        finally :
+            pool.terminate()
+            if detailPool is not None :
+                detailPool.terminate()
+
+    if cache is not None or negativeCache is not None :
+        with profiler.phase('cache save') :
+            if cache is not None :
+                cache.save()
+            if negativeCache is not None :
+                negativeCache.save()
+
+def crawlProjectPages(redmineHandle, **keywords) :
+    """
+    Fetches the projects and, lazily, their wiki pages in depth-first order.
+
+    @keyword workers: Number of projects whose wiki pages are fetched concurrently
+    @type    workers: int
+    @keyword cache: Page metadata of earlier runs
+    @type    cache: None or L{CrawlCache}
+    @keyword noAuthor: If True no page details are fetched
+    @type    noAuthor: bool
+    @keyword profiler: Records requests and the time spent per phase
+    @type    profiler: L{Profiler}
+    @keyword backend: Backend used for the crawl, default: the Redmine client
+    @type    backend: L{RedmineBackend} or L{RestBackend}
+    @keyword projects: Project list fetched earlier in this run, default: fetch it
+    @type    projects: None or [ProjectRecord, ...]
+    @keyword negativeCache: Projects without accessible wiki pages of earlier runs
+    @type    negativeCache: None or L{NegativeCache}
+    @keyword detailFilter: function(allPages) returning the pages whose authors are
+                           needed, default: all pages
+    @keyword checkpoint: Projects finished by an interrupted run; updated during the crawl
+    @type    checkpoint: None or L{CrawlCheckpoint}
+    @keyword deadline: time.time() value at which the crawl stops, see L{iterProjectPages}
+    @type    deadline: None or float
+    @return: (projectTree, iterator over (project, allPages))
+    """
+    r = redmineHandle
+    profiler = keywords.get('profiler', NULL_PROFILER)
+    backend = getBackend(r, **keywords)
+
+    allProjects = getProjectList(backend, keywords.get('projects', None), profiler)
+    if len(allProjects) == 0 :
+        return (ProjectTree([]), iter([]))
+
+    with profiler.phase('project tree') :
+        projectTree = ProjectTree(allProjects)
+
+    workers = keywords.get('workers', 1)
+    cache = keywords.get('cache', None)
+    withAuthor = not keywords.get('noAuthor', False)
+    projectPages = iterProjectPages(backend, projectTree.iter_dfs(), workers = workers, cache = cache,
+                                    withAuthor = withAuthor, profiler = profiler,
+                                    detailFilter = keywords.get('detailFilter', None),
+                                    negativeCache = keywords.get('negativeCache', None),
+                                    checkpoint = keywords.get('checkpoint', None),
+                                    deadline = keywords.get('deadline', None))
+    return (projectTree, projectPages)
+
+def getDefaultCachePath() :
+    """
+    @return: Path of the cache file next to the running script
+    """
+    scriptPath = os.path.abspath(sys.argv[0])
+    return os.path.splitext(scriptPath)[0] + '.cache'
+
+def addCrawlArguments(parser) :
+    """
+    Adds the command line options controlling the crawl to C{parser}.
+    """
+    parser.add_argument("--workers", type = int,
+                        help = "Number of wiki page lists fetched concurrently",
+                        default = 1)
+    parser.add_argument("--cache", nargs = "?", const = getDefaultCachePath(),
+                        help = "Keep page metadata in a cache file (default: next to the script) "
+                               "and only fetch details of pages changed since the last run",
+                        default = None)
+    parser.add_argument("--backend", choices = BACKENDS,
+                        help = "redmine: python-redmine client, rest: pooled keep-alive HTTP session "
+                               "limited to --workers parallel requests",
+                        default = "redmine")
+    parser.add_argument("--negative-ttl", dest = "negativettl", type = float,
+                        help = "With --cache: hours during which projects whose wiki answered 403/404 "
+                               "are skipped; projects with an empty wiki are checked again after "
+                               "one hour at the latest",
+                        default = 24.0)
+    parser.add_argument("--refresh", action = "store_true",
+                        help = "With --cache: check all projects again, ignoring the skipped ones")
+    parser.add_argument("--page-size", dest = "pagesize", type = int,
+                        help = "Number of projects requested per listing request; "
+                               "the server may apply a lower limit",
+                        default = PAGE_SIZE)
+    parser.add_argument("--retries", type = int,
+                        help = "Retries of a request failing with 429, 5xx or a connection error; "
+                               "the number of parallel requests is reduced meanwhile",
+                        default = DEFAULT_RETRIES)
+    parser.add_argument("--profile", nargs = "?", const = "-",
+                        help = "Print request and phase statistics to stderr, or write them as JSON to the given file",
+                        default = None)
+    return parser
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Parsing of the C{[[project:Page]]} links in wiki texts.
+"""
+
+#---
+#--- Python
+import re
+
+#---
+# [[Page]], [[Page|Text]], [[project:Page#Anchor|Text]]; ![[...]] is escaped
+LINK_PATTERN = re.compile(ur'(!?)\[\[([^\]\n|]+)(?:\|[^\]\n]*)?\]\]', re.UNICODE)
+SPACE_PATTERN = re.compile(ur'\s+', re.UNICODE)
+TITLE_DELETED_CHARACTERS = u',./?;|:'
+
+def decodeText(value) :
+    if isinstance(value, str) :
+        return value.decode('utf-8', 'replace')
+    return value
+
+def titleize(title) :
+    """
+    Turns a link target into a page title the way Redmine does.
+
+    @return: unicode title, e.g. u'Foo_bar' for u' foo bar'
+    """
+    title = SPACE_PATTERN.sub(u'_', decodeText(title).strip())
+    title = u''.join(character for character in title if character not in TITLE_DELETED_CHARACTERS)
+    return title[:1].upper() + title[1:]
+
+def getTitleKey(title) :
+    """
+    Redmine finds wiki pages regardless of case.
+
+    @return: UTF-8 encoded key under which links and pages are matched
+    """
+    return titleize(title).lower().encode('utf-8')
+
+def getProjectKey(nameOrIdentifier) :
+    """
+    @return: UTF-8 encoded key of a project as written in a link
+    """
+    return decodeText(nameOrIdentifier).strip().lower().encode('utf-8')
+
+def iterLinks(text, projectIdent) :
+    """
+    Finds the links to wiki pages in C{text}, each once.
+
+    Links to a project without a page and escaped links are skipped.
+
+    @param text: UTF-8 encoded byte string or unicode
+    @param projectIdent: Identifier of the project C{text} belongs to
+    @return: iterator over (projectKey, titleKey, title) with the UTF-8
+             encoded title as written in the link, titleized
+    """
+    seen = set()
+    for match in LINK_PATTERN.finditer(decodeText(text or u'')) :
+        if match.group(1) :
+            continue
+        target = match.group(2)
+        (projectPart, separator, page) = target.partition(u':')
+        if not separator :
+            (projectPart, page) = (projectIdent, target)
+        page = page.split(u'#', 1)[0]
+        title = titleize(page)
+        if not title or not projectPart.strip() :
+            continue
+        link = (getProjectKey(projectPart), title.lower().encode('utf-8'), title.encode('utf-8'))
+        if link[:2] not in seen :
+            seen.add(link[:2])
+            yield link
@@ -0,0 +1,404 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Local SQLite mirror of the project and wiki page metadata.
+
+C{wiki_mirror.py} crawls Redmine like the index scripts do and
+stores the projects and page lists. With C{--mirror} the index scripts
+then render from the file without a single request: the project
+hierarchy and the topic subtrees are resolved by recursive queries.
+"""
+
+#---
+#--- Python
+import os
+import sys
+import time
+import argparse
+import logging
+import sqlite3
+
+#---
+#--- 3rd party
+from redmine import Redmine
+
+#---
+#--- Local
+from wiki_crawl import ProjectRecord, PageRecord, parseDatetime, formatDatetime, fetchProjects, crawlProjectPages, \
+    addCrawlArguments, createBackend, getDefaultCachePath
+from crawl_cache import CrawlCache
+from negative_cache import NegativeCache, getNegativeCachePath
+from instrumentation import Profiler, ProgressReporter, NULL_PROFILER
+from wiki_tree import ProjectTree
+
+# To disable all urllib3 warnings
+import urllib3
+urllib3.disable_warnings()
+
+# To capture warnings to your own log with the logging module
+logging.captureWarnings(True)
+
+#---
+BREADCRUMB_SEPARATOR = '\x1f' # never part of a project name
+
+def getMirrorPath(crawlCachePath) :
+    """
+    @return: Path of the mirror kept next to the crawl cache
+    """
+    return os.path.splitext(crawlCachePath)[0] + '.mirror'
+
+#---
+class MirrorProjectTree(object) :
+    """
+    The project hierarchy as computed by the mirror, with the part of the
+    L{ProjectTree} interface the renderers use.
+    """
+    def __init__(self, rows) :
+        """
+        @param rows: [(ProjectRecord, depth, breadcrumbTrail), ...] in depth first order
+        """
+        self._projects = [project for (project, depth, trail) in rows]
+        self._depths = dict((project.id, depth) for (project, depth, trail) in rows)
+        self._trails = dict((project.id, trail) for (project, depth, trail) in rows)
+
+    def __len__(self) :
+        return len(self._projects)
+
+    def iter_dfs(self) :
+        return iter(self._projects)
+
+    def getDepth(self, project) :
+        return self._depths[project.id]
+
+    def getBreadcrumbTrail(self, project) :
+        return self._trails[project.id]
+
+#---
+class WikiMirror(object) :
+    """
+    Projects and wiki pages as last synced, stored in a SQLite file.
+
+    All strings are stored and returned as UTF-8 encoded byte strings,
+    like the fields of the records.
+    """
+    FORMAT_VERSION = 1
+
+    TABLES = ('meta', 'projects', 'pages')
+
+    SCHEMA = """
+        CREATE TABLE meta (
+            key TEXT PRIMARY KEY,
+            value TEXT);
+        CREATE TABLE projects (
+            id INTEGER PRIMARY KEY,
+            parent_id INTEGER,
+            name TEXT NOT NULL,
+            identifier TEXT NOT NULL,
+            updated_on TEXT,
+            sort_rank INTEGER NOT NULL);
+        CREATE INDEX projects_parent ON projects (parent_id);
+        CREATE TABLE pages (
+            project_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            parent_title TEXT,
+            author_name TEXT,
+            created_on TEXT,
+            updated_on TEXT,
+            version INTEGER,
+            PRIMARY KEY (project_id, title));
+        CREATE INDEX pages_parent ON pages (project_id, parent_title);
+        CREATE INDEX pages_title ON pages (title);
+        """
+
+    # depth first over the projects; siblings are ordered by name like in ProjectTree
+    PROJECT_TREE_QUERY = """
+        WITH RECURSIVE tree (id, depth, path, trail) AS (
+            SELECT id, 1, printf('%08d', sort_rank), name
+            FROM projects
+            WHERE parent_id IS NULL OR parent_id = id OR parent_id NOT IN (SELECT id FROM projects)
+          UNION ALL
+            SELECT child.id, tree.depth + 1, tree.path || printf('%08d', child.sort_rank),
+                   tree.trail || ? || child.name
+            FROM tree JOIN projects AS child ON child.parent_id = tree.id AND child.id != tree.id
+        )
+        SELECT projects.id, projects.parent_id, projects.name, projects.identifier, projects.updated_on,
+               tree.depth, tree.trail
+        FROM tree JOIN projects ON projects.id = tree.id
+        ORDER BY tree.path"""
+
+    # all pages below the topic pages, each once even on parent cycles
+    TOPIC_PAGES_QUERY = """
+        WITH RECURSIVE topic (project_id, title) AS (
+            SELECT child.project_id, child.title
+            FROM pages AS parent
+            JOIN pages AS child ON child.project_id = parent.project_id AND child.parent_title = parent.title
+            WHERE parent.title IN (?, ?) AND child.title != parent.title
+          UNION
+            SELECT child.project_id, child.title
+            FROM topic JOIN pages AS child ON child.project_id = topic.project_id AND child.parent_title = topic.title
+        )
+        SELECT pages.project_id, pages.title, pages.parent_title, pages.author_name,
+               pages.created_on, pages.updated_on, pages.version
+        FROM topic JOIN pages ON pages.project_id = topic.project_id AND pages.title = topic.title
+        WHERE pages.title NOT IN (?, ?)
+        ORDER BY pages.project_id"""
+
+    def __init__(self, path, baseURL) :
+        """
+        @param path: Path of the SQLite file, created if missing
+        """
+        self._baseURL = baseURL
+        self._connection = sqlite3.connect(path)
+        self._connection.text_factory = str
+        if self._getMeta('version') != str(self.FORMAT_VERSION) or self._getMeta('url') != baseURL :
+            self.clear()
+
+    def _getMeta(self, key) :
+        try :
+            row = self._connection.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        except sqlite3.OperationalError :
+            # new file
+            return None
+        return row[0] if row is not None else None
+
+    def clear(self) :
+        """
+        Removes all projects and pages, e.g. after the base URL or the format changed.
+        """
+        with self._connection :
+            for table in self.TABLES :
+                self._connection.execute("DROP TABLE IF EXISTS %s" % (table,))
+            self._connection.executescript(self.SCHEMA)
+            self._connection.executemany("INSERT INTO meta (key, value) VALUES (?, ?)",
+                                         [('version', str(self.FORMAT_VERSION)), ('url', self._baseURL)])
+
+    def close(self) :
+        self._connection.close()
+
+    def isSynced(self) :
+        return self._getMeta('synced') is not None
+
+    def sync(self, projects, projectPages, printProgress = False) :
+        """
+        Replaces the mirrored projects and pages.
+
+        The mirror is only changed if the crawl completes.
+
+        @param projects: [ProjectRecord, ...] in the order returned by Redmine
+        @param projectPages: (project, allPages) pairs
+        @return: Number of mirrored pages
+        """
+        # like ProjectTree: siblings by name, equal names in the order given
+        sortRanks = dict((project.id, rank) for (rank, (name, position, project)) in
+                         enumerate(sorted((project.name, position, project) for (position, project) in enumerate(projects))))
+        progress = ProgressReporter(len(projects))
+        pageCount = 0
+        connection = self._connection
+        with connection :
+            connection.execute("DELETE FROM projects")
+            connection.execute("DELETE FROM pages")
+            connection.executemany("INSERT INTO projects (id, parent_id, name, identifier, updated_on, sort_rank) "
+                                   "VALUES (?, ?, ?, ?, ?, ?)",
+                                   ((project.id, project.parent_id, project.name, project.identifier,
+                                     formatDatetime(project.updated_on), sortRanks[project.id])
+                                    for project in projects))
+            for (projNum, (project, allPages)) in enumerate(projectPages) :
+                connection.executemany("INSERT OR REPLACE INTO pages (project_id, title, parent_title, author_name, "
+                                       "created_on, updated_on, version) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                       ((project.id, page.title, page.parent_title, page.author_name,
+                                         formatDatetime(page.created_on), formatDatetime(page.updated_on),
+                                         page.version) for page in allPages))
+                pageCount += len(allPages)
+                if printProgress and allPages :
+                    progress.report(projNum+1, len(allPages))
+            connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('synced', ?)", (str(time.time()),))
+        return pageCount
+
+    def getProjects(self) :
+        """
+        @return: [ProjectRecord, ...]
+        """
+        return [self._getProject(row) for row in self._connection.execute(
+            "SELECT id, parent_id, name, identifier, updated_on FROM projects ORDER BY sort_rank")]
+
+    def _getProject(self, row) :
+        (projectId, parentId, name, identifier, updatedOn) = row
+        return ProjectRecord(projectId, parentId, name, identifier, parseDatetime(updatedOn))
+
+    def _getPage(self, row) :
+        (title, parentTitle, authorName, createdOn, updatedOn, version) = row
+        return PageRecord(title, parentTitle, authorName, parseDatetime(createdOn), parseDatetime(updatedOn), version)
+
+    def getProjectTree(self) :
+        """
+        @return: L{MirrorProjectTree}, or a L{ProjectTree} if projects are
+                 on a parent cycle the recursive query cannot reach
+        """
+        rows = [(self._getProject(row[:5]), row[5], tuple(row[6].split(BREADCRUMB_SEPARATOR)))
+                for row in self._connection.execute(self.PROJECT_TREE_QUERY, (BREADCRUMB_SEPARATOR,))]
+        projectCount = self._connection.execute("SELECT COUNT(*) FROM projects").fetchone()[0]
+        if len(rows) < projectCount :
+            return ProjectTree(self.getProjects())
+        return MirrorProjectTree(rows)
+
+    def getPages(self, project) :
+        """
+        @return: [PageRecord, ...] of C{project} in the order returned by Redmine
+        """
+        return [self._getPage(row) for row in self._connection.execute(
+            "SELECT title, parent_title, author_name, created_on, updated_on, version FROM pages "
+            "WHERE project_id = ? ORDER BY rowid", (project.id,))]
+
+    def iterProjectPages(self, projectTree) :
+        """
+        @return: iterator over (project, allPages) in the order of C{projectTree.iter_dfs()},
+                 like L{iterProjectPages} of a crawl
+        """
+        for project in projectTree.iter_dfs() :
+            yield (project, self.getPages(project))
+
+    def iterTopicPages(self, topicParentPage) :
+        """
+        Selects the pages below the topic pages of all projects, see L{selectTopicPages}.
+
+        @return: iterator over (projectId, PageRecord) grouped by project
+        """
+        titles = (topicParentPage.replace(' ', '_'), topicParentPage.replace('_', ' '))
+        for row in self._connection.execute(self.TOPIC_PAGES_QUERY, titles + titles) :
+            yield (row[0], self._getPage(row[1:]))
+
+#---
+class CLI(object) :
+    """
+    Encapsulates the Command Line Interface.
+    """
+    def __init__(self) :
+        self._parser = parser = self._createParser()
+        self._args = args = parser.parse_args()
+        if args.apikey is None :
+            print "You must provide a Redmine API-Key as first argument."
+            sys.exit(1)
+            return
+
+    def _createParser(self) :
+        parser = argparse.ArgumentParser()
+        parser.add_argument("--apikey", help = "Valid API-key to use the Python REST-API")
+        parser.add_argument("--mirror",
+                            help = "Path of the mirror (default: next to the cache file)",
+                            default = None)
+        parser.add_argument("--no-author", dest = "noauthor", action = "store_true",
+                            help = "Do not fetch page details; indexes rendered from the mirror show no author names")
+        addCrawlArguments(parser)
+
+        return parser
+
+    def getBaseURL(self) :
+        """
+        Base URL of the Redmine instance.
+        """
+        baseURL = 'https://redmine.itz.uni-halle.de'
+        return baseURL
+
+    def getApiKey(self) :
+        """
+        Valid API-key to use the REST-API of Redmine.
+        """
+        return self._args.apikey
+
+    def getMirrorPath(self) :
+        """
+        Path of the SQLite file of the mirror.
+        """
+        if self._args.mirror :
+            return self._args.mirror
+        return getMirrorPath(self._args.cache or getDefaultCachePath())
+
+    def isAuthorOmitted(self) :
+        """True if no page details should be fetched."""
+        return self._args.noauthor
+
+    def getWorkers(self) :
+        """Number of concurrent wiki page requests."""
+        return max(self._args.workers, 1)
+
+    def getCachePath(self) :
+        """
+        @rtype: None or str
+        """
+        return self._args.cache
+
+    def getProfilePath(self) :
+        """
+        @return: None, '-' for a summary on stderr or the path of a JSON report
+        """
+        return self._args.profile
+
+    def getBackend(self) :
+        """Name of the crawl backend."""
+        return self._args.backend
+
+    def getPageSize(self) :
+        """Number of projects per listing request."""
+        return max(self._args.pagesize, 1)
+
+    def getRetries(self) :
+        """Retries of requests failing with a transient error."""
+        return max(self._args.retries, 0)
+
+    def getNegativeTTL(self) :
+        """Seconds projects without accessible wiki pages are skipped."""
+        return self._args.negativettl * 3600
+
+    def isRefreshForced(self) :
+        """True if projects skipped in earlier runs should be checked again."""
+        return self._args.refresh
+
+#---
+def main() :
+    cli = CLI()
+    baseURL = cli.getBaseURL()
+    apiKey = cli.getApiKey()
+
+    redmineHandle = Redmine(baseURL, key = apiKey)
+    profilePath = cli.getProfilePath()
+    profiler = Profiler() if profilePath else NULL_PROFILER
+    if profilePath :
+        profiler.attach(redmineHandle)
+
+    workers = cli.getWorkers()
+    backend = createBackend(cli.getBackend(), redmineHandle, workers, pageSize = cli.getPageSize(),
+                            retries = cli.getRetries(), profiler = profiler)
+    if profilePath and backend.session is not None :
+        profiler.attach(backend.session)
+
+    allProjects = fetchProjects(backend, profiler)
+    if len(allProjects) == 0 :
+        print "You must provide a VALID Redmine API-Key!"
+        return
+
+    cachePath = cli.getCachePath()
+    cache = CrawlCache(cachePath, baseURL) if cachePath else None
+    negativeCache = NegativeCache(getNegativeCachePath(cachePath), baseURL, cli.getNegativeTTL(),
+                                  cli.isRefreshForced()) if cachePath else None
+    (projectTree, projectPages) = crawlProjectPages(redmineHandle, workers = workers, cache = cache,
+                                                    noAuthor = cli.isAuthorOmitted(), profiler = profiler,
+                                                    backend = backend, projects = allProjects,
+                                                    negativeCache = negativeCache)
+    mirror = WikiMirror(cli.getMirrorPath(), baseURL)
+    try :
+        with profiler.phase('mirror sync') :
+            pageCount = mirror.sync(allProjects, projectPages, printProgress = True)
+    finally :
+        mirror.close()
+    print "%i projects and %i pages mirrored" % (len(allProjects), pageCount)
+
+    if profilePath :
+        profiler.writeReport(profilePath)
+    return
+
+if __name__ == '__main__' :
+    try :
+        main()
+    except KeyboardInterrupt :
+        sys.exit(0)
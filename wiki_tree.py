@@ -0,0 +1,199 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Project and wiki page hierarchies shared by the index scripts.
+"""
+
+#---
+class _Tree(object) :
+    """
+    Node hierarchy built on a child adjacency index keyed by node id.
+
+    Siblings are ordered by name, so the depth first traversal yields the
+    nodes sorted by their breadcrumb trail. Breadcrumb trails are computed
+    once during the traversal and memoized.
+    """
+    def __init__(self, allNodes) :
+        self._nodesById = {} # id -> node
+        self._children = {} # parent id or None -> [child nodes, ...]
+        self._parentIds = {} # id -> parent id or None
+        self._trails = {} # id -> (..., parentName, name)
+
+        allNodes = list(allNodes)
+        for node in allNodes :
+            self._nodesById[self._getId(node)] = node
+
+        for node in allNodes :
+            nodeId = self._getId(node)
+            parentId = self._getParentId(node)
+            if parentId not in self._nodesById or parentId == nodeId :
+                # parent not visible -> treat the node as root
+                parentId = None
+            self._parentIds[nodeId] = parentId
+            self._children.setdefault(parentId, []).append(node)
+
+        for children in self._children.itervalues() :
+            children.sort(key = self._getName)
+
+        self._nodes = []
+        self._visit(self._children.get(None, []), ())
+        if len(self._nodes) < len(self._nodesById) :
+            # nodes on a parent cycle are not reachable from any root
+            for node in allNodes :
+                if self._getId(node) not in self._trails :
+                    self._visit([node], ())
+
+    def _visit(self, roots, rootTrail) :
+        stack = [(node, rootTrail) for node in reversed(roots)]
+        while stack :
+            (node, parentTrail) = stack.pop()
+            nodeId = self._getId(node)
+            if nodeId in self._trails :
+                continue
+            trail = parentTrail + (self._getName(node),)
+            self._trails[nodeId] = trail
+            self._nodes.append(node)
+            for child in reversed(self._children.get(nodeId, [])) :
+                stack.append((child, trail))
+
+    def _getId(self, node) :
+        raise NotImplementedError
+
+    def _getParentId(self, node) :
+        raise NotImplementedError
+
+    def _getName(self, node) :
+        raise NotImplementedError
+
+    def __len__(self) :
+        return len(self._nodes)
+
+    def iter_dfs(self) :
+        for node in self._nodes :
+            yield node
+
+    def getParent(self, node) :
+        """
+        @return: None or the parent node
+        """
+        parentId = self._parentIds[self._getId(node)]
+        if parentId is None :
+            return None
+        return self._nodesById[parentId]
+
+    def getChildren(self, node) :
+        """
+        @return: [childNode, ...] sorted by name
+        """
+        return list(self._children.get(self._getId(node), []))
+
+    def getDepth(self, node) :
+        """
+        @return: 1 for root nodes, 2 for their children, ...
+        """
+        return len(self._trails[self._getId(node)])
+
+    def getBreadcrumbTrail(self, node, encoding = 'utf-8') :
+        """
+        @return: (..., parentName, name)
+        """
+        if encoding == 'utf-8' :
+            return self._trails[self._getId(node)]
+        return tuple(n.decode('utf-8').encode(encoding) for n in self._trails[self._getId(node)])
+
+    def getAncestors(self, node) :
+        ancestors = []
+        parent = self.getParent(node)
+        while parent is not None :
+            ancestors.append(parent)
+            parent = self.getParent(parent)
+        ancestors.reverse()
+        return ancestors
+
+
+#---
+class ProjectTree(_Tree) :
+    def __init__(self, allProjects ) :
+        _Tree.__init__(self, allProjects)
+
+    def _getId(self, project) :
+        return project.id
+
+    def _getParentId(self, project) :
+        return project.parent_id
+
+    def _getName(self, project) :
+        return project.name
+
+    def getAncestorProjects(self, project) :
+        return self.getAncestors(project)
+
+    def getAncestorsAndProject(self, project) :
+        return self.getAncestors(project) + [project]
+
+
+#---
+class PageTree(_Tree) :
+    """
+    Wiki pages of a single project. Pages are identified by their title.
+    """
+    def __init__(self, project, allPages) :
+        self._project = project
+        self._prettyTrails = {} # title -> (..., parentPage, page) with spaces
+        _Tree.__init__(self, allPages)
+
+    def _getId(self, page) :
+        return page.title
+
+    def _getParentId(self, page) :
+        return page.parent_title
+
+    def _getName(self, page) :
+        return page.title
+
+    def getPrettyBreadcrumbTrail(self, page) :
+        """
+        @return: (..., parentPage, page) with underscores replaced by spaces
+        """
+        title = page.title
+        trail = self._prettyTrails.get(title)
+        if trail is None :
+            trail = tuple(t.replace('_', ' ') for t in self._trails[title])
+            self._prettyTrails[title] = trail
+        return trail
+
+    def getAncestorPages(self, page) :
+        return self.getAncestors(page)
+
+    def getAncestorsAndPage(self, page) :
+        return self.getAncestors(page) + [page]
+
+
+#---
+class PageChildIndex(object) :
+    """
+    Child pages by parent title.
+
+    Cheaper than a L{PageTree} when only the pages below a few pages are
+    needed: no sorting and no breadcrumb trails.
+    """
+    def __init__(self, allPages) :
+        self._children = {} # parent title -> [child pages, ...]
+        for page in allPages :
+            if page.parent_title is not None and page.parent_title != page.title :
+                self._children.setdefault(page.parent_title, []).append(page)
+
+    def iterDescendants(self, page) :
+        """
+        Iterates over all pages below C{page}, each page once even on parent cycles.
+        """
+        seen = set([page.title])
+        stack = list(self._children.get(page.title, []))
+        while stack :
+            child = stack.pop()
+            if child.title in seen :
+                continue
+            seen.add(child.title)
+            yield child
+            stack.extend(self._children.get(child.title, []))
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Writing generated index pages back to the Redmine wiki.
+"""
+
+#---
+#--- Python
+from multiprocessing.pool import ThreadPool
+
+#---
+#--- 3rd party
+from redmine import exceptions as redmine_exceptions
+
+#---
+#--- Local
+from render_cache import getDigest
+
+#---
+def updateWikiPage(redmineHandle, projectId, targetPage, newText, title, renderCache = None, parentTitle = '') :
+    """
+    Replaces the text of C{targetPage} if it differs from C{newText}.
+    Missing pages are created.
+
+    With a C{renderCache} the page is not even downloaded if C{newText} is
+    the text uploaded last time. Manual edits of the page are then only
+    overwritten once the generated text changes.
+
+    @param renderCache: Digests of the texts uploaded earlier
+    @type  renderCache: None or L{RenderCache}
+    @param parentTitle: Title of the parent page, empty for none
+    @return: True if the page was updated
+    """
+    digest = getDigest(newText)
+    if renderCache is not None and renderCache.getUploadDigest(projectId, targetPage) == digest :
+        return False
+
+    try :
+        oldPage = redmineHandle.wiki_page.get(targetPage, project_id = projectId)
+        oldText = oldPage.text.encode('utf-8')
+    except redmine_exceptions.ResourceNotFoundError :
+        # Redmine creates the page on update
+        oldText = None
+    isUpdated = False
+    if oldText != newText :
+        redmineHandle.wiki_page.update(targetPage,
+                                       project_id = projectId,
+                                       title = title,
+                                       text = newText,
+                                       parent_title = parentTitle,
+                                       comments = 'automatisch aktualisiert')
+        isUpdated = True
+    if renderCache is not None :
+        renderCache.setUploadDigest(projectId, targetPage, digest)
+    return isUpdated
+
+def updateWikiPages(redmineHandle, projectId, documents, workers = 1, renderCache = None) :
+    """
+    Updates several wiki pages concurrently, see L{updateWikiPage}.
+
+    @param documents: [(targetPage, title, newText, parentTitle), ...]
+    @param workers: Number of pages written concurrently
+    @return: Number of updated pages
+    """
+    update = lambda (targetPage, title, newText, parentTitle) : \
+        updateWikiPage(redmineHandle, projectId, targetPage, newText, title, renderCache, parentTitle)
+    if workers <= 1 or len(documents) <= 1 :
+        return sum(map(update, documents))
+    pool = ThreadPool(min(workers, len(documents)))
+    try :
+        return sum(pool.map(update, documents))
+    finally :
+        pool.terminate()